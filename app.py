@@ -1,34 +1,59 @@
 import json
 import os
 import sys
+import startup_profiler
+# Профилирование запуска: --profile-startup или ALLMANAGERC_PROFILE_STARTUP=1
+startup_profiler.start()
+startup_profiler.stage('imports')
 from pathlib import Path
 from datetime import date, datetime
 import uuid
-from flask import Flask, render_template, request, redirect, url_for, make_response, send_from_directory, jsonify, flash, abort, session, send_file
-from dotenv import load_dotenv
+from flask import Flask, Request, render_template, request, redirect, url_for, make_response, send_from_directory, jsonify, flash, abort, session, send_file, Response, stream_with_context, g, has_request_context
 from cryptography.fernet import Fernet, InvalidToken
 from werkzeug.utils import secure_filename
-from werkzeug.serving import make_server
-import requests
 from urllib.parse import urlparse
+import ipaddress
+import itertools
+import hashlib
+import hmac
+import mimetypes
+import zipfile
 import copy
+import queue
 import threading
 import subprocess
 import shutil
-import webview
 import signal
 import logging
 import re
 from jinja2 import Environment, FileSystemLoader, select_autoescape
 from jinja2.ext import do as DoExtension
 try:
-    from yubikey_auth import check_internet_connection
+    from yubikey_auth import check_internet_connection, connectivity_monitor
 except Exception:
+    connectivity_monitor = None
     def check_internet_connection(timeout: float = 0.5):
         return False
 import sys
 import socket
 import time
+from change_feed import ChangeFeed, diff_versions, format_sse, RELOAD
+from zip_stream import stream_zip
+from geo_client import GeoLookupClient, GeoLookupError
+from blob_crypto import BlobCryptoError, PlainBlob
+from upload_store import (UploadStore, UploadStoreError, UploadTooLarge, IMAGE_TYPES, DOCUMENT_TYPES,
+                          referenced_names)
+from icon_derivatives import ICON_SIZES, PIL_AVAILABLE, derivative_name, render_derivatives
+from upload_gc import UploadGC
+from backup_store import BackupStore, BackupStoreError, key_fingerprint
+from bulk_import import BulkImportError, detect_format, iter_rows, import_rows
+from merge_engine import MergeEngine, MergeBase, STRATEGIES as MERGE_STRATEGIES
+from delta_sync import (ExportLog, DeltaError, build_delta, build_manifest, apply_delta, parse_payload,
+                        plan_uploads, ensure_uids, new_export_id, PAYLOAD_NAME, MANIFEST_NAME, EXPORT_LOG_NAME)
+from receipts_index import ReceiptsIndex, insert_receipt_sorted, ensure_receipts_order
+import bootstrap
+import metrics
+from wsgi_server import PooledWSGIServer, SENDFILE_ENVIRON_KEY, DEFAULT_WORKERS, DEFAULT_QUEUE_SIZE, DEFAULT_KEEP_ALIVE_TIMEOUT, DEFAULT_IO_TIMEOUT
 
 # Handle Windows console encoding for non-encodable characters (e.g., emojis)
 try:
@@ -40,85 +65,10 @@ try:
 except Exception:
     pass
 
-# Улучшенная загрузка .env файла для работы в дистрибутиве
-def load_env_file():
-    """Загружает .env файл из различных возможных мест."""
-    from pathlib import Path
-    import os
-    
-    # Список возможных путей к .env файлу
-    possible_paths = []
-    
-    # 1. Текущая директория (для разработки)
-    possible_paths.append(Path.cwd() / ".env")
-    
-    # 2. Директория приложения (для дистрибутива)
-    if getattr(sys, 'frozen', False):
-        # Если приложение запаковано
-        if sys.platform == 'darwin':  # macOS
-            # В .app бандле
-            app_bundle = Path(sys.executable).parent.parent.parent
-            possible_paths.append(app_bundle / "Contents" / "Resources" / ".env")
-            # В пользовательской директории
-            user_env = Path.home() / "Library" / "Application Support" / "AllManagerC" / ".env"
-            possible_paths.append(user_env)
-            # В директории приложения
-            app_dir = Path(sys.executable).parent
-            possible_paths.append(app_dir / ".env")
-        elif sys.platform == 'win32':  # Windows
-            # Основной путь для .exe — директория данных пользователя
-            from pathlib import Path as _P
-            possible_paths.append(_P(os.environ.get('APPDATA', str(Path.home()))) / 'AllManagerC' / '.env')
-            # Рядом с исполняемым файлом
-            possible_paths.append(Path(sys.executable).parent / '.env')
-        else:
-            # Linux и др.: ~/.local/share/AllManagerC/.env и рядом с exe
-            possible_paths.append(Path.home() / '.local' / 'share' / 'AllManagerC' / '.env')
-            possible_paths.append(Path(sys.executable).parent / '.env')
-    
-    # 3. Директория скрипта
-    script_dir = Path(__file__).parent
-    possible_paths.append(script_dir / ".env")
-    
-    # 4. Родительская директория
-    parent_dir = Path(__file__).parent.parent
-    possible_paths.append(parent_dir / ".env")
-    
-    # Пытаемся загрузить .env из каждого возможного места
-    for env_path in possible_paths:
-                print(f"🔍 Проверяем путь: {env_path} {'✅' if env_path.exists() else '❌'}")
-                if env_path.exists():
-                    print(f"📁 Найден .env файл: {env_path}")
-                    print(f"📄 Содержимое .env файла:")
-                    try:
-                        with open(env_path, 'r', encoding='utf-8') as f:
-                            content = f.read().strip()
-                            print(f"   {content}")
-                    except Exception as e:
-                        print(f"   ❌ Ошибка чтения файла: {e}")
-                    
-                    load_dotenv(env_path)
-                    
-                    # Проверяем, загрузились ли переменные
-                    static_passwords = os.getenv('YUBIKEY_STATIC_PASSWORDS')
-                    print(f"🔑 YUBIKEY_STATIC_PASSWORDS: {repr(static_passwords)}")
-                    
-                    return True
-    
-    print(f"❌ .env файл не найден в следующих местах:")
-    for path in possible_paths:
-        print(f"   - {path} {'✅' if path.exists() else '❌'}")
-    
-    # Показываем все переменные окружения для отладки
-    print(f"🔍 Все переменные окружения:")
-    for key, value in os.environ.items():
-        if 'YUBIKEY' in key or 'SECRET' in key:
-            print(f"   {key}: {repr(value)}")
-    
-    return False
-
-# Загружаем .env файл
-load_env_file()
+# Загружаем .env один раз (единый список путей, см. bootstrap.env_candidates)
+startup_profiler.stage('env')
+bootstrap.load_env()
+startup_profiler.stage('flask_app')
 
 app = Flask(__name__)
 # Уникальное имя cookie для сессии, чтобы не пересекаться с другими приложениями на 127.0.0.1
@@ -127,6 +77,22 @@ app.config['SESSION_COOKIE_NAME'] = 'allmanagerc_session'
 # Включаем расширение 'do' для использования в шаблонах Jinja2
 app.jinja_env.add_extension(DoExtension)
 
+# --- Метрики запросов (регистрируются первыми, чтобы учитывать и отклонённые запросы) ---
+@app.before_request
+def metrics_request_started():
+    g.metrics_started = time.perf_counter()
+    g.metrics_decrypts = 0
+
+@app.after_request
+def metrics_request_finished(response):
+    started = g.pop('metrics_started', None)
+    if started is not None:
+        endpoint = request.endpoint or 'unmatched'
+        metrics.http_request_duration.observe(time.perf_counter() - started, endpoint=endpoint,
+                                              method=request.method, status=response.status_code)
+        metrics.http_request_decrypts.observe(g.pop('metrics_decrypts', 0), endpoint=endpoint)
+    return response
+
 # Функция для определения директории для хранения данных
 def get_app_data_dir():
     """
@@ -178,10 +144,12 @@ def get_app_data_dir():
     return app_data_dir
 
 # --- НОВАЯ ЛОГИКА ИНИЦИАЛИЗАЦИИ КОНФИГА ---
+startup_profiler.stage('app_data_dir')
 APP_DATA_DIR = get_app_data_dir()
 is_frozen = getattr(sys, 'frozen', False)
 
 # --- ИНИЦИАЛИЗАЦИЯ YubiKey ---
+startup_profiler.stage('init_yubikey_auth')
 try:
     from yubikey_auth import init_yubikey_auth
     # Убеждаемся, что директория существует
@@ -206,6 +174,7 @@ except Exception as e:
     yubikey_auth = None
 
 # Путь к конфигу в директории данных пользователя
+startup_profiler.stage('config_merge')
 user_config_path = Path(APP_DATA_DIR) / 'config.json'
 
 def load_config_from_path(path):
@@ -292,6 +261,8 @@ if 'app_info' not in app.config:
         "developer": "N/A"
     }
 
+startup_profiler.stage('app_setup')
+
 # Добавим фильтр для Jinja2
 def format_datetime_filter(iso_str):
     """Jinja фильтр для форматирования ISO-строки с датой и временем."""
@@ -336,6 +307,183 @@ except ImportError:
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 os.makedirs(os.path.join(APP_DATA_DIR, 'data'), exist_ok=True)
 
+# Ограничения размера загрузок и шифрование (config.json, секция uploads), размеры в МБ
+_upload_settings = app.config.get('uploads') if isinstance(app.config.get('uploads'), dict) else {}
+
+# Иконки и чеки хранятся по SHA-256 содержимого (дубликаты не занимают места)
+# и шифруются ключом хранилища; SECRET_KEY читается при каждом обращении,
+# так как меняется при смене главного ключа
+upload_store = UploadStore(app.config['UPLOAD_FOLDER'], key_provider=lambda: SECRET_KEY,
+                           encrypt=bool(_upload_settings.get('encrypt_at_rest', True)))
+app.config['MAX_CONTENT_LENGTH'] = int(float(_upload_settings.get('max_request_mb', 100)) * 1024 * 1024)
+MAX_ICON_SIZE = int(float(_upload_settings.get('max_icon_mb', 5)) * 1024 * 1024)
+MAX_RECEIPT_SIZE = int(float(_upload_settings.get('max_receipt_mb', 25)) * 1024 * 1024)
+
+
+class UploadRequest(Request):
+    """Файлы из multipart-запросов пишутся сразу во временный файл хранилища загрузок."""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return upload_store.open_spool(max_size=app.config['MAX_CONTENT_LENGTH'])
+
+
+app.request_class = UploadRequest
+
+
+def release_service_uploads(service):
+    """Освобождает иконку и чеки удалённой записи; файл удаляется с последней ссылкой."""
+    for name in referenced_names([service]):
+        upload_store.release(name)
+
+
+def store_service_icon(service, file):
+    """
+    Сохраняет загруженную иконку записи вместе с уменьшенными копиями для карточек.
+    Прежняя иконка (и её копии) освобождается. UploadStoreError — файл слишком
+    большой или не изображение; запись при этом не меняется.
+    """
+    unique_filename = f"{service['id']}_{secure_filename(file.filename)}"
+    old_icon = service.get('icon_filename')
+    upload_store.put(unique_filename, file.stream, max_size=MAX_ICON_SIZE, allowed_types=IMAGE_TYPES)
+    thumbnails = render_derivatives(upload_store.open_blob(unique_filename).read_all())
+    for size in ICON_SIZES:
+        if size in thumbnails:
+            upload_store.put_bytes(derivative_name(unique_filename, size), thumbnails[size])
+        else:
+            # Не изображение или нет Pillow: карточка покажет оригинал, старые копии не нужны
+            upload_store.release(derivative_name(unique_filename, size))
+    service['icon_filename'] = unique_filename
+    if old_icon and old_icon != unique_filename:
+        release_service_uploads({'icon_filename': old_icon})
+
+
+# --- Сборка мусора в хранилище загрузок ---
+_GC_REFERENCES = {'stamp': None, 'names': None}
+
+def _vault_files():
+    """Активный файл данных и остальные .enc в data/ (их можно прикрепить обратно)."""
+    paths = set()
+    data_dir = os.path.join(APP_DATA_DIR, 'data')
+    try:
+        with os.scandir(data_dir) as it:
+            paths.update(e.path for e in it if e.is_file() and e.name.endswith('.enc'))
+    except OSError:
+        pass
+    active = get_active_data_path()
+    if active:
+        paths.add(active)
+    return sorted(paths)
+
+def collect_referenced_uploads():
+    """
+    Имена загрузок, на которые ссылается хотя бы один файл данных или снимок резервной
+    копии. None, если активного файла нет или какой-либо файл данных либо снимок не
+    удаётся прочитать (например, он зашифрован другим ключом): его ссылки неизвестны,
+    поэтому сборщик мусора ничего не удаляет. Ссылки файлов данных кэшируются по
+    отпечаткам файлов.
+    """
+    active = get_active_data_path()
+    if not active or not os.path.exists(active):
+        return None
+    snapshot_names = backup_store.referenced_uploads()
+    if snapshot_names is None:
+        return None
+    paths = _vault_files()
+    stamp = tuple((path, _vault_stat(path)) for path in paths)
+    if _GC_REFERENCES['stamp'] == stamp:
+        return _GC_REFERENCES['names'] | snapshot_names
+    names = set()
+    for path in paths:
+        try:
+            with open(path, 'rb') as f:
+                encrypted_data = f.read()
+            servers = json.loads(fernet.decrypt(encrypted_data).decode('utf-8')) if encrypted_data else []
+        except Exception as e:
+            print(f"⚠️ Сборка мусора загрузок пропущена: не удалось прочитать {os.path.basename(path)} ({e.__class__.__name__})")
+            return None
+        names |= referenced_names(servers)
+    _GC_REFERENCES.update(stamp=stamp, names=names)
+    return names | snapshot_names
+
+upload_gc = UploadGC(upload_store, collect_referenced_uploads,
+                     grace=float(_upload_settings.get('gc_grace_hours', 24)) * 3600,
+                     interval=float(_upload_settings.get('gc_interval_hours', 6)) * 3600,
+                     batch_size=int(_upload_settings.get('gc_batch_size', 200)),
+                     dry_run=bool(_upload_settings.get('gc_dry_run', False)))
+
+# Резервные копии файла данных (перед сменой ключа, импортом, слиянием, восстановлением):
+# снимки с дедупликацией блоков и политикой хранения (config.json, секция backups)
+_backup_settings = app.config.get('backups') if isinstance(app.config.get('backups'), dict) else {}
+backup_store = BackupStore(os.path.join(APP_DATA_DIR, 'data', 'backups'), key_provider=lambda: SECRET_KEY,
+                           keep_last=int(_backup_settings.get('keep_last', 10)),
+                           keep_daily=int(_backup_settings.get('keep_daily', 7)),
+                           keep_weekly=int(_backup_settings.get('keep_weekly', 4)),
+                           max_bytes=(int(float(_backup_settings['max_mb']) * 1024 * 1024)
+                                      if _backup_settings.get('max_mb') else None),
+                           references=referenced_names)
+
+def _snapshot_vault_file(path, reason, created_at=None):
+    """
+    Снимок файла данных в хранилище резервных копий: список записей, если файл
+    расшифровывается текущим ключом, иначе содержимое файла как есть.
+    """
+    with open(path, 'rb') as f:
+        encrypted_data = f.read()
+    try:
+        records = json.loads(fernet.decrypt(encrypted_data).decode('utf-8')) if encrypted_data else []
+    except (InvalidToken, ValueError):
+        records = None
+    if not isinstance(records, list):
+        return backup_store.snapshot(raw=encrypted_data, reason=reason,
+                                     source=os.path.basename(path), created_at=created_at)
+    return backup_store.snapshot(records=records, reason=reason,
+                                 source=os.path.basename(path), created_at=created_at)
+
+def snapshot_active_vault(reason):
+    """Снимок активного файла данных; None, если активного файла нет."""
+    with _VAULT_LOCK:
+        active_file = get_active_data_path()
+        if not active_file or not os.path.exists(active_file):
+            return None
+        return _snapshot_vault_file(active_file, reason)
+
+LEGACY_BACKUP_PREFIXES = ('backup_before_key_change_', 'backup_before_merge_')
+
+def adopt_legacy_backups():
+    """
+    Переносит полные копии backup_before_*.enc из data/ в хранилище резервных копий.
+    Файл удаляется только после проверки, что снимок восстанавливается в то же содержимое.
+    """
+    data_dir = os.path.join(APP_DATA_DIR, 'data')
+    active = get_active_data_path()
+    adopted = 0
+    try:
+        names = sorted(n for n in os.listdir(data_dir) if n.endswith('.enc') and n.startswith(LEGACY_BACKUP_PREFIXES))
+    except OSError:
+        return 0
+    for name in names:
+        path = os.path.join(data_dir, name)
+        if active and os.path.abspath(path) == os.path.abspath(active):
+            continue
+        try:
+            reason = 'key_change' if name.startswith('backup_before_key_change_') else 'before_merge'
+            info = _snapshot_vault_file(path, reason, created_at=datetime.fromtimestamp(os.path.getmtime(path)))
+            _manifest, content = backup_store.restore(info['id'])
+            with open(path, 'rb') as f:
+                original = f.read()
+            if info['kind'] == 'raw':
+                matches = content == original
+            else:
+                matches = content == json.loads(fernet.decrypt(original).decode('utf-8'))
+            if not matches:
+                print(f"⚠️ Снимок {name} не совпал с файлом, файл оставлен")
+                continue
+            os.remove(path)
+            adopted += 1
+        except (OSError, ValueError, InvalidToken, BackupStoreError) as e:
+            print(f"⚠️ Не удалось перенести {name} в хранилище резервных копий: {e}")
+    return adopted
+
 @app.context_processor
 def inject_request():
     return {'request': request}
@@ -361,7 +509,7 @@ def inject_yubikey_status():
                     'available': yubikey_auth is not None,
                     'enabled': yubikey_auth.enabled if yubikey_auth else False,
                     'authenticated': False,  # Безопасное значение вне контекста
-                    'keys_count': len(yubikey_auth.get_keys()) if yubikey_auth else 0
+                    'keys_count': len(yubikey_auth.get_keys()) + len(yubikey_auth.local_keys) if yubikey_auth else 0
                 }
             }
         
@@ -369,7 +517,7 @@ def inject_yubikey_status():
             'available': yubikey_auth is not None,
             'enabled': yubikey_auth.enabled if yubikey_auth else False,
             'authenticated': yubikey_auth.is_authenticated() if yubikey_auth else False,
-            'keys_count': len(yubikey_auth.get_keys()) if yubikey_auth else 0
+            'keys_count': len(yubikey_auth.get_keys()) + len(yubikey_auth.local_keys) if yubikey_auth else 0
         }
         return {'yubikey_status': yubikey_status}
     except Exception as e:
@@ -408,7 +556,8 @@ def enforce_authentication_dynamic():
         allowed_endpoints = {
             'yubikey_login', 'yubikey_instructions', 'yubikey_setup', 'yubikey_remove_key',
             'secret_login', 'change_secret_pin',
-            'static', 'help_page', 'about_page', 'set_clipboard', 'shutdown'
+            'static', 'help_page', 'about_page', 'set_clipboard', 'shutdown',
+            'connectivity_status', 'connectivity_events', 'metrics_endpoint'
         }
         ep = request.endpoint or ''
 
@@ -422,8 +571,8 @@ def enforce_authentication_dynamic():
 
         # Если ключей нет — разрешаем только настройки/мастер и статику
         try:
-            if len(yubikey_auth.get_keys()) == 0:
-                if ep in {'yubikey_setup', 'settings_page', 'static'}:
+            if not yubikey_auth.has_keys():
+                if ep in {'yubikey_setup', 'yubikey_add_local_key', 'settings_page', 'static'}:
                     return None
                 session.pop('yubikey_authenticated', None)
                 return redirect('/yubikey/setup')
@@ -432,42 +581,16 @@ def enforce_authentication_dynamic():
 
         # Для всех остальных: если не аутентифицирован — отправляем на вход
         if ep not in allowed_endpoints and not yubikey_auth.is_authenticated():
+            # JSON API отвечает кодом, а не редиректом на страницу входа
+            if request.path.startswith('/api/'):
+                return jsonify({'error': 'Требуется аутентификация'}), 401
             return redirect('/yubikey/login')
     except Exception:
         return None
 
-# --- NEW, ROBUST LOGIC FOR SECRET_KEY ---
-SECRET_KEY = None
-is_frozen = getattr(sys, 'frozen', False)
-
-if is_frozen:
-    # Если приложение собрано, ищем .env в платформа-зависимых местах
-    try:
-        dotenv_candidates = []
-        if sys.platform == 'win32':
-            # Основное место для Windows: директория данных пользователя
-            dotenv_candidates.append(Path(APP_DATA_DIR) / '.env')
-            # Также пробуем рядом с исполняемым файлом
-            dotenv_candidates.append(Path(sys.executable).parent / '.env')
-        elif sys.platform == 'darwin':
-            base_path = Path(sys.executable).parent.parent / 'Resources'
-            dotenv_candidates.append(base_path / '.env')
-        else:
-            # Linux и другие системы
-            dotenv_candidates.append(Path(APP_DATA_DIR) / '.env')
-            dotenv_candidates.append(Path(sys.executable).parent / '.env')
-        for _p in dotenv_candidates:
-            if _p.exists():
-                load_dotenv(dotenv_path=_p)
-                SECRET_KEY = os.getenv("SECRET_KEY")
-                if SECRET_KEY:
-                    break
-    except Exception:
-        SECRET_KEY = None
-else:
-    # Для разработки, ищем .env в корне проекта
-    load_dotenv()
-    SECRET_KEY = os.getenv("SECRET_KEY")
+# --- SECRET_KEY (переменные .env уже загружены bootstrap.load_env) ---
+startup_profiler.stage('secret_key')
+SECRET_KEY = os.getenv("SECRET_KEY")
 
 # Если ключ не найден, создаем новый
 if not SECRET_KEY:
@@ -495,10 +618,29 @@ if not SECRET_KEY:
 
 fernet = Fernet(SECRET_KEY.encode())
 
+startup_profiler.stage('module_body')
+
+def _record_crypto(op, scope, started):
+    """Учитывает операцию Fernet в метриках (и в счётчике расшифровок текущего запроса)."""
+    metrics.crypto_operations.inc(op=op, scope=scope)
+    metrics.crypto_duration.observe(time.perf_counter() - started, op=op, scope=scope)
+    if op == 'decrypt' and has_request_context():
+        g.metrics_decrypts = g.get('metrics_decrypts', 0) + 1
+
+def _decrypt_field(encrypted_data):
+    started = time.perf_counter()
+    try:
+        return fernet.decrypt(encrypted_data.encode()).decode()
+    finally:
+        _record_crypto('decrypt', 'field', started)
+
 def encrypt_data(data):
     if not data:
         return ""
-    return fernet.encrypt(data.encode()).decode()
+    started = time.perf_counter()
+    result = fernet.encrypt(data.encode()).decode()
+    _record_crypto('encrypt', 'field', started)
+    return result
 
 def decrypt_data(encrypted_data):
     """
@@ -520,7 +662,7 @@ def decrypt_data(encrypted_data):
     # Если данные начинаются с gAAAAA или выглядят как зашифрованные Fernet данные
     if encrypted_data.startswith('gAAAAA') or (len(encrypted_data) > 50 and not ' ' in encrypted_data):
         try:
-            return fernet.decrypt(encrypted_data.encode()).decode()
+            return _decrypt_field(encrypted_data)
         except Exception:
             # Если расшифровка не удалась, возвращаем предупреждение
             return "⚠️ Данные зашифрованы старым ключом"
@@ -538,7 +680,7 @@ def decrypt_data(encrypted_data):
         # Если успешно декодировалось и выглядит как Fernet данные, пытаемся расшифровать
         if len(decoded) >= 57:
             try:
-                return fernet.decrypt(encrypted_data.encode()).decode()
+                return _decrypt_field(encrypted_data)
             except Exception:
                 return "⚠️ Данные зашифрованы старым ключом"
         else:
@@ -573,6 +715,9 @@ def save_app_config():
     with open(config_path, 'w', encoding='utf-8') as f:
         json.dump(config_to_save, f, ensure_ascii=False, indent=2)
 
+    # Смена активного файла (импорт, открепление) — сообщаем открытым окнам
+    check_vault_changes('app')
+
 def get_active_data_path():
     """Возвращает полный путь к активному файлу данных из конфигурации."""
     path = app.config.get('active_data_file')
@@ -628,103 +773,314 @@ def analyze_hosting(ip_info):
 
     return {"text": "ISP/Residential", "quality": "success"}
 
-def load_ai_services():
-    """Загружает и расшифровывает серверы из активного зашифрованного файла."""
+# Поля записи, которые хранятся зашифрованными по отдельности (секция, поле)
+ENCRYPTED_FIELDS = [
+    ('credentials', 'username'),
+    ('credentials', 'password'),
+    ('credentials', 'additional_info'),
+    ('personal_cabinet', 'account_email'),
+    ('ssh_credentials', 'password'),
+    ('ssh_credentials', 'root_password'),
+    ('panel_credentials', 'user'),
+    ('panel_credentials', 'password'),
+    ('hoster_credentials', 'user'),
+    ('hoster_credentials', 'password')
+]
+
+# Блокировка цикла «чтение → изменение → запись» активного файла данных
+_VAULT_LOCK = threading.RLock()
+
+def _read_vault():
+    """
+    Читает и расшифровывает активный файл данных как есть, без полей для UI.
+    Исключения (InvalidToken, JSONDecodeError, OSError) пробрасываются вызывающему.
+    """
     active_file = get_active_data_path()
     if not active_file or not os.path.exists(active_file):
         return []
 
+    with open(active_file, 'rb') as f:
+        encrypted_data = f.read()
+
+    metrics.vault_operations.inc(op='load')
+    metrics.vault_io_bytes.inc(len(encrypted_data), direction='read')
+    if not encrypted_data:
+        return []
+
+    started = time.perf_counter()
+    decrypted_data = fernet.decrypt(encrypted_data)
+    _record_crypto('decrypt', 'vault', started)
+    return json.loads(decrypted_data.decode('utf-8'))
+
+def _strip_ui_fields(server):
+    """Удаляет из записи временные поля, добавленные для отображения."""
+    # Удаляем все временные расшифрованные ключи
+    if 'ssh_credentials' in server:
+        server['ssh_credentials'].pop('password_decrypted', None)
+        server['ssh_credentials'].pop('root_password_decrypted', None)
+    if 'panel_credentials' in server:
+        server['panel_credentials'].pop('user_decrypted', None)
+        server['panel_credentials'].pop('password_decrypted', None)
+    if 'hoster_credentials' in server:
+        server['hoster_credentials'].pop('user_decrypted', None)
+        server['hoster_credentials'].pop('password_decrypted', None)
+    if 'credentials' in server:
+        server['credentials'].pop('username_decrypted', None)
+        server['credentials'].pop('password_decrypted', None)
+        server['credentials'].pop('additional_info_decrypted', None)
+
+    # Удаляем другие временные поля, созданные для UI
+    server.pop('hosting_analysis', None)
+    server.pop('os_icon', None)
+    server.pop('masked_panel_url', None)
+    if 'payment_info' in server:
+        server['payment_info'].pop('formatted_date', None)
+    return server
+
+def _write_vault(servers):
+    """
+    Шифрует и атомарно записывает список записей в активный файл.
+    В отличие от save_ai_services не использует flash и пробрасывает ошибки.
+    """
+    active_file = get_active_data_path()
+    if not active_file:
+        raise RuntimeError('не указан активный файл данных')
+
+    # Постоянный идентификатор записи для разностного экспорта (delta_sync) и порядок чеков
+    # проставляются в записях вызывающего: ответ и ETag строятся по тому же, что сохранено
+    ensure_uids(servers)
+    for server in servers:
+        receipts = (server.get('payment_info') or {}).get('receipts')
+        if isinstance(receipts, list):
+            ensure_receipts_order(receipts)
+    servers_to_save = [_strip_ui_fields(server) for server in copy.deepcopy(servers)]
+    json_string = json.dumps(servers_to_save, ensure_ascii=False, indent=2)
+    started = time.perf_counter()
+    encrypted_data = fernet.encrypt(json_string.encode('utf-8'))
+    _record_crypto('encrypt', 'vault', started)
+
+    with _VAULT_LOCK:
+        # Сначала фиксируем возможные внешние правки, чтобы не выдать их за свои
+        check_vault_changes('external')
+
+        # Пишем во временный файл рядом и подменяем, чтобы не оставить обрезанный файл
+        tmp_path = f"{active_file}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(encrypted_data)
+        os.replace(tmp_path, active_file)
+        metrics.vault_operations.inc(op='save')
+        metrics.vault_io_bytes.inc(len(encrypted_data), direction='write')
+
+        if _VAULT_STATE['tracking']:
+            _publish_versions(active_file, {s.get('id'): _etag_of_clean_record(s) for s in servers_to_save}, 'app')
+
+def _etag_of_clean_record(record):
+    canonical = json.dumps(record, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()[:32]
+
+def compute_record_etag(server):
+    """
+    Возвращает ETag записи (без кавычек): хеш её сохраняемого представления.
+    Секретные поля хешируются в зашифрованном виде, поэтому значение меняется
+    только при реальной записи, а не при каждой расшифровке.
+    """
+    return _etag_of_clean_record(_strip_ui_fields(copy.deepcopy(server)))
+
+# --- Лента изменений записей (для /events) ---
+change_feed = ChangeFeed()
+
+# Последнее известное состояние активного файла: путь, отпечаток stat и версии записей.
+# Отслеживание включается при первой подписке на /events.
+_VAULT_STATE = {'tracking': False, 'primed': False, 'path': None, 'stat': None, 'versions': {}}
+_VAULT_WATCHER = None
+VAULT_WATCH_INTERVAL = 2.0
+
+def _vault_stat(path):
     try:
-        with open(active_file, 'rb') as f:
-            encrypted_data = f.read()
+        st = os.stat(path)
+        return (st.st_mtime_ns, st.st_size)
+    except (OSError, TypeError):
+        return None
+
+def _publish_versions(path, versions, source):
+    """Публикует разницу между известными и новыми версиями записей и запоминает новое состояние."""
+    if _VAULT_STATE['primed']:
+        if _VAULT_STATE['path'] != path:
+            change_feed.publish(RELOAD, source=source)
+        else:
+            for record_id, version, kind in diff_versions(_VAULT_STATE['versions'], versions):
+                change_feed.publish(kind, record_id, version, source=source)
+    _VAULT_STATE.update(primed=True, path=path, stat=_vault_stat(path), versions=versions)
+
+# --- Общий индекс чеков (для /api/receipts) ---
+# Строится из файла данных при первом запросе; add_receipt/delete_receipt обновляют его
+# точечно. Любая другая запись меняет отпечаток файла, и индекс перестраивается лениво.
+receipts_index = ReceiptsIndex()
+
+def _receipts_stamp():
+    path = get_active_data_path()
+    return (path, _vault_stat(path))
+
+def get_receipts_index():
+    """Индекс чеков, соответствующий текущему состоянию активного файла."""
+    with _VAULT_LOCK:
+        stamp = _receipts_stamp()
+        if receipts_index.stamp != stamp:
+            receipts_index.rebuild(_read_vault(), stamp)
+    return receipts_index
+
+def check_vault_changes(source='external'):
+    """
+    Сверяет активный файл с последним известным состоянием и публикует изменения.
+    Вызывается фоновым наблюдателем и перед каждой записью из приложения.
+    """
+    if not _VAULT_STATE['tracking']:
+        return
+    with _VAULT_LOCK:
+        path = get_active_data_path()
+        if _VAULT_STATE['primed'] and path == _VAULT_STATE['path'] and _vault_stat(path) == _VAULT_STATE['stat']:
+            return
+        try:
+            servers = _read_vault()
+        except Exception:
+            # Файл недоступен или записан другим ключом — запоминаем отпечаток, чтобы не читать его повторно
+            _VAULT_STATE.update(stat=_vault_stat(path))
+            return
+        _publish_versions(path, {s.get('id'): compute_record_etag(s) for s in servers}, source)
+
+def _vault_watcher_loop():
+    while True:
+        time.sleep(VAULT_WATCH_INTERVAL)
+        try:
+            check_vault_changes('external')
+        except Exception as e:
+            print(f"⚠️ Ошибка наблюдения за файлом данных: {e}")
+
+def start_vault_watcher():
+    """Включает отслеживание изменений и запускает фоновый поток наблюдения (однократно)."""
+    global _VAULT_WATCHER
+    with _VAULT_LOCK:
+        if _VAULT_WATCHER is not None:
+            return
+        _VAULT_STATE['tracking'] = True
+        check_vault_changes('app')
+        _VAULT_WATCHER = threading.Thread(target=_vault_watcher_loop, name='vault-watcher', daemon=True)
+        _VAULT_WATCHER.start()
+
+def apply_gradient(service, base_color):
+    """Записывает в сервис базовый цвет и автоматически рассчитанный градиент."""
+    service['gradient_color'] = base_color
+    
+    # Автоматическая генерация градиента
+    base_rgb = [
+        int(base_color[1:3], 16),
+        int(base_color[3:5], 16),
+        int(base_color[5:7], 16)
+    ]
+    
+    # Создаем более темный оттенок
+    darker_rgb = [max(0, min(255, int(c * 0.7))) for c in base_rgb]
+    
+    # Преобразуем в hex
+    gradient_color2 = '#{:02x}{:02x}{:02x}'.format(darker_rgb[0], darker_rgb[1], darker_rgb[2])
+    
+    service['gradient_color1'] = base_color
+    service['gradient_color2'] = gradient_color2
+    service['gradient_css'] = f"linear-gradient(135deg, {service['gradient_color1']} 0%, {service['gradient_color2']} 100%)"
+    return service
+
+def _decorate_server(server, today=None):
+    """Дополняет запись значениями по умолчанию и расшифрованными полями для UI."""
+    today = today or date.today()
+    # Для обратной совместимости добавляем недостающие ключи
+    if 'status' not in server:
+        server['status'] = 'Active' # Статус по умолчанию
+    if 'payment_info' not in server:
+        server['payment_info'] = {}
+    if 'payment_period' not in server['payment_info']:
+        server['payment_info']['payment_period'] = ''
+    if 'panel_credentials' not in server:
+        server['panel_credentials'] = {}
+    if 'hoster_credentials' not in server:
+        server['hoster_credentials'] = {}
+    if 'login_method' not in server.get('hoster_credentials', {}):
+        server['hoster_credentials']['login_method'] = 'password'
+    if 'geolocation' not in server:
+        server['geolocation'] = {}
+    if 'checks' not in server:
+        server['checks'] = {"dns_ok": False, "streaming_ok": False}
+
+    if "ssh_credentials" in server:
+        if 'root_password' not in server['ssh_credentials']:
+            server['ssh_credentials']['root_password'] = ''
+        if 'root_login_allowed' not in server['ssh_credentials']:
+            server['ssh_credentials']['root_login_allowed'] = False
+        server["ssh_credentials"]["password_decrypted"] = decrypt_data(server["ssh_credentials"].get("password", ""))
+        server["ssh_credentials"]["root_password_decrypted"] = decrypt_data(server["ssh_credentials"].get("root_password", ""))
+
+    # Автоматическое обновление статуса на основе даты платежа
+    due_date_str = server.get('payment_info', {}).get('next_due_date')
+    if server.get('status') == 'Active' and due_date_str:
+        try:
+            due_date = datetime.strptime(due_date_str, '%Y-%m-%d').date()
+            if due_date < today:
+                delta = today - due_date
+                if delta.days > 5:
+                    server['status'] = 'Удален'
+                else:
+                    server['status'] = 'Приостановлен'
+        except (ValueError, TypeError):
+            pass  # Игнорируем неверный формат даты
+
+    # Анализ хостинга
+    server['hosting_analysis'] = analyze_hosting(server.get('geolocation'))
+
+    # Форматируем дату
+    due_date_str = server.get('payment_info', {}).get('next_due_date')
+    if due_date_str:
+        try:
+            date_obj = datetime.strptime(due_date_str, '%Y-%m-%d').date()
+            day_with_suffix = get_day_with_suffix(date_obj.day)
+            server['payment_info']['formatted_date'] = date_obj.strftime(f'%B {day_with_suffix}, %Y')
+        except (ValueError, TypeError):
+            server['payment_info']['formatted_date'] = due_date_str
+    else:
+        server['payment_info']['formatted_date'] = 'N/A'
 
-        if not encrypted_data:
-            return []
 
-        decrypted_data = fernet.decrypt(encrypted_data)
-        servers = json.loads(decrypted_data.decode('utf-8'))
+    if "ssh_credentials" in server and "password" in server["ssh_credentials"]:
+        pass # Логика перенесена выше для согласованности
+
+    # Расшифровываем данные панели управления
+    if "panel_credentials" in server:
+        server["panel_credentials"]["user_decrypted"] = decrypt_data(server["panel_credentials"].get("user", ""))
+        server["panel_credentials"]["password_decrypted"] = decrypt_data(server["panel_credentials"].get("password", ""))
+
+    # Расшифровываем данные кабинета хостера
+    if "hoster_credentials" in server:
+        server["hoster_credentials"]["user_decrypted"] = decrypt_data(server["hoster_credentials"].get("user", ""))
+        server["hoster_credentials"]["password_decrypted"] = decrypt_data(server["hoster_credentials"].get("password", ""))
+
+    # Расшифровываем основные учетные данные (credentials)
+    if "credentials" in server:
+        server["credentials"]["username_decrypted"] = decrypt_data(server["credentials"].get("username", ""))
+        server["credentials"]["password_decrypted"] = decrypt_data(server["credentials"].get("password", ""))
+        server["credentials"]["additional_info_decrypted"] = decrypt_data(server["credentials"].get("additional_info", ""))
+
+    # Чеки хранятся уже упорядоченными (от новых к старым) — см. add_receipt, _write_vault
+    # и миграцию migrate_receipts_order для файлов прежних версий
+    return server
+
+
+def load_ai_services():
+    """Загружает и расшифровывает серверы из активного зашифрованного файла."""
+    try:
+        servers = _read_vault()
         
         today = date.today()
         # Расшифровываем конфиденциальные данные для отображения
         for server in servers:
-            # Для обратной совместимости добавляем недостающие ключи
-            if 'status' not in server:
-                server['status'] = 'Active' # Статус по умолчанию
-            if 'payment_info' not in server:
-                server['payment_info'] = {}
-            if 'payment_period' not in server['payment_info']:
-                server['payment_info']['payment_period'] = ''
-            if 'panel_credentials' not in server:
-                server['panel_credentials'] = {}
-            if 'hoster_credentials' not in server:
-                server['hoster_credentials'] = {}
-            if 'login_method' not in server.get('hoster_credentials', {}):
-                server['hoster_credentials']['login_method'] = 'password'
-            if 'geolocation' not in server:
-                server['geolocation'] = {}
-            if 'checks' not in server:
-                server['checks'] = {"dns_ok": False, "streaming_ok": False}
-
-            if "ssh_credentials" in server:
-                if 'root_password' not in server['ssh_credentials']:
-                    server['ssh_credentials']['root_password'] = ''
-                if 'root_login_allowed' not in server['ssh_credentials']:
-                    server['ssh_credentials']['root_login_allowed'] = False
-                server["ssh_credentials"]["password_decrypted"] = decrypt_data(server["ssh_credentials"].get("password", ""))
-                server["ssh_credentials"]["root_password_decrypted"] = decrypt_data(server["ssh_credentials"].get("root_password", ""))
-            
-            # Автоматическое обновление статуса на основе даты платежа
-            due_date_str = server.get('payment_info', {}).get('next_due_date')
-            if server.get('status') == 'Active' and due_date_str:
-                try:
-                    due_date = datetime.strptime(due_date_str, '%Y-%m-%d').date()
-                    if due_date < today:
-                        delta = today - due_date
-                        if delta.days > 5:
-                            server['status'] = 'Удален'
-                        else:
-                            server['status'] = 'Приостановлен'
-                except (ValueError, TypeError):
-                    pass  # Игнорируем неверный формат даты
-
-            # Анализ хостинга
-            server['hosting_analysis'] = analyze_hosting(server.get('geolocation'))
-
-            # Форматируем дату
-            due_date_str = server.get('payment_info', {}).get('next_due_date')
-            if due_date_str:
-                try:
-                    date_obj = datetime.strptime(due_date_str, '%Y-%m-%d').date()
-                    day_with_suffix = get_day_with_suffix(date_obj.day)
-                    server['payment_info']['formatted_date'] = date_obj.strftime(f'%B {day_with_suffix}, %Y')
-                except (ValueError, TypeError):
-                    server['payment_info']['formatted_date'] = due_date_str
-            else:
-                server['payment_info']['formatted_date'] = 'N/A'
-
-
-            if "ssh_credentials" in server and "password" in server["ssh_credentials"]:
-                pass # Логика перенесена выше для согласованности
-            
-            # Расшифровываем данные панели управления
-            if "panel_credentials" in server:
-                server["panel_credentials"]["user_decrypted"] = decrypt_data(server["panel_credentials"].get("user", ""))
-                server["panel_credentials"]["password_decrypted"] = decrypt_data(server["panel_credentials"].get("password", ""))
-
-            # Расшифровываем данные кабинета хостера
-            if "hoster_credentials" in server:
-                server["hoster_credentials"]["user_decrypted"] = decrypt_data(server["hoster_credentials"].get("user", ""))
-                server["hoster_credentials"]["password_decrypted"] = decrypt_data(server["hoster_credentials"].get("password", ""))
-
-            # Расшифровываем основные учетные данные (credentials)
-            if "credentials" in server:
-                server["credentials"]["username_decrypted"] = decrypt_data(server["credentials"].get("username", ""))
-                server["credentials"]["password_decrypted"] = decrypt_data(server["credentials"].get("password", ""))
-                server["credentials"]["additional_info_decrypted"] = decrypt_data(server["credentials"].get("additional_info", ""))
-
-            if 'receipts' in server.get('payment_info', {}):
-                # Сортировка чеков по дате загрузки (от новых к старым)
-                server['payment_info']['receipts'].sort(key=lambda r: r.get('upload_date', ''), reverse=True)
+            _decorate_server(server, today)
 
         return servers
     except (FileNotFoundError, json.JSONDecodeError):
@@ -739,41 +1095,15 @@ def save_ai_services(servers):
     active_file = get_active_data_path()
     if not active_file:
         flash('Ошибка: не указан активный файл данных. Сохранение невозможно.', 'danger')
-        return
-
-    # Создаем копию для безопасного сохранения, удаляя временные поля
-    servers_to_save = copy.deepcopy(servers)
-    for server in servers_to_save:
-        # Удаляем все временные расшифрованные ключи
-        if 'ssh_credentials' in server:
-            server['ssh_credentials'].pop('password_decrypted', None)
-            server['ssh_credentials'].pop('root_password_decrypted', None)
-        if 'panel_credentials' in server:
-            server['panel_credentials'].pop('user_decrypted', None)
-            server['panel_credentials'].pop('password_decrypted', None)
-        if 'hoster_credentials' in server:
-            server['hoster_credentials'].pop('user_decrypted', None)
-            server['hoster_credentials'].pop('password_decrypted', None)
-        if 'credentials' in server:
-            server['credentials'].pop('username_decrypted', None)
-            server['credentials'].pop('password_decrypted', None)
-            server['credentials'].pop('additional_info_decrypted', None)
-        
-        # Удаляем другие временные поля, созданные для UI
-        server.pop('hosting_analysis', None)
-        server.pop('os_icon', None)
-        server.pop('masked_panel_url', None)
-        if 'payment_info' in server:
-            server['payment_info'].pop('formatted_date', None)
+        return False
 
     try:
-        json_string = json.dumps(servers_to_save, ensure_ascii=False, indent=2)
-        encrypted_data = fernet.encrypt(json_string.encode('utf-8'))
-        
-        with open(active_file, 'wb') as f:
-            f.write(encrypted_data)
+        with _VAULT_LOCK:
+            _write_vault(servers)
+        return True
     except Exception as e:
         flash(f'Произошла ошибка при сохранении файла: {e}', 'danger')
+        return False
 
 
 def re_encrypt_service_data(service, external_fernet, current_fernet):
@@ -784,21 +1114,7 @@ def re_encrypt_service_data(service, external_fernet, current_fernet):
     """
     service_copy = copy.deepcopy(service)
     
-    # Список полей для перешифровки
-    fields_to_reencrypt = [
-        ('credentials', 'username'),
-        ('credentials', 'password'),
-        ('credentials', 'additional_info'),
-        ('personal_cabinet', 'account_email'),
-        ('ssh_credentials', 'password'),
-        ('ssh_credentials', 'root_password'),
-        ('panel_credentials', 'user'),
-        ('panel_credentials', 'password'),
-        ('hoster_credentials', 'user'),
-        ('hoster_credentials', 'password')
-    ]
-    
-    for section, field in fields_to_reencrypt:
+    for section, field in ENCRYPTED_FIELDS:
         try:
             # Проверяем, существует ли секция и поле
             if section in service_copy and field in service_copy[section]:
@@ -849,7 +1165,7 @@ def generate_search_hints():
     except Exception as e:
         print(f"Ошибка генерации подсказок поиска: {e}")
 
-def migrate_data():
+def migrate_legacy_data():
     """
     Выполняет однократную миграцию из старого формата `servers.json`
     в новый зашифрованный `servers.json.enc`.
@@ -904,7 +1220,8 @@ def migrate_data():
         except Exception as e:
             print(f"Ошибка миграции файла: {e}")
     
-    # Если файл данных не прикреплен или не существует, создаем его
+def ensure_active_data_file():
+    """Создаёт пустой файл данных по умолчанию, если активный файл не прикреплен или отсутствует."""
     active_file = get_active_data_path()
     if not active_file or not os.path.exists(active_file):
         print("Активный файл данных не прикреплен или не существует. Создание файла по умолчанию...")
@@ -928,9 +1245,84 @@ def migrate_data():
             except Exception as e:
                 print(f"Ошибка создания файла данных: {e}")
 
+def migrate_receipts_order():
+    """
+    Упорядочивает чеки «от новых к старым» в файлах данных, записанных до того, как
+    порядок стал поддерживаться при сохранении (add_receipt вставляет чек бинарным
+    поиском и рассчитывает на отсортированный список). Файлы другим ключом пропускаются.
+    Возвращает False, если не удалось обработать активный файл.
+    """
+    active = get_active_data_path()
+    fixed = 0
+    for path in _vault_files():
+        try:
+            with open(path, 'rb') as f:
+                encrypted_data = f.read()
+            servers = json.loads(fernet.decrypt(encrypted_data).decode('utf-8')) if encrypted_data else []
+        except (OSError, InvalidToken, ValueError):
+            if path == active:
+                return False
+            continue
+        if not isinstance(servers, list):
+            continue
+        changed = False
+        for server in servers:
+            payment_info = server.get('payment_info') if isinstance(server, dict) else None
+            receipts = payment_info.get('receipts') if isinstance(payment_info, dict) else None
+            if isinstance(receipts, list) and all(isinstance(r, dict) for r in receipts):
+                changed = ensure_receipts_order(receipts) or changed
+        if not changed:
+            continue
+        try:
+            encrypted_data = fernet.encrypt(json.dumps(servers, ensure_ascii=False, indent=2).encode('utf-8'))
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(encrypted_data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"⚠️ Не удалось упорядочить чеки в {os.path.basename(path)}: {e}")
+            if path == active:
+                return False
+            continue
+        fixed += 1
+    if fixed:
+        print(f"🧾 Упорядочены чеки в файлах данных: {fixed}")
+    return True
+
+def run_startup_migrations():
+    """
+    Выполняет миграции данных один раз: после успешного прохода в директории
+    данных сохраняется маркер версии (bootstrap.MIGRATION_VERSION).
+    Наличие активного файла данных проверяется при каждом запуске.
+    """
+    version = bootstrap.read_migration_version(APP_DATA_DIR)
+    completed = True
+    if version < 1:
+        migrate_legacy_data()
+    ensure_active_data_file()
+    if version < 2:
+        completed = migrate_receipts_order()
+    if version < bootstrap.MIGRATION_VERSION and completed:
+        try:
+            bootstrap.write_migration_version(APP_DATA_DIR)
+        except OSError as e:
+            print(f"⚠️ Не удалось записать маркер миграции: {e}")
+    # Файлы в корне uploads/ (старый формат или скопированные из архива) переносим в хранилище
+    adopted = upload_store.adopt_legacy_files()
+    if adopted:
+        print(f"📦 Перенесено файлов в хранилище загрузок: {adopted}")
+    encrypted = upload_store.encrypt_existing()
+    if encrypted:
+        print(f"🔐 Зашифровано файлов в хранилище загрузок: {encrypted}")
+    # Полные копии backup_before_*.enc из прежних версий переносим в хранилище резервных копий
+    backups = adopt_legacy_backups()
+    if backups:
+        print(f"🗄️ Перенесено резервных копий в хранилище снимков: {backups}")
+
 # Выполняем проверку и миграцию при старте приложения
-migrate_data()
-migrate_data()
+startup_profiler.stage('migrate_data')
+run_startup_migrations()
+startup_profiler.stage('module_body')
 
 # OAuth функции для выбора предпочитаемого метода входа
 def get_all_oauth_methods(service_name):
@@ -1056,14 +1448,32 @@ def encrypt_warning_filter(text):
         return f'<span class="encrypted-data-warning">{text}</span>'
     return text
 
+# Загрузки отдаются с ETag по содержимому: браузер хранит их у себя и сверяет при каждом показе
+# (304 без тела), остальные ответы не кэшируются
+REVALIDATED_ENDPOINTS = {'uploaded_file', 'icon_thumbnail'}
+
 @app.after_request
 def add_security_headers(response):
+    if request.endpoint in REVALIDATED_ENDPOINTS and response.status_code in (200, 206, 304):
+        response.headers['Cache-Control'] = 'private, no-cache'
+        response.headers.add("Access-Control-Allow-Origin", "*")
+        return response
     response.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, max-age=0'
     response.headers['Pragma'] = 'no-cache'
     response.headers['Expires'] = '0'
     response.headers.add("Access-Control-Allow-Origin", "*")
     return response
 
+@app.errorhandler(413)
+def request_too_large(error):
+    """Запрос больше MAX_CONTENT_LENGTH (секция uploads в config.json)."""
+    limit_mb = (app.config.get('MAX_CONTENT_LENGTH') or 0) // (1024 * 1024)
+    message = f'Файл слишком большой (максимум {limit_mb} МБ).'
+    if request.path.startswith('/api/') or '/receipts/' in request.path:
+        return jsonify({'error': message}), 413
+    flash(message, 'danger')
+    return redirect(request.referrer or '/'), 302
+
 @app.errorhandler(500)
 def internal_error(error):
     """Обработчик внутренних ошибок сервера."""
@@ -1072,56 +1482,164 @@ def internal_error(error):
     traceback.print_exc()
     return render_template('error.html', error=error), 500
 
+def get_os_icon(os_name):
+    """Подбирает иконку Bootstrap Icons по названию ОС."""
+    os_lower = (os_name or '').lower()
+    if 'windows' in os_lower:
+        return 'bi-windows'
+    if 'ubuntu' in os_lower:
+        return 'bi-box-seam'
+    if 'debian' in os_lower:
+        return 'bi-box'
+    if 'centos' in os_lower:
+        return 'bi-archive'
+    if 'linux' in os_lower:
+        return 'bi-server'
+    return 'bi-question-circle'
+
+def mask_url_path(url_string):
+    """Скрывает путь и порт URL панели, оставляя схему и хост."""
+    if not url_string or not url_string.strip():
+        return "⚠️ Данные зашифрованы старым ключом"
+    try:
+        parsed = urlparse(url_string)
+        # Отображаем только схему и хост. Добавляем /... если есть путь или порт.
+        display_url = f"{parsed.scheme}://{parsed.hostname}"
+        has_path = parsed.path and parsed.path != '/'
+        has_port = parsed.port is not None
+        if has_path or has_port:
+            display_url += "/..."
+        else:
+            return url_string # Возвращаем как есть, если нечего скрывать
+        return display_url
+    except Exception:
+        return url_string 
+
+def prepare_card(server):
+    """Добавляет поля, которые нужны только шаблону карточки."""
+    server['os_icon'] = get_os_icon(server.get('os', ''))
+    server['masked_panel_url'] = mask_url_path(server.get('panel_url', ''))
+    return server
+
+def card_template_helpers():
+    """Функции, которые шаблон карточки вызывает при рендеринге."""
+    return {
+        'get_oauth_urls': get_oauth_urls,
+        'get_service_specific_oauth': get_service_specific_oauth,
+        'get_selected_oauth_method': get_selected_oauth_method,
+        'get_all_oauth_methods': get_all_oauth_methods
+    }
+
 @app.route('/')
 @yubikey_auth.require_auth if yubikey_auth else (lambda f: f)
 def index():
     servers = load_ai_services()
-    
-    def get_os_icon(os_name):
-        os_lower = os_name.lower()
-        if 'windows' in os_lower:
-            return 'bi-windows'
-        if 'ubuntu' in os_lower:
-            return 'bi-box-seam'
-        if 'debian' in os_lower:
-            return 'bi-box'
-        if 'centos' in os_lower:
-            return 'bi-archive'
-        if 'linux' in os_lower:
-            return 'bi-server'
-        return 'bi-question-circle'
-    
-    def mask_url_path(url_string):
-        if not url_string or not url_string.strip():
-            return "⚠️ Данные зашифрованы старым ключом"
-        try:
-            parsed = urlparse(url_string)
-            # Отображаем только схему и хост. Добавляем /... если есть путь или порт.
-            display_url = f"{parsed.scheme}://{parsed.hostname}"
-            has_path = parsed.path and parsed.path != '/'
-            has_port = parsed.port is not None
-            if has_path or has_port:
-                display_url += "/..."
-            else:
-                return url_string # Возвращаем как есть, если нечего скрывать
-            return display_url
-        except Exception:
-            return url_string 
 
     for server in servers:
-        server['os_icon'] = get_os_icon(server.get('os', ''))
-        server['masked_panel_url'] = mask_url_path(server.get('panel_url', ''))
+        prepare_card(server)
         
     return render_template('index.html', 
                           servers=servers,
-                          get_oauth_urls=get_oauth_urls,
-                          get_service_specific_oauth=get_service_specific_oauth,
-                          get_selected_oauth_method=get_selected_oauth_method,
-                          get_all_oauth_methods=get_all_oauth_methods)
+                          **card_template_helpers())
+
+def _if_range_allows(etag):
+    """If-Range: диапазон отдаётся, только если указан текущий сильный ETag (или заголовка нет)."""
+    header = request.headers.get('If-Range')
+    if not header:
+        return True
+    return bool(etag) and not header.startswith('W/') and request.if_range.etag == etag
+
+def _not_modified(etag):
+    """304, если If-None-Match совпадает с ETag загрузки (файл при этом не открывается), иначе None."""
+    if etag and request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+    return None
+
+def send_blob(blob, filename, mimetype=None, etag=None):
+    """
+    Отдаёт файл из хранилища загрузок потоком, расшифровывая по блокам.
+    etag — SHA-256 содержимого (сильный ETag ответа и проверка If-Range).
+    Поддерживает один диапазон Range (206 / 416); весь файл в память не читается.
+    Незашифрованные файлы отправляются через sendfile, если его поддерживает сервер.
+    """
+    mimetype = mimetype or mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    start, end, status = 0, blob.size, 200
+    if (request.range and request.range.units == 'bytes' and len(request.range.ranges) == 1
+            and _if_range_allows(etag)):
+        bounds = request.range.range_for_length(blob.size)
+        if bounds is None:
+            response = Response(status=416)
+            response.headers['Content-Range'] = f'bytes */{blob.size}'
+            return response
+        start, end = bounds
+        status = 206
+
+    sendfile = request.environ.get(SENDFILE_ENVIRON_KEY)
+    if sendfile and isinstance(blob, PlainBlob):
+        body = sendfile(open(blob.path, 'rb'), start, end - start)
+    else:
+        chunks = blob.iter_range(start, end)
+        try:
+            # Первый блок расшифровываем до отправки заголовков: неверный ключ или подмена дают 500
+            first = next(chunks, b'')
+        except BlobCryptoError as e:
+            print(f"❌ Не удалось расшифровать {filename}: {e}")
+            abort(500)
+        body = itertools.chain((first,), chunks)
+    response = Response(body, status=status, mimetype=mimetype, direct_passthrough=True)
+    response.content_length = end - start
+    if etag:
+        response.set_etag(etag)
+    response.headers['Accept-Ranges'] = 'bytes'
+    if status == 206:
+        response.headers['Content-Range'] = f'bytes {start}-{end - 1}/{blob.size}'
+    return response
+
+def _open_upload(filename):
+    try:
+        blob = upload_store.open_blob(filename)
+    except BlobCryptoError as e:
+        print(f"❌ Не удалось расшифровать {filename}: {e}")
+        abort(500)
+    if blob is None:
+        abort(404)
+    return blob
 
 @app.route('/uploads/<path:filename>')
 def uploaded_file(filename):
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    etag = upload_store.digest(filename)
+    return _not_modified(etag) or send_blob(_open_upload(filename), filename, etag=etag)
+
+@app.route('/uploads/icon/<int:size>/<path:filename>')
+def icon_thumbnail(filename, size):
+    """
+    Уменьшенная копия иконки для карточки. Для иконок, загруженных до появления
+    миниатюр, копии создаются при первом обращении; если изображение нельзя
+    уменьшить (нет Pillow, не картинка), отдаётся оригинал.
+    """
+    if size not in ICON_SIZES:
+        abort(404)
+    thumb_name = derivative_name(filename, size)
+    cached = _not_modified(upload_store.digest(thumb_name))
+    if cached:
+        return cached
+    if not upload_store.exists(thumb_name):
+        if not PIL_AVAILABLE:
+            etag = upload_store.digest(filename)
+            return _not_modified(etag) or send_blob(_open_upload(filename), filename, etag=etag)
+        original = _open_upload(filename).read_all()
+        thumbnails = render_derivatives(original)
+        for thumb_size in ICON_SIZES:
+            # Нечитаемое изображение сохраняется под именами копий как есть (тот же блоб,
+            # места не занимает), чтобы не разбирать его заново при каждом показе
+            upload_store.put_bytes(derivative_name(filename, thumb_size), thumbnails.get(thumb_size, original))
+    etag = upload_store.digest(thumb_name)
+    if etag == upload_store.digest(filename):
+        # Копия совпадает с оригиналом: тип содержимого — по имени оригинала
+        return send_blob(_open_upload(thumb_name), filename, etag=etag)
+    return send_blob(_open_upload(thumb_name), thumb_name, mimetype='image/png', etag=etag)
 
 @app.route('/add', methods=['GET', 'POST'])
 @yubikey_auth.require_auth if yubikey_auth else lambda f: f
@@ -1169,38 +1687,17 @@ def add_service():
         }
 
         # Градиент
-        new_service['gradient_color'] = request.form.get('gradient_color', '#667eea')
-        
-        # Автоматическая генерация градиента
-        base_rgb = [
-            int(new_service['gradient_color'][1:3], 16),
-            int(new_service['gradient_color'][3:5], 16),
-            int(new_service['gradient_color'][5:7], 16)
-        ]
-        
-        # Создаем более темный оттенок
-        darker_rgb = [
-            max(0, min(255, int(base_rgb[0] * 0.7))),
-            max(0, min(255, int(base_rgb[1] * 0.7))),
-            max(0, min(255, int(base_rgb[2] * 0.7)))
-        ]
-        
-        # Преобразуем в hex
-        gradient_color2 = '#{:02x}{:02x}{:02x}'.format(darker_rgb[0], darker_rgb[1], darker_rgb[2])
-        
-        new_service['gradient_color1'] = new_service['gradient_color']
-        new_service['gradient_color2'] = gradient_color2
-        new_service['gradient_css'] = f"linear-gradient(135deg, {new_service['gradient_color1']} 0%, {new_service['gradient_color2']} 100%)"
+        apply_gradient(new_service, request.form.get('gradient_color', '#667eea'))
 
         # Обработка иконки
         if 'icon_filename' in request.files:
             file = request.files['icon_filename']
             if file and file.filename != '':
-                filename = secure_filename(file.filename)
-                # Добавляем ID к имени файла для уникальности
-                unique_filename = f"{new_service_id}_{filename}"
-                file.save(os.path.join(app.config['UPLOAD_FOLDER'], unique_filename))
-                new_service['icon_filename'] = unique_filename
+                # ID в имени файла — для уникальности
+                try:
+                    store_service_icon(new_service, file)
+                except UploadStoreError as e:
+                    flash(f'Иконка не сохранена: {e}', 'warning')
 
         services.append(new_service)
         save_ai_services(services)
@@ -1262,16 +1759,15 @@ def delete_service(service_id):
     service_to_delete = next((s for s in services if s['id'] == service_id_int), None)
     
     if service_to_delete:
-        # Удаление файла иконки, если он есть
-        if service_to_delete.get('icon_filename'):
-            try:
-                os.remove(os.path.join(app.config['UPLOAD_FOLDER'], service_to_delete['icon_filename']))
-            except OSError as e:
-                print(f"Ошибка при удалении иконки: {e}")
-                flash(f"Не удалось удалить файл иконки: {service_to_delete['icon_filename']}", 'warning')
-
         services = [s for s in services if s['id'] != service_id_int]
         save_ai_services(services)
+
+        # Иконка и чеки освобождаются после сохранения; общие с другими записями файлы остаются
+        try:
+            release_service_uploads(service_to_delete)
+        except OSError as e:
+            print(f"Ошибка при удалении файлов записи: {e}")
+            flash('Не удалось удалить файлы записи (иконку или чеки).', 'warning')
         flash('AI-сервис успешно удален.', 'success')
     else:
         flash('AI-сервис не найден.', 'danger')
@@ -1365,44 +1861,16 @@ def edit_service(service_id):
         service['updated_at'] = datetime.now().isoformat()
         
         # Градиент
-        service['gradient_color'] = request.form.get('gradient_color', '#667eea')
-        
-        # Автоматическая генерация градиента
-        base_rgb = [
-            int(service['gradient_color'][1:3], 16),
-            int(service['gradient_color'][3:5], 16),
-            int(service['gradient_color'][5:7], 16)
-        ]
-        
-        # Создаем более темный оттенок
-        darker_rgb = [
-            max(0, min(255, int(base_rgb[0] * 0.7))),
-            max(0, min(255, int(base_rgb[1] * 0.7))),
-            max(0, min(255, int(base_rgb[2] * 0.7)))
-        ]
-        
-        # Преобразуем в hex
-        gradient_color2 = '#{:02x}{:02x}{:02x}'.format(darker_rgb[0], darker_rgb[1], darker_rgb[2])
-        
-        service['gradient_color1'] = service['gradient_color']
-        service['gradient_color2'] = gradient_color2
-        service['gradient_css'] = f"linear-gradient(135deg, {service['gradient_color1']} 0%, {service['gradient_color2']} 100%)"
+        apply_gradient(service, request.form.get('gradient_color', '#667eea'))
         
         # Обработка иконки
         if 'icon_filename' in request.files:
             file = request.files['icon_filename']
             if file and file.filename != '':
-                # Удаляем старую иконку
-                if service.get('icon_filename'):
-                    try:
-                        os.remove(os.path.join(app.config['UPLOAD_FOLDER'], service['icon_filename']))
-                    except OSError:
-                        pass # Игнорируем, если файла нет
-                
-                filename = secure_filename(file.filename)
-                unique_filename = f"{service['id']}_{filename}"
-                file.save(os.path.join(app.config['UPLOAD_FOLDER'], unique_filename))
-                service['icon_filename'] = unique_filename
+                try:
+                    store_service_icon(service, file)
+                except UploadStoreError as e:
+                    flash(f'Иконка не сохранена: {e}', 'warning')
 
         save_ai_services(services)
         flash('AI-сервис успешно обновлен!', 'success')
@@ -1474,7 +1942,12 @@ def add_receipt(service_id):
         timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
         unique_filename = f"{service_id}_{timestamp}_{original_filename}"
         
-        file.save(os.path.join(app.config['UPLOAD_FOLDER'], unique_filename))
+        try:
+            upload_store.put(unique_filename, file.stream, max_size=MAX_RECEIPT_SIZE, allowed_types=DOCUMENT_TYPES)
+        except UploadTooLarge as e:
+            return jsonify({"error": str(e)}), 413
+        except UploadStoreError as e:
+            return jsonify({"error": str(e)}), 400
         
         if 'payment_info' not in service: service['payment_info'] = {}
         if 'receipts' not in service['payment_info']: service['payment_info']['receipts'] = []
@@ -1485,9 +1958,13 @@ def add_receipt(service_id):
             'description': description,
             'upload_date': datetime.now().isoformat()
         }
-        service['payment_info']['receipts'].append(new_receipt)
-        
-        save_ai_services(services)
+        insert_receipt_sorted(service['payment_info']['receipts'], new_receipt)
+
+        with _VAULT_LOCK:
+            index_current = receipts_index.stamp == _receipts_stamp()
+            if save_ai_services(services) and index_current:
+                receipts_index.add(service, new_receipt)
+                receipts_index.stamp = _receipts_stamp()
         
         # Возвращаем добавленный чек с отформатированной датой для UI
         new_receipt['formatted_date'] = datetime.fromisoformat(new_receipt['upload_date']).strftime('%Y-%m-%d %H:%M')
@@ -1515,17 +1992,19 @@ def delete_receipt(service_id, filename):
     if not receipt_to_delete:
         return jsonify({"error": "Чек не найден"}), 404
 
-    # Удаляем файл с диска
-    try:
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        if os.path.exists(filepath):
-            os.remove(filepath)
-    except OSError as e:
-        print(f"Ошибка удаления файла {filepath}: {e}") # Логгируем, но не останавливаем процесс
-
     # Удаляем запись из JSON
     service['payment_info']['receipts'].remove(receipt_to_delete)
-    save_ai_services(services)
+    with _VAULT_LOCK:
+        index_current = receipts_index.stamp == _receipts_stamp()
+        if save_ai_services(services) and index_current:
+            receipts_index.remove(service_id_int, receipt_to_delete)
+            receipts_index.stamp = _receipts_stamp()
+
+    # Освобождаем файл; если то же содержимое используется другим чеком, блоб остаётся
+    try:
+        upload_store.release(filename)
+    except OSError as e:
+        print(f"Ошибка удаления файла {filename}: {e}") # Логгируем, но не останавливаем процесс
     
     return jsonify({"success": True, "message": "Чек удален"})
 
@@ -1533,6 +2012,477 @@ def delete_receipt(service_id, filename):
 
 
 
+# --- JSON API для сервисов (ETag / If-Match, частичные обновления) ---
+
+# Поля, которые API не позволяет менять напрямую. Ссылки на загруженные файлы
+# (иконка, чеки) меняются только через эндпоинты загрузки: иначе запись могла бы
+# сослаться на чужой файл и освободить его при своём удалении
+API_READONLY_FIELDS = {'id', 'uid', 'created_at', 'updated_at', 'gradient_color1', 'gradient_color2', 'gradient_css',
+                       'icon_filename'}
+API_READONLY_PATHS = {'payment_info.receipts'}
+
+# Типы полей записи для проверки данных API; поля вне схемы принимаются как есть
+API_FIELD_TYPES = {
+    'name': str,
+    'service_type': str,
+    'provider': str,
+    'login_url': str,
+    'preferred_oauth_method': str,
+    'status': str,
+    'notes': str,
+    'features': list,
+    'credentials': dict,
+    'subscription': dict,
+    'personal_cabinet': dict,
+    'payment_info': dict,
+    'ssh_credentials': dict,
+    'panel_credentials': dict,
+    'hoster_credentials': dict,
+}
+API_SUBFIELD_TYPES = {
+    'subscription': {
+        'plan_name': str,
+        'cost_monthly': (int, float),
+        'currency': str,
+        'billing_cycle': str,
+        'next_payment_date': str,
+        'auto_renewal': bool,
+        'payment_method': str,
+        'notes': str,
+    },
+    'personal_cabinet': {'dashboard_url': str},
+    'payment_info': {'next_due_date': str, 'payment_period': str},
+}
+_TYPE_NAMES = {str: 'строкой', list: 'списком', dict: 'объектом', bool: 'true/false', (int, float): 'числом'}
+
+_HEX_COLOR_RE = re.compile(r'^#[0-9a-fA-F]{6}$')
+
+def _api_error(message, status):
+    return jsonify({'error': message}), status
+
+def service_to_api(server):
+    """Представление записи для JSON API: секретные поля расшифрованы, UI-поля убраны."""
+    record = _strip_ui_fields(copy.deepcopy(server))
+    for section, field in ENCRYPTED_FIELDS:
+        if isinstance(record.get(section), dict) and field in record[section]:
+            record[section][field] = decrypt_data(record[section][field])
+    return record
+
+def _check_api_type(path, value, expected):
+    # bool — подкласс int, но числом в записи не считается
+    if value is None:
+        return
+    is_number_as_bool = isinstance(value, bool) and expected == (int, float)
+    if is_number_as_bool or not isinstance(value, expected):
+        raise ValueError(f"Поле '{path}' должно быть {_TYPE_NAMES.get(expected, expected)}")
+
+def validate_service_patch(patch):
+    """Проверяет частичное обновление до изменения записи: запрещённые поля и типы значений."""
+    encrypted_sections = {}
+    for section, field in ENCRYPTED_FIELDS:
+        encrypted_sections.setdefault(section, set()).add(field)
+
+    for key, value in patch.items():
+        if key in API_READONLY_FIELDS:
+            raise ValueError(f"Поле '{key}' нельзя изменять")
+        if key == 'gradient_color':
+            continue
+        if value is None and any(path.startswith(f"{key}.") for path in API_READONLY_PATHS):
+            # null удалил бы объект вместе с ссылками на файлы
+            raise ValueError(f"Поле '{key}' нельзя удалить")
+        if key in encrypted_sections and value is not None and not isinstance(value, dict):
+            raise ValueError(f"Поле '{key}' должно быть объектом")
+        _check_api_type(key, value, API_FIELD_TYPES.get(key, object))
+        if key == 'features' and value is not None and not all(isinstance(item, str) for item in value):
+            raise ValueError("Поле 'features' должно быть списком строк")
+        if not isinstance(value, dict):
+            continue
+        for sub_key, sub_value in value.items():
+            path = f"{key}.{sub_key}"
+            if path in API_READONLY_PATHS:
+                raise ValueError(f"Поле '{path}' нельзя изменять")
+            if sub_key in encrypted_sections.get(key, ()):
+                _check_api_type(path, sub_value, str)
+            else:
+                _check_api_type(path, sub_value, API_SUBFIELD_TYPES.get(key, {}).get(sub_key, object))
+
+def apply_service_patch(service, patch):
+    """
+    Применяет частичное обновление (JSON merge patch) к записи на месте.
+    Вложенные объекты объединяются по ключам, null удаляет поле.
+    Шифруются только переданные секретные поля — остальные не перешифровываются.
+    Возвращает список изменённых путей; при недопустимых данных бросает ValueError
+    (до изменения записи).
+    """
+    validate_service_patch(patch)
+    encrypted_sections = {}
+    for section, field in ENCRYPTED_FIELDS:
+        encrypted_sections.setdefault(section, set()).add(field)
+
+    changed = []
+    for key, value in patch.items():
+        if key == 'gradient_color':
+            if not isinstance(value, str) or not _HEX_COLOR_RE.match(value):
+                raise ValueError("gradient_color должен быть в формате #rrggbb")
+            apply_gradient(service, value)
+            changed.append(key)
+            continue
+
+        if isinstance(value, dict):
+            section = service.get(key) if isinstance(service.get(key), dict) else {}
+            for sub_key, sub_value in value.items():
+                if sub_key in encrypted_sections.get(key, ()):
+                    section[sub_key] = encrypt_data(str(sub_value)) if sub_value else ""
+                elif sub_value is None:
+                    section.pop(sub_key, None)
+                else:
+                    section[sub_key] = sub_value
+                changed.append(f"{key}.{sub_key}")
+            service[key] = section
+        elif value is None:
+            service.pop(key, None)
+            changed.append(key)
+        else:
+            service[key] = value
+            changed.append(key)
+    return changed
+
+def _api_record_response(server, status=200):
+    response = jsonify(service_to_api(server))
+    response.status_code = status
+    response.set_etag(compute_record_etag(server))
+    return response
+
+def _parse_iso_date_arg(name):
+    """Дата/время ISO из параметра запроса; None, если параметр не задан. ValueError при неверном формате."""
+    value = request.args.get(name, '').strip()
+    if not value:
+        return None
+    try:
+        datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"Параметр '{name}' должен быть датой ISO (YYYY-MM-DD или YYYY-MM-DDTHH:MM:SS)") from None
+    return value
+
+@app.route('/api/receipts', methods=['GET'])
+@yubikey_auth.require_auth if yubikey_auth else (lambda f: f)
+def api_list_receipts():
+    """
+    Чеки всех сервисов за период: ?from=2024-01-01&to=2024-03-31&service_id=5
+    &limit=100&offset=0&order=desc. Границы включительные, дата без времени покрывает весь день.
+    """
+    try:
+        date_from = _parse_iso_date_arg('from')
+        date_to = _parse_iso_date_arg('to')
+        service_id = request.args.get('service_id', type=int)
+        limit = min(max(request.args.get('limit', 100, type=int), 1), 1000)
+        offset = max(request.args.get('offset', 0, type=int), 0)
+    except ValueError as e:
+        return _api_error(str(e), 400)
+    order = request.args.get('order', 'desc')
+    if order not in ('asc', 'desc'):
+        return _api_error("Параметр 'order' должен быть asc или desc", 400)
+
+    try:
+        index = get_receipts_index()
+    except Exception as e:
+        return _api_error(f'Не удалось прочитать файл данных: {e}', 500)
+    total, items = index.query(date_from, date_to, service_id=service_id, offset=offset, limit=limit,
+                               newest_first=(order == 'desc'))
+    for item in items:
+        item['url'] = url_for('uploaded_file', filename=item['filename'])
+    return jsonify({'total': total, 'offset': offset, 'limit': limit, 'items': items})
+
+@app.route('/api/services', methods=['GET'])
+@yubikey_auth.require_auth if yubikey_auth else (lambda f: f)
+def api_list_services():
+    """Список записей; у каждой в поле _etag указан её текущий ETag."""
+    try:
+        services = _read_vault()
+    except Exception as e:
+        return _api_error(f'Не удалось прочитать файл данных: {e}', 500)
+    items = []
+    for server in services:
+        item = service_to_api(server)
+        item['_etag'] = compute_record_etag(server)
+        items.append(item)
+    return jsonify({'services': items})
+
+@app.route('/api/services', methods=['POST'])
+@yubikey_auth.require_auth if yubikey_auth else (lambda f: f)
+def api_create_service():
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        return _api_error('Ожидается JSON-объект', 400)
+    if not payload.get('name'):
+        return _api_error("Поле 'name' обязательно", 400)
+
+    with _VAULT_LOCK:
+        try:
+            services = _read_vault()
+        except Exception as e:
+            return _api_error(f'Не удалось прочитать файл данных: {e}', 500)
+
+        now = datetime.now().isoformat()
+        new_service = {
+            "id": max((s.get('id', 0) for s in services), default=0) + 1,
+            "created_at": now,
+            "updated_at": now
+        }
+        apply_gradient(new_service, '#667eea')
+        try:
+            apply_service_patch(new_service, payload)
+        except ValueError as e:
+            return _api_error(str(e), 400)
+
+        services.append(new_service)
+        try:
+            _write_vault(services)
+        except Exception as e:
+            return _api_error(f'Ошибка сохранения: {e}', 500)
+
+    response = _api_record_response(new_service, 201)
+    response.headers['Location'] = url_for('api_get_service', service_id=new_service['id'])
+    return response
+
+@app.route('/api/services/<int:service_id>', methods=['GET'])
+@yubikey_auth.require_auth if yubikey_auth else (lambda f: f)
+def api_get_service(service_id):
+    try:
+        services = _read_vault()
+    except Exception as e:
+        return _api_error(f'Не удалось прочитать файл данных: {e}', 500)
+    server = next((s for s in services if s.get('id') == service_id), None)
+    if server is None:
+        return _api_error('Сервис не найден', 404)
+
+    etag = compute_record_etag(server)
+    if request.if_none_match.contains_weak(etag):
+        response = make_response('', 304)
+        response.set_etag(etag)
+        return response
+    return _api_record_response(server)
+
+@app.route('/api/services/<int:service_id>', methods=['PATCH'])
+@yubikey_auth.require_auth if yubikey_auth else (lambda f: f)
+def api_patch_service(service_id):
+    """Частичное обновление записи. Требует If-Match с текущим ETag записи."""
+    if 'If-Match' not in request.headers:
+        return _api_error('Требуется заголовок If-Match', 428)
+    patch = request.get_json(silent=True)
+    if not isinstance(patch, dict):
+        return _api_error('Ожидается JSON-объект', 400)
+
+    with _VAULT_LOCK:
+        try:
+            services = _read_vault()
+        except Exception as e:
+            return _api_error(f'Не удалось прочитать файл данных: {e}', 500)
+        server = next((s for s in services if s.get('id') == service_id), None)
+        if server is None:
+            return _api_error('Сервис не найден', 404)
+
+        current_etag = compute_record_etag(server)
+        if current_etag not in request.if_match:
+            response = jsonify({'error': 'Запись была изменена', 'etag': current_etag})
+            response.status_code = 412
+            response.set_etag(current_etag)
+            return response
+
+        try:
+            changed = apply_service_patch(server, patch)
+        except ValueError as e:
+            return _api_error(str(e), 400)
+
+        if changed:
+            server['updated_at'] = datetime.now().isoformat()
+            try:
+                _write_vault(services)
+            except Exception as e:
+                return _api_error(f'Ошибка сохранения: {e}', 500)
+
+    return _api_record_response(server)
+
+@app.route('/api/services/<int:service_id>', methods=['DELETE'])
+@yubikey_auth.require_auth if yubikey_auth else (lambda f: f)
+def api_delete_service(service_id):
+    """Удаляет запись. Если передан If-Match, удаление выполняется только при совпадении ETag."""
+    with _VAULT_LOCK:
+        try:
+            services = _read_vault()
+        except Exception as e:
+            return _api_error(f'Не удалось прочитать файл данных: {e}', 500)
+        server = next((s for s in services if s.get('id') == service_id), None)
+        if server is None:
+            return _api_error('Сервис не найден', 404)
+        if 'If-Match' in request.headers and compute_record_etag(server) not in request.if_match:
+            return _api_error('Запись была изменена', 412)
+
+        services = [s for s in services if s.get('id') != service_id]
+        try:
+            _write_vault(services)
+        except Exception as e:
+            return _api_error(f'Ошибка сохранения: {e}', 500)
+
+    try:
+        release_service_uploads(server)
+    except OSError as e:
+        print(f"Ошибка при удалении файлов записи: {e}")
+    return '', 204
+
+@app.route('/api/services/<int:service_id>/card', methods=['GET'])
+@yubikey_auth.require_auth if yubikey_auth else (lambda f: f)
+def api_service_card(service_id):
+    """HTML-фрагмент одной карточки — для обновления карточки на месте без перезагрузки списка."""
+    try:
+        services = _read_vault()
+    except Exception as e:
+        return _api_error(f'Не удалось прочитать файл данных: {e}', 500)
+    server = next((s for s in services if s.get('id') == service_id), None)
+    if server is None:
+        return _api_error('Сервис не найден', 404)
+
+    etag = compute_record_etag(server)
+    prepare_card(_decorate_server(server))
+    response = make_response(render_template('card_content.html', server=server, **card_template_helpers()))
+    response.set_etag(etag)
+    return response
+
+# SSE-поток держит рабочий поток пула всё время, пока открыт: число таких потоков
+# ограничено, лишние подключения сразу получают 503
+DEFAULT_MAX_EVENT_STREAMS = 4
+_EVENT_STREAMS_LOCK = threading.Lock()
+_event_streams_open = 0
+
+def get_max_event_streams():
+    """Лимит одновременных SSE-потоков (server.max_event_streams); один поток пула всегда свободен."""
+    cfg = app.config.get('server') if isinstance(app.config.get('server'), dict) else {}
+    try:
+        limit = int(cfg.get('max_event_streams', DEFAULT_MAX_EVENT_STREAMS))
+    except (TypeError, ValueError):
+        limit = DEFAULT_MAX_EVENT_STREAMS
+    if _WSGI_SERVER is not None:
+        limit = min(limit, _WSGI_SERVER.workers - 1)
+    return max(0, limit)
+
+def _acquire_event_stream():
+    global _event_streams_open
+    with _EVENT_STREAMS_LOCK:
+        if _event_streams_open >= get_max_event_streams():
+            return False
+        _event_streams_open += 1
+        return True
+
+def _release_event_stream():
+    global _event_streams_open
+    with _EVENT_STREAMS_LOCK:
+        _event_streams_open = max(0, _event_streams_open - 1)
+
+def event_streams_open():
+    with _EVENT_STREAMS_LOCK:
+        return _event_streams_open
+
+def _event_streams_busy():
+    response = jsonify({'error': 'Слишком много открытых потоков событий, повторите позже'})
+    response.status_code = 503
+    response.headers['Retry-After'] = '30'
+    return response
+
+def _event_stream_response(stream):
+    """Ответ text/event-stream; слот потока освобождается при закрытии соединения."""
+    response = Response(stream_with_context(stream), mimetype='text/event-stream')
+    response.headers['X-Accel-Buffering'] = 'no'
+    response.call_on_close(_release_event_stream)
+    return response
+
+@app.route('/events')
+@yubikey_auth.require_auth if yubikey_auth else (lambda f: f)
+def events_stream():
+    """SSE-поток изменений записей: id, версия (ETag) и вид изменения."""
+    if not _acquire_event_stream():
+        return _event_streams_busy()
+    # Пока ответ не создан, слот освобождать некому: при ошибке возвращаем его сами
+    try:
+        start_vault_watcher()
+        try:
+            last_seq = int(request.headers.get('Last-Event-ID', ''))
+        except ValueError:
+            last_seq = None
+        subscriber = change_feed.subscribe(last_seq)
+
+        def generate():
+            try:
+                yield 'retry: 3000\n\n'
+                while True:
+                    try:
+                        event = subscriber.get(timeout=15)
+                    except queue.Empty:
+                        # Комментарий-пинг держит соединение и выявляет закрытые окна
+                        yield ': keep-alive\n\n'
+                        continue
+                    yield format_sse(event)
+            finally:
+                change_feed.unsubscribe(subscriber)
+
+        return _event_stream_response(generate())
+    except BaseException:
+        _release_event_stream()
+        raise
+
+# Состояние сети публикуется отдельной лентой: она доступна и на странице входа
+connectivity_feed = ChangeFeed(history_size=16)
+_CONNECTIVITY_SUBSCRIBED = False
+
+def _publish_connectivity(state):
+    connectivity_feed.publish('connectivity', source='monitor', **state)
+
+def ensure_connectivity_monitor():
+    """Запускает фоновый монитор сети и подписывает на него ленту (однократно)."""
+    global _CONNECTIVITY_SUBSCRIBED
+    if connectivity_monitor is None:
+        return
+    if not _CONNECTIVITY_SUBSCRIBED:
+        _CONNECTIVITY_SUBSCRIBED = True
+        connectivity_monitor.subscribe(_publish_connectivity)
+    connectivity_monitor.start()
+
+@app.route('/connectivity')
+def connectivity_status():
+    """Текущее состояние сети: {online, since, checked_at}."""
+    if connectivity_monitor is None:
+        return jsonify({'online': False, 'since': None, 'checked_at': None})
+    ensure_connectivity_monitor()
+    if request.args.get('refresh') == '1':
+        connectivity_monitor.refresh()
+    return jsonify(connectivity_monitor.get_state())
+
+@app.route('/connectivity/events')
+def connectivity_events():
+    """SSE-поток переходов онлайн/офлайн (событие connectivity)."""
+    if not _acquire_event_stream():
+        return _event_streams_busy()
+    try:
+        ensure_connectivity_monitor()
+        subscriber = connectivity_feed.subscribe()
+
+        def generate():
+            try:
+                yield 'retry: 5000\n\n'
+                while True:
+                    try:
+                        event = subscriber.get(timeout=15)
+                    except queue.Empty:
+                        yield ': keep-alive\n\n'
+                        continue
+                    yield format_sse(event)
+            finally:
+                connectivity_feed.unsubscribe(subscriber)
+
+        return _event_stream_response(generate())
+    except BaseException:
+        _release_event_stream()
+        raise
+
 @app.route('/help')
 @yubikey_auth.require_auth if yubikey_auth else (lambda f: f)
 def help_page():
@@ -1550,7 +2500,9 @@ def about_page():
 @yubikey_auth.require_auth if yubikey_auth else (lambda f: f)
 def settings_page():
     """Отображает страницу управления данными."""
-    return render_template('settings.html')
+    return render_template('settings.html', metrics_dump=metrics.registry.render(),
+                           backups=backup_store.list_snapshots(), backup_stats=backup_store.stats(),
+                           current_key_fingerprint=backup_store.key_fingerprint())
 
 @app.route('/data/export')
 @yubikey_auth.require_auth if yubikey_auth else (lambda f: f)
@@ -1612,40 +2564,40 @@ def export_key():
 @app.route('/data/export_package')
 @yubikey_auth.require_auth if yubikey_auth else (lambda f: f)
 def export_package():
-    """Создает ZIP архив с данными, ключом и загруженными файлами."""
+    """
+    Отдаёт ZIP архив с данными, ключом и загруженными файлами.
+    Архив собирается потоково прямо в ответ, без временного файла в Downloads.
+    """
+    # Проверяем наличие активного файла данных
+    active_file = get_active_data_path()
+    if not active_file or not os.path.exists(active_file):
+        flash('Нет активного файла данных для экспорта.', 'warning')
+        return redirect('/settings')
+
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    zip_filename = f'ai_services_backup_{timestamp}.zip'
+
     try:
-        import zipfile
-        
-        # Проверяем наличие активного файла данных
-        active_file = get_active_data_path()
-        if not active_file or not os.path.exists(active_file):
-            flash('Нет активного файла данных для экспорта.', 'warning')
-            return redirect('/settings')
-        
-        # Создаем ZIP файл в папке Downloads
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        zip_filename = f'ai_services_backup_{timestamp}.zip'
-        export_dir = get_export_dir()
-        zip_path = os.path.join(export_dir, zip_filename)
-        
-        with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            # Добавляем файл данных сервера
-            zipf.write(active_file, f"servers_{timestamp}.enc")
-            
-            # Создаем и добавляем файл с ключом
-            env_content = f"SECRET_KEY={SECRET_KEY}\nFLASK_SECRET_KEY=portable_app_key\n"
-            zipf.writestr("SECRET_KEY.env", env_content)
-            
-            # Добавляем загруженные файлы (если они есть)
-            uploads_dir = os.path.join(get_app_data_dir(), "uploads")
-            if os.path.exists(uploads_dir):
-                for filename in os.listdir(uploads_dir):
-                    file_path = os.path.join(uploads_dir, filename)
-                    if os.path.isfile(file_path):
-                        zipf.write(file_path, f"uploads/{filename}")
-            
-            # Добавляем README с инструкциями
-            readme_content = f"""AI Manager - Экспорт данных
+        # Снимок файла данных берём сразу, чтобы архив был согласован с моментом запроса
+        with _VAULT_LOCK, open(active_file, 'rb') as f:
+            vault_bytes = f.read()
+        servers = json.loads(fernet.decrypt(vault_bytes).decode('utf-8')) if vault_bytes else []
+    except (OSError, InvalidToken, ValueError) as e:
+        flash(f'Ошибка при создании архива: {str(e)}', 'danger')
+        return redirect('/settings')
+
+    # Полный экспорт — база для следующего разностного
+    export_id = new_export_id()
+    try:
+        export_log.record(export_id, build_manifest(servers, compute_record_etag), 'full')
+    except OSError as e:
+        print(f"⚠️ Не удалось записать журнал экспортов: {e}")
+
+    # Создаем файл с ключом
+    env_content = f"SECRET_KEY={SECRET_KEY}\nFLASK_SECRET_KEY=portable_app_key\n"
+
+    # README с инструкциями
+    readme_content = f"""AI Manager - Экспорт данных
 ===========================================
 
 Дата экспорта: {datetime.now().strftime('%d.%m.%Y %H:%M:%S')}
@@ -1654,6 +2606,7 @@ def export_package():
 - servers_{timestamp}.enc - Зашифрованные данные AI-сервисов
 - SECRET_KEY.env - Ключ шифрования (поместите в папку с приложением)
 - uploads/ - Загруженные файлы (иконки, документы и т.д.)
+- manifest.json - Идентификатор экспорта {export_id} (база для разностного экспорта)
 
 Инструкция по импорту:
 1. Скопируйте SECRET_KEY.env в папку с новой установкой AI Manager
@@ -1665,21 +2618,134 @@ def export_package():
 ВАЖНО: Храните этот архив в безопасном месте. Любой, кто имеет доступ к нему,
 может расшифровать ваши данные о AI-сервисах!
 """
-            zipf.writestr("README.txt", readme_content)
-        
-        flash(f'✅ Полный архив создан как: {zip_filename} в папке Downloads', 'success')
-        
-        # Отправляем ZIP файл
-        return send_from_directory(
-            export_dir,
-            zip_filename,
-            as_attachment=True
-        )
-        
+
+    def entries():
+        yield f"servers_{timestamp}.enc", vault_bytes
+        yield MANIFEST_NAME, json.dumps({'export_id': export_id, 'kind': 'full', 'records': len(servers)},
+                                        ensure_ascii=False, indent=2).encode('utf-8')
+        yield "SECRET_KEY.env", env_content.encode('utf-8')
+        # Загруженные файлы — по индексу хранилища, под исходными именами
+        for name, blob in upload_store.iter_blobs():
+            yield f"uploads/{name}", blob
+        yield "README.txt", readme_content.encode('utf-8')
+
+    response = Response(stream_with_context(stream_zip(entries())), mimetype='application/zip')
+    response.headers['Content-Disposition'] = f'attachment; filename="{zip_filename}"'
+    return response
+
+export_log = ExportLog(os.path.join(APP_DATA_DIR, 'data', EXPORT_LOG_NAME))
+
+@app.route('/data/export_delta')
+@yubikey_auth.require_auth if yubikey_auth else (lambda f: f)
+def export_delta():
+    """
+    ZIP только с записями и файлами, изменёнными с экспорта ?since=<id экспорта>
+    или с момента ?since=<дата ISO>; без параметра — с последнего экспорта.
+    """
+    since = request.args.get('since', '').strip()
+    base = export_log.find(since) if since else export_log.latest()
+    if since and base is None:
+        try:
+            datetime.fromisoformat(since)
+        except ValueError:
+            flash(f'Экспорт «{since}» не найден в журнале и не является датой.', 'danger')
+            return redirect('/settings')
+
+    try:
+        with _VAULT_LOCK:
+            servers = _read_vault()
     except Exception as e:
-        flash(f'Ошибка при создании архива: {str(e)}', 'danger')
+        flash(f'Ошибка при чтении файла данных: {e}', 'danger')
+        return redirect('/settings')
+
+    export_id = new_export_id()
+    payload, manifest = build_delta(servers, compute_record_etag, export_id, base=base,
+                                    since=since if base is None else None, digest_fn=upload_store.digest)
+    encrypted_payload = fernet.encrypt(json.dumps(payload, ensure_ascii=False).encode('utf-8'))
+    try:
+        export_log.record(export_id, manifest, 'delta')
+    except OSError as e:
+        print(f"⚠️ Не удалось записать журнал экспортов: {e}")
+    summary = {
+        'export_id': export_id,
+        'kind': 'delta',
+        'base_export_id': payload['base_export_id'],
+        'since': payload['since'],
+        'records': len(payload['records']),
+        'deleted': len(payload['deleted']),
+        'uploads': len(payload['uploads']),
+        'total_records': payload['total_records'],
+    }
+
+    def entries():
+        yield MANIFEST_NAME, json.dumps(summary, ensure_ascii=False, indent=2).encode('utf-8')
+        yield PAYLOAD_NAME, encrypted_payload
+        for name in payload['uploads']:
+            try:
+                blob = upload_store.open_blob(name)
+            except BlobCryptoError as e:
+                print(f"⚠️ Файл {name} не включён в пакет: {e}")
+                continue
+            if blob is not None:
+                yield f"uploads/{name}", blob
+
+    response = Response(stream_with_context(stream_zip(entries())), mimetype='application/zip')
+    response.headers['Content-Disposition'] = f'attachment; filename="ai_services_delta_{export_id}.zip"'
+    return response
+
+@app.route('/data/import_delta', methods=['POST'])
+@yubikey_auth.require_auth if yubikey_auth else (lambda f: f)
+def import_delta():
+    """Применяет разностный пакет (export_delta) к активному файлу данных."""
+    uploaded_file = request.files.get('delta_file')
+    if not uploaded_file or not uploaded_file.filename.endswith('.zip'):
+        flash('Выберите файл разностного экспорта (.zip).', 'danger')
+        return redirect('/settings')
+    if not get_active_data_path():
+        flash('Нет активного файла данных: сначала прикрепите или импортируйте полный файл.', 'warning')
         return redirect('/settings')
 
+    try:
+        with zipfile.ZipFile(uploaded_file.stream) as archive:
+            try:
+                payload = parse_payload(fernet.decrypt(archive.read(PAYLOAD_NAME)))
+            except KeyError:
+                raise DeltaError(f'В архиве нет {PAYLOAD_NAME}') from None
+            except InvalidToken:
+                raise DeltaError('Пакет зашифрован другим ключом') from None
+
+            # Сначала файлы: записи не должны ссылаться на то, чего ещё нет в хранилище
+            plan = plan_uploads(payload, upload_store.digest, payload['export_id'].split('-')[-1])
+            members = set(archive.namelist())
+            for name, target in plan.items():
+                if f"uploads/{name}" not in members:
+                    continue
+                with archive.open(f"uploads/{name}") as src:
+                    upload_store.put(target, src, max_size=MAX_RECEIPT_SIZE,
+                                     allowed_types=IMAGE_TYPES | DOCUMENT_TYPES)
+
+        with _VAULT_LOCK:
+            servers = _read_vault()
+            summary = apply_delta(servers, payload)
+            _write_vault(servers)
+    except zipfile.BadZipFile:
+        flash('Файл не является ZIP-архивом.', 'danger')
+        return redirect('/settings')
+    except (DeltaError, UploadStoreError) as e:
+        flash(f'Ошибка импорта пакета: {e}', 'danger')
+        return redirect('/settings')
+    except Exception as e:
+        flash(f'Ошибка импорта пакета: {e}', 'danger')
+        return redirect('/settings')
+
+    message = (f"Пакет {payload['export_id']} применён: добавлено {summary['added']}, "
+               f"обновлено {summary['updated']}, удалено {summary['deleted']}, без изменений {summary['unchanged']}, "
+               f"файлов загружено {len(plan)}.")
+    if summary['conflicts']:
+        message += f" Оставлены более новые локальные версии: {summary['conflicts']}."
+    flash(message, 'success')
+    return redirect('/settings')
+
 @app.route('/data/import', methods=['POST'])
 def import_data():
     global app_config
@@ -1733,6 +2799,12 @@ def import_data():
                 flash('Ошибка: файл не может быть расшифрован или поврежден. Возможно, он создан с другим ключом.', 'danger')
                 return redirect('/settings')
             
+            # Прежний активный файл сохраняется снимком: после переключения его можно восстановить
+            try:
+                snapshot_active_vault('before_import')
+            except (OSError, BackupStoreError) as e:
+                print(f"⚠️ Не удалось создать снимок перед импортом: {e}")
+
             # Обновляем конфигурацию для использования нового файла
             app.config['active_data_file'] = file_path
             save_app_config()
@@ -1743,6 +2815,38 @@ def import_data():
         flash(f'Ошибка при импорте файла: {str(e)}', 'danger')
     return redirect('/settings')
 
+# Отпечатки полей после последнего слияния — база для трёхстороннего слияния.
+# Хранится отдельно для каждого источника; источник — отпечаток внешнего ключа
+# (у файлов одной установки он один и тот же, у посторонних — свой)
+merge_base = MergeBase(os.path.join(APP_DATA_DIR, 'data', 'merge_base.json'))
+_ENCRYPTED_PATHS = {f"{section}.{field}" for section, field in ENCRYPTED_FIELDS}
+
+def _merge_hash_key():
+    # Отпечатки зависят от ключа хранилища: по файлу базы нельзя подобрать пароли
+    return hmac.new(SECRET_KEY.encode(), b'allmanagerc/merge-base/v1', hashlib.sha256).digest()
+
+def _merge_plaintext_fn():
+    """Значение поля для сравнения: секретные поля расшифровываются (один раз на шифртекст)."""
+    cache = {}
+    def plaintext(path, value):
+        if path not in _ENCRYPTED_PATHS or not isinstance(value, str) or not value:
+            return value
+        if value not in cache:
+            cache[value] = decrypt_data(value)
+        return cache[value]
+    return plaintext
+
+def _write_merge_report(summary, strategy, source):
+    """Сводка слияния (без значений полей) в logs/merge_<время>.json."""
+    try:
+        logs_dir = os.path.join(APP_DATA_DIR, 'logs')
+        os.makedirs(logs_dir, exist_ok=True)
+        path = os.path.join(logs_dir, f"merge_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(dict(summary, strategy=strategy, source=source), f, ensure_ascii=False, indent=2)
+    except OSError as e:
+        print(f"⚠️ Не удалось сохранить отчёт слияния: {e}")
+
 @app.route('/data/import_external', methods=['POST'])
 def import_external_data():
     global app_config
@@ -1786,95 +2890,44 @@ def import_external_data():
             if not isinstance(servers_data, list):
                 raise ValueError("Неверная структура данных")
             
-            # Данные корректны, теперь перешифровываем их с текущим ключом
-            # и объединяем с текущими данными
-            current_servers = []
-            current_file = get_active_data_path()
-            
-            # Загружаем текущие данные, если файл существует
-            if current_file and os.path.exists(current_file):
-                try:
-                    with open(current_file, 'rb') as f:
-                        current_encrypted = f.read()
-                    # decrypt_data ожидает строку, поэтому декодируем bytes в строку
-                    current_decrypted = fernet.decrypt(current_encrypted).decode('utf-8')
-                    current_servers = json.loads(current_decrypted)
-                except Exception:
-                    current_servers = []
-            
             # КРИТИЧЕСКИ ВАЖНО: Перешифровываем все импортированные сервисы с текущим ключом
-            reencrypted_servers_data = []
-            for server in servers_data:
-                reencrypted_server = re_encrypt_service_data(server, fernet_external, fernet)
-                reencrypted_servers_data.append(reencrypted_server)
-            
-            # Заменяем servers_data на перешифрованные данные
-            servers_data = reencrypted_servers_data
-            
-            # Получаем списки существующих IP адресов и имен для предотвращения дублей
-            existing_ips = {server.get('ip', '') for server in current_servers if server.get('ip')}
-            existing_names = {server.get('name', '') for server in current_servers if server.get('name')}
-            
-            # Находим максимальный ID среди существующих серверов
-            max_id = 0
-            for server in current_servers:
-                if 'id' in server and isinstance(server['id'], int):
-                    max_id = max(max_id, server['id'])
-            
-            # Фильтруем импортируемые сервера и присваиваем новые ID
-            new_servers = []
-            skipped_count = 0
-            for server in servers_data:
-                server_ip = server.get('ip', '')
-                server_name = server.get('name', '')
-                
-                # Проверяем на дублирование по IP или имени
-                if server_ip in existing_ips or server_name in existing_names:
-                    skipped_count += 1
-                    continue
-                
-                # Присваиваем новый уникальный ID
-                max_id += 1
-                server['id'] = max_id
-                new_servers.append(server)
-                
-                # Добавляем в списки для отслеживания дублей
-                if server_ip:
-                    existing_ips.add(server_ip)
-                if server_name:
-                    existing_names.add(server_name)
-            
-            # Объединяем данные
-            combined_servers = current_servers + new_servers
-            
-            # Создаем новый файл с объединенными данными
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            filename = f"ai_services_merged_{timestamp}.enc"
-            
-            app_data_dir = get_app_data_dir()
-            data_dir = os.path.join(app_data_dir, "data")
-            os.makedirs(data_dir, exist_ok=True)
-            
-            file_path = os.path.join(data_dir, filename)
-            
-            # Шифруем объединенные данные нашим ключом
-            json_string = json.dumps(combined_servers, ensure_ascii=False, indent=2)
-            encrypted_with_our_key = fernet.encrypt(json_string.encode('utf-8'))
-            with open(file_path, 'wb') as f:
-                f.write(encrypted_with_our_key)
-            
-            # Обновляем конфигурацию
-            app.config['active_data_file'] = file_path
-            save_app_config()
-            
-            # Информируем пользователя о результате
-            if new_servers:
-                message = f'Успешно импортировано {len(new_servers)} новых серверов!'
-                if skipped_count > 0:
-                    message += f' Пропущено {skipped_count} дублирующихся серверов.'
-                flash(message, 'success')
-            else:
-                flash('Все сервера из импортируемого файла уже существуют в вашем списке.', 'info')
+            servers_data = [re_encrypt_service_data(server, fernet_external, fernet) for server in servers_data]
+
+            strategy = request.form.get('merge_strategy', 'three_way')
+            if strategy not in MERGE_STRATEGIES:
+                strategy = 'three_way'
+            engine = MergeEngine(_merge_hash_key(), plaintext_fn=_merge_plaintext_fn())
+
+            with _VAULT_LOCK:
+                current_file = get_active_data_path()
+                has_current = bool(current_file and os.path.exists(current_file))
+                current_servers = _read_vault() if has_current else []
+                merge_source = key_fingerprint(external_key)
+                merged, new_base, summary = engine.merge(current_servers, servers_data,
+                                                         merge_base.load(merge_source), strategy)
+
+                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+                data_dir = os.path.join(get_app_data_dir(), "data")
+                os.makedirs(data_dir, exist_ok=True)
+                if has_current:
+                    if summary['added'] or summary['updated']:
+                        # Слияние пишет в активный файл; прежнее состояние — снимком в хранилище резервных копий
+                        _snapshot_vault_file(current_file, 'before_merge')
+                        _write_vault(merged)
+                else:
+                    # Активного файла нет — создаём новый из импортированных записей
+                    app.config['active_data_file'] = os.path.join(data_dir, f"ai_services_merged_{timestamp}.enc")
+                    save_app_config()
+                    _write_vault(merged)
+                merge_base.save(merge_source, new_base)
+
+            _write_merge_report(summary, strategy, uploaded_file.filename)
+            message = (f"Слияние завершено: добавлено {summary['added']}, обновлено {summary['updated']}, "
+                       f"без изменений {summary['unchanged']}.")
+            if summary['conflicts']:
+                names = ', '.join(str(c['name']) for c in summary['changes'] if c.get('conflicts'))[:200]
+                message += f" Конфликтов: {summary['conflicts']} ({names}) — выбраны более новые значения."
+            flash(message, 'success' if summary['added'] or summary['updated'] else 'info')
             
         except InvalidToken:
             flash('Ошибка: неверный ключ шифрования. Проверьте правильность введенного ключа.', 'danger')
@@ -1892,6 +2945,130 @@ def import_external_data():
     
     return redirect('/settings')
 
+def bulk_import_services(stream, filename, fmt=None, skip_duplicates=True, workers=None):
+    """
+    Добавляет сервисы из CSV/JSON (экспорт менеджера паролей или собственный формат)
+    в активный файл одним сохранением. Возвращает отчёт bulk_import.import_rows.
+    """
+    if not get_active_data_path():
+        raise BulkImportError('Нет активного файла данных')
+    if not fmt:
+        head = stream.read(64)
+        stream.seek(0)
+        fmt = detect_format(filename, head)
+    options = {'workers': workers} if workers else {}
+    with _VAULT_LOCK:
+        services = _read_vault()
+        report = import_rows(iter_rows(stream, fmt), services, ENCRYPTED_FIELDS, encrypt_data,
+                             decorate_fn=lambda service: apply_gradient(service, '#667eea'),
+                             skip_duplicates=skip_duplicates, **options)
+        if report['imported']:
+            _write_vault(services)
+    report['format'] = fmt
+    return report
+
+@app.route('/data/import_bulk', methods=['POST'])
+@yubikey_auth.require_auth if yubikey_auth else (lambda f: f)
+def import_bulk():
+    """Массовый импорт сервисов из CSV/JSON (в т.ч. экспортов браузеров и менеджеров паролей)."""
+    uploaded_file = request.files.get('bulk_file')
+    if not uploaded_file or not uploaded_file.filename:
+        flash('Выберите файл CSV или JSON.', 'danger')
+        return redirect('/settings')
+    try:
+        started = time.perf_counter()
+        report = bulk_import_services(uploaded_file.stream, uploaded_file.filename,
+                                      skip_duplicates='allow_duplicates' not in request.form)
+    except BulkImportError as e:
+        flash(f'Ошибка импорта: {e}', 'danger')
+        return redirect('/settings')
+    except Exception as e:
+        flash(f'Ошибка импорта: {e}', 'danger')
+        return redirect('/settings')
+
+    message = (f"Импортировано сервисов: {report['imported']} за {time.perf_counter() - started:.1f} с. "
+               f"Пропущено дубликатов: {report['skipped_duplicates']}.")
+    if report['errors']:
+        rows = ', '.join(str(e['row']) for e in report['error_rows'][:10])
+        message += f" Строк с ошибками: {report['errors']} (строки {rows})."
+    flash(message, 'success' if report['imported'] else 'warning')
+    return redirect('/settings')
+
+@app.route('/api/backups')
+@yubikey_auth.require_auth if yubikey_auth else (lambda f: f)
+def api_backups():
+    """Снимки файла данных (от новых к старым) и занятое хранилищем место."""
+    return jsonify({'snapshots': backup_store.list_snapshots(), 'stats': backup_store.stats()})
+
+@app.route('/data/backups/<snapshot_id>/restore', methods=['POST'])
+@yubikey_auth.require_auth if yubikey_auth else (lambda f: f)
+def restore_backup(snapshot_id):
+    """
+    Восстанавливает снимок в новый файл data/restored_<id>.enc и делает его активным.
+    Текущий активный файл перед этим сохраняется снимком. Если поля снимка зашифрованы
+    прежним ключом (снимок до смены ключа), нужен этот ключ: поля перешифровываются.
+    """
+    old_key = request.form.get('old_key', '').strip()
+    try:
+        manifest, content = backup_store.restore(snapshot_id)
+        path = os.path.join(APP_DATA_DIR, 'data', f"restored_{manifest['id']}.enc")
+        if manifest['kind'] == 'raw':
+            # Файл не расшифровывался ключом, действовавшим при создании снимка: возвращаем как есть
+            with open(path, 'wb') as f:
+                f.write(content)
+            try:
+                fernet.decrypt(content)
+            except InvalidToken:
+                flash(f'Снимок сохранён как {os.path.basename(path)}, но файл зашифрован другим ключом '
+                      f'и не подключён. Используйте «Импорт с другим ключом».', 'warning')
+                return redirect('/settings')
+            records = None
+        else:
+            records = content
+            if manifest.get('key_fingerprint') != backup_store.key_fingerprint():
+                if not old_key:
+                    flash('Поля этого снимка зашифрованы прежним ключом. Укажите его для восстановления.', 'danger')
+                    return redirect('/settings')
+                if backup_store.key_fingerprint(old_key) != manifest.get('key_fingerprint'):
+                    flash('Указанный ключ не совпадает с ключом, которым зашифрован снимок.', 'danger')
+                    return redirect('/settings')
+                old_fernet = Fernet(old_key.encode())
+                records = [re_encrypt_service_data(record, old_fernet, fernet) for record in records]
+
+        with _VAULT_LOCK:
+            snapshot_active_vault('before_restore')
+            # Конфигурация на диске переключается только после записи восстановленного файла
+            previous_file = app.config.get('active_data_file')
+            app.config['active_data_file'] = path
+            if records is not None:
+                try:
+                    _write_vault(records)
+                except Exception:
+                    app.config['active_data_file'] = previous_file
+                    raise
+            save_app_config()
+    except BackupStoreError as e:
+        flash(f'Ошибка восстановления: {e}', 'danger')
+        return redirect('/settings')
+    except Exception as e:
+        flash(f'Ошибка восстановления: {e}', 'danger')
+        return redirect('/settings')
+
+    flash(f"✅ Снимок от {manifest['created_at']} восстановлен в файл {os.path.basename(path)} и подключён.", 'success')
+    return redirect('/settings')
+
+@app.route('/data/backups/prune', methods=['POST'])
+@yubikey_auth.require_auth if yubikey_auth else (lambda f: f)
+def prune_backups():
+    """Применяет политику хранения резервных копий сейчас."""
+    try:
+        report = backup_store.apply_retention()
+    except (OSError, BackupStoreError) as e:
+        flash(f'Ошибка очистки резервных копий: {e}', 'danger')
+        return redirect('/settings')
+    flash(f"Удалено снимков: {len(report['removed'])}, освобождено {report['bytes_freed'] // 1024} КБ.", 'info')
+    return redirect('/settings')
+
 @app.route('/data/detach', methods=['POST'])
 def detach_data():
     """Открепляет текущий файл данных."""
@@ -1903,17 +3080,69 @@ def detach_data():
     return redirect('/')
 
 
+# Клиент геолокации: общая сессия, объединение одинаковых запросов и кэш на диске
+_geo_settings = app.config.get('geolocation') if isinstance(app.config.get('geolocation'), dict) else {}
+geo_client = GeoLookupClient(
+    cache_path=os.path.join(APP_DATA_DIR, 'cache', 'ip_geolocation.json'),
+    url_template=app.config.get('service_urls', {}).get('ip_check_api', 'https://ipinfo.io/{ip}/json'),
+    ttl=float(_geo_settings.get('cache_ttl_hours', 168)) * 3600,
+    max_concurrency=int(_geo_settings.get('max_concurrency', 8))
+)
+
+def _is_valid_ip(value):
+    try:
+        ipaddress.ip_address(value)
+        return True
+    except ValueError:
+        return False
+
 @app.route('/check_ip/<ip_address>')
 def check_ip(ip_address):
+    if not _is_valid_ip(ip_address):
+        return jsonify({"error": "Некорректный IP-адрес"}), 400
     try:
-        ip_check_url = app.config.get('service_urls', {}).get('ip_check_api', 'https://ipinfo.io/{ip}/json').format(ip=ip_address)
-        response = requests.get(ip_check_url, timeout=5)
-        if response.status_code == 200:
-            return jsonify(response.json())
-        else:
-            return jsonify({"error": f"Ошибка запроса: статус {response.status_code}"}), 500
-    except requests.exceptions.RequestException as e:
-        return jsonify({"error": f"Не удалось подключиться к сервису: {e}"}), 500
+        data, _cached = geo_client.lookup(ip_address, force=request.args.get('refresh') == '1')
+        return jsonify(data)
+    except GeoLookupError as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/servers/geolocate', methods=['POST'])
+@yubikey_auth.require_auth if yubikey_auth else (lambda f: f)
+def geolocate_all_servers():
+    """
+    Определяет геолокацию IP всех серверов параллельно и сохраняет её в поле geolocation
+    (используется analyze_hosting). Тело запроса (необязательно): {"force": true}.
+    """
+    payload = request.get_json(silent=True) or {}
+    try:
+        services = _read_vault()
+    except Exception as e:
+        return jsonify({'error': f'Не удалось прочитать файл данных: {e}'}), 500
+
+    ips = [s.get('ip') for s in services if s.get('ip') and _is_valid_ip(str(s.get('ip')))]
+    # Сетевые запросы выполняются без блокировки файла данных
+    results = geo_client.lookup_many(ips, force=bool(payload.get('force')))
+
+    updated = 0
+    with _VAULT_LOCK:
+        try:
+            services = _read_vault()
+            for server in services:
+                result = results.get(server.get('ip'))
+                if result and 'data' in result and server.get('geolocation') != result['data']:
+                    server['geolocation'] = result['data']
+                    updated += 1
+            if updated:
+                _write_vault(services)
+        except Exception as e:
+            return jsonify({'error': f'Ошибка сохранения: {e}'}), 500
+
+    return jsonify({
+        'total_ips': len(results),
+        'updated_servers': updated,
+        'from_cache': sum(1 for r in results.values() if r.get('cached')),
+        'errors': {ip: r['error'] for ip, r in results.items() if 'error' in r}
+    })
 
 @app.route('/settings')
 @yubikey_auth.require_auth if yubikey_auth else (lambda f: f)
@@ -1945,17 +3174,12 @@ def change_main_key():
         # Загружаем текущие данные с существующим ключом
         current_servers = load_ai_services()
         
-        # Создаем резервную копию с временной меткой
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        backup_filename = f"backup_before_key_change_{timestamp}.enc"
-        
         app_data_dir = get_app_data_dir()
         data_dir = os.path.join(app_data_dir, "data")
-        backup_path = os.path.join(data_dir, backup_filename)
         
-        # Создаем резервную копию
-        if app.config.get('active_data_file') and os.path.exists(app.config['active_data_file']):
-            shutil.copy2(app.config['active_data_file'], backup_path)
+        # Резервная копия — снимок в хранилище резервных копий (поля остаются на старом ключе)
+        backup = snapshot_active_vault('key_change')
         
         # Сохраняем старые значения для отката в случае ошибки
         old_key = os.environ.get('SECRET_KEY')
@@ -2006,6 +3230,8 @@ def change_main_key():
         new_filename = f"ai_services_reencrypted_{timestamp}.enc"
         new_file_path = os.path.join(data_dir, new_filename)
         
+        uploads_rekeyed = False
+        backups_rekeyed = False
         try:
             # Обновляем глобальные переменные СНАЧАЛА
             SECRET_KEY = new_key
@@ -2014,15 +3240,25 @@ def change_main_key():
             # Перешифровываем данные с новым ключом
             with open(new_file_path, 'wb') as f:
                 f.write(encrypt_data(json.dumps(current_servers)).encode())
+
+            # Загруженные файлы: переписываются только заголовки с ключом файла
+            upload_store.rekey(old_secret_key, new_key)
+            uploads_rekeyed = True
+            backups_rekeyed = backup_store.rekey(old_secret_key, new_key)
             
             # Обновляем конфигурацию приложения
             app.config['active_data_file'] = new_file_path
             save_app_config()
             
-            flash(f'✅ Ключ успешно изменен! Создан новый файл данных: {new_filename}. Резервная копия сохранена как: {backup_filename}', 'success')
+            backup_note = f" Резервная копия: снимок {backup['id']}." if backup else ''
+            flash(f'✅ Ключ успешно изменен! Создан новый файл данных: {new_filename}.{backup_note}', 'success')
             
         except Exception as e:
             # Откатываем ВСЕ изменения в случае ошибки
+            if backups_rekeyed:
+                backup_store.rekey(new_key, old_secret_key)
+            if uploads_rekeyed:
+                upload_store.rekey(new_key, old_secret_key)
             os.environ['SECRET_KEY'] = old_key
             SECRET_KEY = old_secret_key
             fernet = old_fernet
@@ -2181,18 +3417,135 @@ SERVER_PORT = None
 _WSGI_SERVER = None
 
 
-def _start_flask_server():
+def get_server_settings():
+    """
+    Параметры встроенного сервера: config.json (секция server) с переопределением из окружения
+    ALLMANAGERC_SERVER_WORKERS / ALLMANAGERC_SERVER_QUEUE / ALLMANAGERC_SERVER_KEEPALIVE /
+    ALLMANAGERC_SERVER_IO_TIMEOUT.
+    """
+    cfg = app.config.get('server') if isinstance(app.config.get('server'), dict) else {}
+    settings = {
+        'workers': cfg.get('workers', DEFAULT_WORKERS),
+        'queue_size': cfg.get('queue_size', DEFAULT_QUEUE_SIZE),
+        'keep_alive_timeout': cfg.get('keep_alive_timeout', DEFAULT_KEEP_ALIVE_TIMEOUT),
+        'io_timeout': cfg.get('io_timeout', DEFAULT_IO_TIMEOUT)
+    }
+    for key, env_name, cast in (('workers', 'ALLMANAGERC_SERVER_WORKERS', int),
+                                ('queue_size', 'ALLMANAGERC_SERVER_QUEUE', int),
+                                ('keep_alive_timeout', 'ALLMANAGERC_SERVER_KEEPALIVE', float),
+                                ('io_timeout', 'ALLMANAGERC_SERVER_IO_TIMEOUT', float)):
+        raw = os.getenv(env_name)
+        if raw:
+            try:
+                settings[key] = cast(raw)
+            except ValueError:
+                print(f"⚠️ Некорректное значение {env_name}={raw!r}, используется {settings[key]}")
+    return settings
+
+
+def create_wsgi_server(host='127.0.0.1', port=0):
+    """Создаёт сервер с пулом потоков; порт 0 — свободный порт, выбранный ОС."""
+    return PooledWSGIServer(host, port, app, **get_server_settings())
+
+
+def _start_flask_server(port=0, host='127.0.0.1'):
     global SERVER_PORT, _WSGI_SERVER
     try:
-        _WSGI_SERVER = make_server('127.0.0.1', 0, app)
+        _WSGI_SERVER = create_wsgi_server(host, port)
         SERVER_PORT = _WSGI_SERVER.server_port
-        print(f"🚀 Flask сервер запущен на http://127.0.0.1:{SERVER_PORT}")
+        print(f"🚀 Flask сервер запущен на http://{host}:{SERVER_PORT} (потоков: {_WSGI_SERVER.workers})")
         _WSGI_SERVER.serve_forever()
     except Exception as e:
         print(f"❌ Ошибка запуска Flask сервера: {e}")
         import traceback
         traceback.print_exc()
 
+
+def start_server_thread(port=0, wait_timeout=5.0, host='127.0.0.1'):
+    """Запускает сервер в фоновом потоке и ждёт, пока он привяжется к порту. Возвращает порт или None."""
+    # Монитор сети стартует заранее, чтобы страница входа сразу знала режим
+    ensure_connectivity_monitor()
+    if _upload_settings.get('gc_enabled', True):
+        upload_gc.start()
+    thread = threading.Thread(target=_start_flask_server, args=(port, host), name='wsgi-server', daemon=True)
+    thread.start()
+    deadline = time.monotonic() + wait_timeout
+    while SERVER_PORT is None and thread.is_alive() and time.monotonic() < deadline:
+        time.sleep(0.02)
+    return SERVER_PORT
+
+
+def stop_server():
+    """Останавливает встроенный сервер: новые соединения не принимаются, потоки пула завершаются."""
+    global SERVER_PORT, _WSGI_SERVER
+    server = _WSGI_SERVER
+    if server is None:
+        return
+    server.shutdown()
+    server.server_close()
+    _WSGI_SERVER = None
+    SERVER_PORT = None
+
+
+@app.route('/api/uploads/gc', methods=['GET', 'POST'])
+@yubikey_auth.require_auth if yubikey_auth else (lambda f: f)
+def api_upload_gc():
+    """
+    GET — отчёт без изменений (dry run): файлы без ссылок и когда их можно будет удалить.
+    POST — проход сборки мусора сейчас (с тем же grace-периодом); ?dry_run=1 — только отчёт.
+    """
+    dry_run = request.method == 'GET' or request.args.get('dry_run', '').lower() in ('1', 'true', 'yes')
+    report = upload_gc.run(dry_run=dry_run)
+    report['store'] = upload_store.stats()
+    report['last_run'] = upload_gc.last_report and upload_gc.last_report['started_at']
+    return jsonify(report)
+
+@app.route('/api/server/stats')
+@yubikey_auth.require_auth if yubikey_auth else (lambda f: f)
+def server_stats():
+    """Состояние пула встроенного сервера: глубина очереди, запросы в работе, отказы."""
+    if _WSGI_SERVER is None:
+        return jsonify({'running': False})
+    return jsonify(dict(_WSGI_SERVER.stats(), running=True,
+                        event_streams=event_streams_open(), max_event_streams=get_max_event_streams()))
+
+def _collect_runtime_metrics():
+    """Метрики пула сервера, кэша геолокации, ленты событий и монитора сети."""
+    families = []
+    if _WSGI_SERVER is not None:
+        st = _WSGI_SERVER.stats()
+        families += [
+            ('allmanagerc_wsgi_queue_depth', 'gauge', 'Соединения в очереди пула', [({}, st['queue_depth'])]),
+            ('allmanagerc_wsgi_in_flight', 'gauge', 'Запросы в работе', [({}, st['in_flight'])]),
+            ('allmanagerc_wsgi_workers', 'gauge', 'Рабочие потоки пула', [({}, st['workers'])]),
+            ('allmanagerc_wsgi_handled_total', 'counter', 'Обработанные соединения', [({}, st['handled'])]),
+            ('allmanagerc_wsgi_rejected_total', 'counter', 'Соединения, отклонённые с 503', [({}, st['rejected'])]),
+        ]
+    geo = geo_client.get_stats()
+    families.append(('allmanagerc_cache_requests_total', 'counter', 'Обращения к кэшам', [
+        ({'cache': 'ip_geolocation', 'result': 'hit'}, geo['hits']),
+        ({'cache': 'ip_geolocation', 'result': 'miss'}, geo['misses']),
+        ({'cache': 'ip_geolocation', 'result': 'coalesced'}, geo['coalesced']),
+    ]))
+    families.append(('allmanagerc_cache_entries', 'gauge', 'Записей в кэшах',
+                     [({'cache': 'ip_geolocation'}, geo['cache_entries'])]))
+    families.append(('allmanagerc_events_subscribers', 'gauge', 'Открытые SSE-подписки',
+                     [({'feed': 'changes'}, change_feed.subscriber_count()),
+                      ({'feed': 'connectivity'}, connectivity_feed.subscriber_count())]))
+    if connectivity_monitor is not None:
+        families.append(('allmanagerc_online', 'gauge', 'Состояние сети по данным монитора',
+                         [({}, 1 if connectivity_monitor.is_online() else 0)]))
+    return families
+
+metrics.registry.register_collector(_collect_runtime_metrics)
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Метрики в формате Prometheus. Доступны только с localhost."""
+    if request.remote_addr not in ('127.0.0.1', '::1'):
+        abort(403)
+    return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
 def create_default_schema():
     """
     Создает базовую схему данных, если она отсутствует
@@ -2213,6 +3566,8 @@ def create_default_schema():
         "status_options": ["active", "inactive", "trial", "expired", "cancelled"]
     }
     
+    if os.path.exists('ai_services_schema.json'):
+        return
     try:
         with open('ai_services_schema.json', 'w', encoding='utf-8') as f:
             json.dump(default_schema, f, indent=2, ensure_ascii=False)
@@ -2221,7 +3576,9 @@ def create_default_schema():
         print(f"❌ Ошибка создания схемы данных: {e}")
 
 # Вызываем создание схемы при старте приложения
+startup_profiler.stage('create_default_schema')
 create_default_schema()
+startup_profiler.stage('module_body')
 
 # Добавляем фильтры и тесты для Jinja2
 def regex_replace(s, find, replace):
@@ -2242,12 +3599,13 @@ def yubikey_login():
     try:
         print(f"🔍 yubikey_login: method={request.method}, yubikey_auth={yubikey_auth is not None}")
         
-        # Проверяем статус сети для передачи в шаблон
+        # Статус сети берётся из фонового монитора (без сетевых запросов)
+        ensure_connectivity_monitor()
         is_online = check_internet_connection()
         
         # Если YubiKey включен, но ключи не настроены, направляем в настройки
         try:
-            if yubikey_auth and yubikey_auth.enabled and len(yubikey_auth.get_keys()) == 0:
+            if yubikey_auth and yubikey_auth.enabled and not yubikey_auth.has_keys():
                 flash('YubiKey ключи не настроены. Укажите Client ID и Secret Key в разделе «Настройки».', 'warning')
                 return redirect('/settings')
         except Exception:
@@ -2365,7 +3723,8 @@ def yubikey_setup():
     
     # Передаем данные для отображения
     keys = yubikey_auth.get_keys() if yubikey_auth else []
-    return render_template('yubikey_setup.html', yubikey_auth=yubikey_auth, keys=keys)
+    local_keys = yubikey_auth.local_keys if yubikey_auth else []
+    return render_template('yubikey_setup.html', yubikey_auth=yubikey_auth, keys=keys, local_keys=local_keys)
 
 @app.route('/yubikey/remove/<int:key_index>', methods=['POST'])
 def yubikey_remove_key(key_index):
@@ -2377,6 +3736,32 @@ def yubikey_remove_key(key_index):
             flash('Ошибка при удалении ключа', 'danger')
     return redirect('/yubikey/setup')
 
+@app.route('/yubikey/local/add', methods=['POST'])
+def yubikey_add_local_key():
+    """Регистрирует ключ для локальной (офлайн) проверки OTP: public id, AES-ключ и private id."""
+    if not yubikey_auth:
+        flash('YubiKey модуль не доступен', 'danger')
+        return redirect('/')
+    try:
+        yubikey_auth.add_local_key(request.form.get('public_id', ''), request.form.get('aes_key', ''),
+                                   request.form.get('private_id', ''), request.form.get('key_name', '').strip() or None)
+        flash('Ключ для локальной проверки добавлен', 'success')
+    except ValueError as e:
+        flash(f'Ошибка: {e}', 'danger')
+    except Exception as e:
+        flash(f'Ошибка сохранения ключа: {e}', 'danger')
+    return redirect('/yubikey/setup')
+
+@app.route('/yubikey/local/remove/<public_id>', methods=['POST'])
+def yubikey_remove_local_key(public_id):
+    if yubikey_auth:
+        removed_key = yubikey_auth.remove_local_key(public_id)
+        if removed_key:
+            flash(f'Ключ "{removed_key.get("name", public_id)}" удален', 'success')
+        else:
+            flash('Ключ не найден', 'danger')
+    return redirect('/yubikey/setup')
+
 @app.route('/yubikey/instructions')
 def yubikey_instructions():
     return render_template('yubikey_instructions.html')
@@ -2456,35 +3841,37 @@ def change_secret_pin():
     except Exception as e:
         return jsonify({'success': False, 'message': f'Ошибка: {e}'}), 500
 
+startup_profiler.stage(None)
+
+def on_window_loaded():
+    """Окно показало первую страницу: фиксируем время и сохраняем профиль запуска."""
+    startup_profiler.mark('window_loaded')
+    startup_profiler.write_report(APP_DATA_DIR)
+
 if __name__ == "__main__":
     try:
-        # Выполняем проверку и миграцию при старте приложения
-        print("🔄 Выполнение миграции данных...")
-        migrate_data()
-        
-        # Запускаем Flask в отдельном потоке
+        # Миграции данных уже выполнены при импорте (run_startup_migrations)
+        startup_profiler.stage('import_webview')
+        import webview
+        from urllib.request import urlopen
+
+        # Запускаем Flask в отдельном потоке и ждём, пока сервер поднимется и задаст порт
         print("🔄 Запуск Flask в отдельном потоке...")
-        flask_thread = threading.Thread(target=_start_flask_server)
-        flask_thread.daemon = True
-        flask_thread.start()
-        
-        # Ждём, пока сервер поднимется и задаст порт
-        for _ in range(100):
-            if SERVER_PORT:
-                break
-            time.sleep(0.05)
+        startup_profiler.stage('server_bind')
+        start_server_thread()
 
         def on_closing():
             print("Окно закрывается, отправка запроса на выключение...")
             try:
                 # Отправляем запрос на выключение, чтобы корректно остановить сервер
-                requests.get(f'http://127.0.0.1:{SERVER_PORT}/shutdown', timeout=1)
-            except requests.exceptions.RequestException:
+                urlopen(f'http://127.0.0.1:{SERVER_PORT}/shutdown', timeout=1)
+            except OSError:
                 # Это нормально, так как сервер умрет до получения ответа
                 pass
 
         # Создаем окно PyWebView
         print("🔄 Создание GUI окна...")
+        startup_profiler.stage('create_window')
         window = webview.create_window(
             'AllManagerC',
             f'http://127.0.0.1:{SERVER_PORT or 5050}',
@@ -2493,12 +3880,23 @@ if __name__ == "__main__":
             resizable=True
         )
         window.events.closing += on_closing
+        if startup_profiler.enabled():
+            window.events.loaded += on_window_loaded
+
+        # Разрешаем скачивание файлов (экспорт архива отдаётся потоком, а не через Downloads)
+        try:
+            webview.settings['ALLOW_DOWNLOADS'] = True
+        except Exception:
+            pass
 
         # Запускаем GUI
         print("🚀 Запуск GUI приложения...")
+        startup_profiler.stage('webview_start')
         webview.start(debug=False) # debug=True может помочь с отладкой, если что-то пойдет не так
 
         # После закрытия окна PyWebView, главный поток продолжится здесь.
+        # Если окно так и не загрузилось, профиль всё равно сохраняется
+        startup_profiler.write_report(APP_DATA_DIR)
         print("Приложение закрыто.")
     except Exception as e:
         print(f"❌ Критическая ошибка при запуске приложения: {e}")
@@ -0,0 +1,411 @@
+#!/usr/bin/env python3
+"""
+Хранилище резервных копий файла данных с дедупликацией и политикой хранения.
+
+Снимок — список записей файла данных, разбитый на блоки по границам записей:
+каждая запись сериализуется отдельной строкой, блок заканчивается после строки,
+хеш которой попадает в маску (но не раньше MIN_CHUNK и не позже MAX_CHUNK).
+Граница зависит только от содержимого, поэтому правка или вставка записи
+меняет один-два блока, а остальные совпадают с блоками прошлых снимков и
+хранятся один раз. Сам .enc-файл для этого не годится: Fernet при каждом
+сохранении шифрует с новым IV, и шифртексты двух снимков не совпадают.
+Файл, который не расшифровывается текущим ключом, сохраняется как есть
+(kind=raw) блоками фиксированного размера.
+
+Блок адресуется HMAC-SHA256 содержимого, сжимается zlib и шифруется
+AES-256-GCM ключом хранилища; ключ хранилища хранится в key.bin зашифрованным
+ключом, выведенным из SECRET_KEY (как ключи файлов в blob_crypto), поэтому
+смена главного ключа переписывает только key.bin. Секретные поля записей
+остаются зашифрованными тем ключом, который действовал при создании снимка
+(key_fingerprint в описании снимка).
+
+В описании снимка kind=records хранится список загрузок (иконок и чеков), на
+которые ссылаются его записи (поле uploads): сборщик мусора загрузок не удаляет
+файлы, нужные для восстановления снимка.
+
+Структура каталога:
+
+    key.bin                 nonce (12) + обёрнутый ключ хранилища
+    snapshots/<id>.json     описание снимка и список блоков
+    chunks/<ab>/<id>        блоки
+
+Политика хранения: последние keep_last снимков, по одному (последнему) за
+keep_daily последних дней и keep_weekly последних недель; остальные снимки
+удаляются вместе с блоками, на которые больше никто не ссылается. Если
+занятое место превышает max_bytes, удаляются самые старые снимки (последний
+снимок остаётся всегда).
+"""
+
+import hashlib
+import hmac
+import json
+import os
+import tempfile
+import threading
+import uuid
+import zlib
+from datetime import datetime
+
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+from blob_crypto import derive_kek
+
+KEK_INFO = b'allmanagerc/backups/kek/v1'
+KEY_AAD = b'allmanagerc/backups/v1'
+MIN_CHUNK = 4 * 1024
+MAX_CHUNK = 64 * 1024
+# Граница после строки, у которой младшие биты CRC32 нулевые: в среднем каждые 8 записей
+BOUNDARY_MASK = 0x7
+RAW_CHUNK = 64 * 1024
+
+
+class BackupStoreError(Exception):
+    """Снимок не найден, повреждён или ключ хранилища не подходит."""
+
+
+def _atomic_write(path, data):
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix='.tmp-', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def key_fingerprint(secret_key):
+    """Короткий отпечаток SECRET_KEY: по нему видно, каким ключом зашифрованы поля снимка."""
+    return hashlib.sha256(b'allmanagerc/backups/fingerprint:' + secret_key.encode()).hexdigest()[:12]
+
+
+def split_records(records):
+    """Сериализует записи построчно и делит на блоки по границам, зависящим от содержимого."""
+    chunks, current, size = [], [], 0
+    for record in records:
+        line = json.dumps(record, ensure_ascii=False, separators=(',', ':')).encode('utf-8') + b'\n'
+        current.append(line)
+        size += len(line)
+        if size >= MAX_CHUNK or (size >= MIN_CHUNK and zlib.crc32(line) & BOUNDARY_MASK == 0):
+            chunks.append(b''.join(current))
+            current, size = [], 0
+    if current:
+        chunks.append(b''.join(current))
+    return chunks
+
+
+def select_retained(snapshots, keep_last, keep_daily, keep_weekly):
+    """Идентификаторы снимков, которые остаются по политике (snapshots — от новых к старым)."""
+    keep = {s['id'] for s in snapshots[:max(0, keep_last)]}
+    for limit, bucket in ((keep_daily, lambda d: d.date()), (keep_weekly, lambda d: d.isocalendar()[:2])):
+        seen = set()
+        for snapshot in snapshots:
+            key = bucket(datetime.fromisoformat(snapshot['created_at']))
+            if key in seen:
+                continue
+            if len(seen) >= limit:
+                break
+            seen.add(key)
+            keep.add(snapshot['id'])
+    return keep
+
+
+class BackupStore:
+    def __init__(self, root, key_provider, keep_last=10, keep_daily=7, keep_weekly=4, max_bytes=None,
+                 references=None):
+        """
+        key_provider() возвращает текущий SECRET_KEY; max_bytes — предел размера блоков (None — без предела);
+        references(records) возвращает имена загрузок, на которые ссылаются записи снимка.
+        """
+        self.root = root
+        self.key_provider = key_provider
+        self.references = references
+        # Последний снимок хранится всегда
+        self.keep_last = max(1, keep_last)
+        self.keep_daily = keep_daily
+        self.keep_weekly = keep_weekly
+        self.max_bytes = max_bytes
+        self.snapshots_dir = os.path.join(root, 'snapshots')
+        self.chunks_dir = os.path.join(root, 'chunks')
+        self.key_path = os.path.join(root, 'key.bin')
+        self._lock = threading.RLock()
+        self._keys = None
+
+    # --- Ключи ---
+    def _load_store_key(self, secret_key):
+        with open(self.key_path, 'rb') as f:
+            blob = f.read()
+        try:
+            return AESGCM(derive_kek(secret_key, KEK_INFO)).decrypt(blob[:12], blob[12:], KEY_AAD)
+        except InvalidTag:
+            raise BackupStoreError('Ключ хранилища резервных копий не подходит к текущему SECRET_KEY') from None
+
+    def _save_store_key(self, store_key, secret_key):
+        nonce = os.urandom(12)
+        _atomic_write(self.key_path, nonce + AESGCM(derive_kek(secret_key, KEK_INFO)).encrypt(nonce, store_key, KEY_AAD))
+
+    def _subkeys(self):
+        """(ключ HMAC для имён блоков, AESGCM для содержимого); ключ хранилища создаётся при первом снимке."""
+        if self._keys is None:
+            secret_key = self.key_provider()
+            if os.path.exists(self.key_path):
+                store_key = self._load_store_key(secret_key)
+            else:
+                store_key = AESGCM.generate_key(bit_length=256)
+                self._save_store_key(store_key, secret_key)
+            derive = lambda info: HKDF(algorithm=hashes.SHA256(), length=32, salt=None, info=info).derive(store_key)
+            self._keys = (derive(b'chunk-id'), AESGCM(derive(b'chunk-data')))
+        return self._keys
+
+    def key_fingerprint(self, secret_key=None):
+        """Отпечаток SECRET_KEY, которым зашифрованы поля записей снимка."""
+        return key_fingerprint(secret_key or self.key_provider())
+
+    def unlocks(self, secret_key):
+        """Подходит ли SECRET_KEY к ключу хранилища (хранилище без key.bin подходит к любому)."""
+        if not os.path.exists(self.key_path):
+            return True
+        try:
+            self._load_store_key(secret_key)
+            return True
+        except (BackupStoreError, ValueError):
+            return False
+
+    def rekey(self, old_key, new_key):
+        """Перешифровывает ключ хранилища под новый SECRET_KEY (блоки не переписываются)."""
+        with self._lock:
+            if not os.path.exists(self.key_path):
+                return False
+            self._save_store_key(self._load_store_key(old_key), new_key)
+            return True
+
+    # --- Блоки ---
+    def _chunk_path(self, chunk_id):
+        return os.path.join(self.chunks_dir, chunk_id[:2], chunk_id)
+
+    def _put_chunk(self, data):
+        """Сохраняет блок, если такого ещё нет. Возвращает (id, записано байт)."""
+        id_key, aead = self._subkeys()
+        chunk_id = hmac.new(id_key, data, hashlib.sha256).hexdigest()[:40]
+        path = self._chunk_path(chunk_id)
+        if os.path.exists(path):
+            return chunk_id, 0
+        nonce = os.urandom(12)
+        blob = nonce + aead.encrypt(nonce, zlib.compress(data, 6), chunk_id.encode())
+        _atomic_write(path, blob)
+        return chunk_id, len(blob)
+
+    def _get_chunk(self, chunk_id):
+        _id_key, aead = self._subkeys()
+        try:
+            with open(self._chunk_path(chunk_id), 'rb') as f:
+                blob = f.read()
+        except FileNotFoundError:
+            raise BackupStoreError(f'Блок {chunk_id} отсутствует') from None
+        try:
+            return zlib.decompress(aead.decrypt(blob[:12], blob[12:], chunk_id.encode()))
+        except (InvalidTag, zlib.error):
+            raise BackupStoreError(f'Блок {chunk_id} повреждён') from None
+
+    def _chunk_sizes(self):
+        sizes = {}
+        if not os.path.isdir(self.chunks_dir):
+            return sizes
+        for prefix in os.scandir(self.chunks_dir):
+            if not prefix.is_dir():
+                continue
+            for entry in os.scandir(prefix.path):
+                if entry.is_file() and not entry.name.startswith('.'):
+                    sizes[entry.name] = entry.stat().st_size
+        return sizes
+
+    # --- Снимки ---
+    def _manifest_path(self, snapshot_id):
+        if not snapshot_id or os.path.basename(snapshot_id) != snapshot_id or snapshot_id.startswith('.'):
+            raise BackupStoreError('Неверный идентификатор снимка')
+        return os.path.join(self.snapshots_dir, f'{snapshot_id}.json')
+
+    def _manifests(self):
+        """Описания снимков от новых к старым."""
+        manifests = []
+        if not os.path.isdir(self.snapshots_dir):
+            return manifests
+        for entry in os.scandir(self.snapshots_dir):
+            if not entry.name.endswith('.json'):
+                continue
+            try:
+                with open(entry.path, 'r', encoding='utf-8') as f:
+                    manifests.append(json.load(f))
+            except (OSError, ValueError) as e:
+                print(f"⚠️ Пропущено повреждённое описание снимка {entry.name}: {e}")
+        manifests.sort(key=lambda m: (m['created_at'], m['id']), reverse=True)
+        return manifests
+
+    def snapshot(self, records=None, raw=None, reason='manual', source=None, created_at=None):
+        """
+        Сохраняет снимок: список записей (records) или байты файла, который не удалось
+        расшифровать (raw). После сохранения применяется политика хранения.
+        Возвращает описание снимка (без списка блоков) с new_bytes — сколько байт добавлено.
+        """
+        if (records is None) == (raw is None):
+            raise ValueError('нужен ровно один из аргументов records или raw')
+        created = created_at or datetime.now()
+        if records is not None:
+            kind, pieces, size = 'records', split_records(records), None
+        else:
+            kind, size = 'raw', len(raw)
+            pieces = [raw[i:i + RAW_CHUNK] for i in range(0, len(raw), RAW_CHUNK)] or [b'']
+        with self._lock:
+            chunk_ids, new_bytes = [], 0
+            for piece in pieces:
+                chunk_id, written = self._put_chunk(piece)
+                chunk_ids.append(chunk_id)
+                new_bytes += written
+            manifest = {
+                'id': f"{created.strftime('%Y%m%d_%H%M%S')}-{uuid.uuid4().hex[:6]}",
+                'created_at': created.isoformat(timespec='seconds'),
+                'reason': reason,
+                'source': source,
+                'kind': kind,
+                'records': len(records) if records is not None else None,
+                'size': size if size is not None else sum(len(p) for p in pieces),
+                'key_fingerprint': self.key_fingerprint(),
+                'uploads': self._references(records),
+                'chunks': chunk_ids,
+            }
+            _atomic_write(self._manifest_path(manifest['id']),
+                          json.dumps(manifest, ensure_ascii=False).encode('utf-8'))
+            self.apply_retention()
+        info = {k: v for k, v in manifest.items() if k not in ('chunks', 'uploads')}
+        info['new_bytes'] = new_bytes
+        return info
+
+    def _references(self, records):
+        if records is None or self.references is None:
+            return None
+        return sorted(self.references(records))
+
+    def referenced_uploads(self):
+        """
+        Имена загрузок, на которые ссылаются снимки kind=records. Снимкам без поля uploads
+        (созданным до его появления) список вычисляется по записям и дописывается в описание.
+        None, если ссылки какого-либо снимка неизвестны: снимки kind=raw не расшифровываются
+        текущим ключом, повреждённый снимок не читается.
+        """
+        names = set()
+        with self._lock:
+            for manifest in self._manifests():
+                if manifest['kind'] != 'records':
+                    return None
+                if manifest.get('uploads') is None:
+                    if self.references is None:
+                        return None
+                    try:
+                        _info, records = self.restore(manifest['id'])
+                    except (BackupStoreError, ValueError) as e:
+                        print(f"⚠️ Не удалось прочитать снимок {manifest['id']}: {e}")
+                        return None
+                    manifest['uploads'] = self._references(records)
+                    _atomic_write(self._manifest_path(manifest['id']),
+                                  json.dumps(manifest, ensure_ascii=False).encode('utf-8'))
+                names.update(manifest.get('uploads') or [])
+        return names
+
+    def list_snapshots(self):
+        """Снимки от новых к старым (без списков блоков)."""
+        with self._lock:
+            return [{k: v for k, v in m.items() if k not in ('chunks', 'uploads')} for m in self._manifests()]
+
+    def get(self, snapshot_id):
+        try:
+            with open(self._manifest_path(snapshot_id), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            raise BackupStoreError(f'Снимок {snapshot_id} не найден') from None
+        except ValueError as e:
+            raise BackupStoreError(f'Описание снимка {snapshot_id} повреждено: {e}') from None
+
+    def restore(self, snapshot_id):
+        """Содержимое снимка: (описание, список записей) для kind=records или (описание, байты) для raw."""
+        with self._lock:
+            manifest = self.get(snapshot_id)
+            data = b''.join(self._get_chunk(chunk_id) for chunk_id in manifest['chunks'])
+        if manifest['kind'] == 'raw':
+            return manifest, data
+        return manifest, [json.loads(line) for line in data.decode('utf-8').splitlines() if line]
+
+    def delete(self, snapshot_id):
+        with self._lock:
+            try:
+                os.remove(self._manifest_path(snapshot_id))
+            except FileNotFoundError:
+                raise BackupStoreError(f'Снимок {snapshot_id} не найден') from None
+            return self._collect_chunks(self._manifests())
+
+    # --- Хранение и место на диске ---
+    def _collect_chunks(self, manifests):
+        """Удаляет блоки, на которые не ссылается ни один снимок. Возвращает (блоков, байт)."""
+        referenced = {chunk_id for m in manifests for chunk_id in m['chunks']}
+        removed = freed = 0
+        for chunk_id, size in self._chunk_sizes().items():
+            if chunk_id not in referenced:
+                try:
+                    os.remove(self._chunk_path(chunk_id))
+                except OSError:
+                    continue
+                removed += 1
+                freed += size
+        return removed, freed
+
+    def apply_retention(self):
+        """Удаляет снимки вне политики хранения и сверх предела места. Возвращает отчёт."""
+        with self._lock:
+            manifests = self._manifests()
+            keep = select_retained(manifests, self.keep_last, self.keep_daily, self.keep_weekly)
+            kept = [m for m in manifests if m['id'] in keep]
+            if self.max_bytes is not None and len(kept) > 1:
+                sizes = self._chunk_sizes()
+                refs = {}
+                for m in kept:
+                    for chunk_id in set(m['chunks']):
+                        refs[chunk_id] = refs.get(chunk_id, 0) + 1
+                total = sum(sizes.get(chunk_id, 0) for chunk_id in refs)
+                # Самые старые снимки уходят первыми; последний снимок не удаляется
+                while total > self.max_bytes and len(kept) > 1:
+                    oldest = kept.pop()
+                    for chunk_id in set(oldest['chunks']):
+                        refs[chunk_id] -= 1
+                        if not refs[chunk_id]:
+                            total -= sizes.get(chunk_id, 0)
+            kept_ids = {m['id'] for m in kept}
+            removed = [m['id'] for m in manifests if m['id'] not in kept_ids]
+            for snapshot_id in removed:
+                try:
+                    os.remove(self._manifest_path(snapshot_id))
+                except OSError as e:
+                    print(f"⚠️ Не удалось удалить снимок {snapshot_id}: {e}")
+            chunks_removed, freed = self._collect_chunks(kept) if removed else (0, 0)
+            return {'removed': removed, 'chunks_removed': chunks_removed, 'bytes_freed': freed}
+
+    def stats(self):
+        with self._lock:
+            manifests = self._manifests()
+            sizes = self._chunk_sizes()
+        logical = sum(m.get('size') or 0 for m in manifests)
+        stored = sum(sizes.values())
+        return {
+            'snapshots': len(manifests),
+            'chunks': len(sizes),
+            'stored_bytes': stored,
+            'logical_bytes': logical,
+            'max_bytes': self.max_bytes,
+            'retention': {'keep_last': self.keep_last, 'keep_daily': self.keep_daily, 'keep_weekly': self.keep_weekly},
+        }
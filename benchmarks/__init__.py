@@ -0,0 +1,10 @@
+"""
+Замеры производительности AI Manager.
+
+    python -m benchmarks.run --sizes 10,1000,10000
+    python -m benchmarks.compare benchmarks/results/old.json benchmarks/results/new.json
+
+Каждый запуск работает в отдельной временной директории данных с
+синтетическим зашифрованным хранилищем (см. vault_generator) и не трогает
+пользовательские данные.
+"""
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Сравнение двух прогонов benchmarks.run.
+
+    python -m benchmarks.compare benchmarks/results/old.json benchmarks/results/new.json
+
+Печатает медианы по каждому сценарию и размеру и отношение new/old.
+С --fail-above 1.2 завершается с кодом 1, если что-то замедлилось больше чем на 20%.
+"""
+
+import argparse
+import json
+import sys
+
+
+def load(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        report = json.load(f)
+    return report, {(r['benchmark'], r['size']): r for r in report.get('results', [])}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Сравнение результатов замеров AI Manager')
+    parser.add_argument('old')
+    parser.add_argument('new')
+    parser.add_argument('--metric', default='median_ms', choices=['min_ms', 'median_ms', 'mean_ms', 'max_ms'])
+    parser.add_argument('--fail-above', type=float, help='Порог отношения new/old для кода возврата 1')
+    args = parser.parse_args(argv)
+
+    old_report, old = load(args.old)
+    new_report, new = load(args.new)
+    print(f"old: {old_report.get('commit')}  ({old_report.get('timestamp')})")
+    print(f"new: {new_report.get('commit')}  ({new_report.get('timestamp')})")
+    print()
+    print(f"{'сценарий':<18} {'n':>7} {'old, мс':>12} {'new, мс':>12} {'new/old':>9}")
+
+    regressions = []
+    for key in sorted(set(old) | set(new), key=lambda k: (k[1], k[0])):
+        name, size = key
+        before = old.get(key, {}).get(args.metric)
+        after = new.get(key, {}).get(args.metric)
+        if before is None or after is None:
+            shown = lambda v: f"{v:>12.2f}" if v is not None else f"{'—':>12}"
+            print(f"{name:<18} {size:>7} {shown(before)} {shown(after)} {'—':>9}")
+            continue
+        ratio = after / before if before else float('inf')
+        marker = ''
+        if args.fail_above and ratio > args.fail_above:
+            regressions.append((name, size, ratio))
+            marker = '  ⚠️'
+        print(f"{name:<18} {size:>7} {before:>12.2f} {after:>12.2f} {ratio:>8.2f}x{marker}")
+
+    if regressions:
+        print()
+        print(f"❌ Замедление выше {args.fail_above:.2f}x: "
+              + ', '.join(f"{name}/{size} ({ratio:.2f}x)" for name, size, ratio in regressions))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
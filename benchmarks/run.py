@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+"""
+Запуск замеров AI Manager.
+
+    python -m benchmarks.run                       # размеры 10 и 1000
+    python -m benchmarks.run --sizes 10,1000,10000 --repeat 5
+    python -m benchmarks.run --only load,save,index --output results.json
+
+Приложение импортируется во временной директории данных (свой .env, config.json
+и выключенный YubiKey), хранилища генерируются vault_generator. Результат —
+JSON с хешем коммита, который можно сравнить через benchmarks.compare.
+"""
+
+import argparse
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager, redirect_stdout
+from datetime import datetime
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+BENCHMARKS = ('load', 'save', 'index', 'edit', 'import_external', 'change_main_key', 'export_package')
+DEFAULT_SIZES = (10, 1000)
+
+
+def git_revision():
+    """(короткий хеш коммита, есть ли незафиксированные изменения)."""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT,
+                                capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=REPO_ROOT,
+                                    capture_output=True, text=True, check=True).stdout.strip())
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+
+@contextmanager
+def quiet(enabled=True):
+    """Глушит отладочный вывод приложения во время замеров."""
+    if not enabled:
+        yield
+        return
+    with redirect_stdout(io.StringIO()):
+        yield
+
+
+def summarize(samples):
+    ms = [s * 1000 for s in samples]
+    return {
+        'repeat': len(ms),
+        'min_ms': round(min(ms), 3),
+        'median_ms': round(statistics.median(ms), 3),
+        'mean_ms': round(statistics.fmean(ms), 3),
+        'max_ms': round(max(ms), 3),
+        'stdev_ms': round(statistics.stdev(ms), 3) if len(ms) > 1 else 0.0,
+    }
+
+
+class BenchmarkEnvironment:
+    """Изолированная директория данных и импортированное в ней приложение."""
+
+    def __init__(self, workdir):
+        self.workdir = Path(workdir)
+        self.app = None
+        self.client = None
+
+    def setup(self):
+        from cryptography.fernet import Fernet
+
+        self.workdir.mkdir(parents=True, exist_ok=True)
+        (self.workdir / 'data').mkdir(exist_ok=True)
+        (self.workdir / 'uploads').mkdir(exist_ok=True)
+        key = Fernet.generate_key().decode()
+        (self.workdir / '.env').write_text(f'SECRET_KEY={key}\n', encoding='utf-8')
+        (self.workdir / 'config.json').write_text(json.dumps({'active_data_file': None}), encoding='utf-8')
+        (self.workdir / 'yubikey_config.json').write_text(
+            json.dumps({'enabled': False, 'keys': []}), encoding='utf-8')
+        if (REPO_ROOT / 'ai_services_schema.json').exists():
+            shutil.copy(REPO_ROOT / 'ai_services_schema.json', self.workdir / 'ai_services_schema.json')
+
+        # Приложение берёт директорию данных и .env из текущей директории (режим разработки)
+        os.chdir(self.workdir)
+        os.environ['SECRET_KEY'] = key
+        os.environ.pop('YUBIKEY_STATIC_PASSWORDS', None)
+        if str(REPO_ROOT) not in sys.path:
+            sys.path.insert(0, str(REPO_ROOT))
+        with quiet():
+            import app as app_module
+        self.app = app_module
+        self.app.app.template_folder = str(REPO_ROOT / 'templates')
+        self.app.app.static_folder = str(REPO_ROOT / 'static')
+        self.client = self.app.app.test_client()
+
+    def make_vault(self, size, seed=0):
+        from benchmarks import vault_generator
+        services = vault_generator.generate_services(size, self.app.encrypt_data, seed=seed)
+        path = self.workdir / 'data' / f'bench_{size}.enc'
+        vault_generator.write_vault(str(path), services, self.app.fernet)
+        vault_generator.write_receipt_files(self.app.app.config['UPLOAD_FOLDER'], services, seed=seed)
+        self.app.upload_store.adopt_legacy_files()
+        return path, services
+
+    def make_external_vault(self, size, seed=1):
+        """Хранилище «другой установки» со своим ключом; половина имён совпадает с основным."""
+        from cryptography.fernet import Fernet
+        from benchmarks import vault_generator
+        key = Fernet.generate_key()
+        external = Fernet(key)
+        encrypt = lambda value: external.encrypt(value.encode()).decode() if value else ""
+        services = vault_generator.generate_services(size, encrypt, seed=seed, receipt_every=0)
+        for service in services[::2]:
+            service['name'] = f"External {service['id']}"
+        path = self.workdir / 'data' / f'external_{size}.enc'
+        vault_generator.write_vault(str(path), services, external)
+        return path, key.decode()
+
+    def activate(self, path):
+        self.app.app.config['active_data_file'] = str(path)
+
+    @contextmanager
+    def request(self, *args, **kwargs):
+        with self.app.app.test_request_context(*args, **kwargs):
+            yield
+
+
+def _restore_key(env, state):
+    env.app.SECRET_KEY, env.app.fernet = state
+    os.environ['SECRET_KEY'] = state[0]
+
+
+def run_size(env, size, repeat, only, verbose):
+    vault_path, services = env.make_vault(size)
+    pristine = vault_path.read_bytes()
+    env.activate(vault_path)
+    edit_id = services[len(services) // 2]['id']
+    results = []
+
+    def measure(name, func, setup=None, teardown=None, extra=None):
+        if only and name not in only:
+            return
+        samples = []
+        for i in range(repeat + 1):  # первый прогон — прогрев
+            if setup:
+                setup()
+            with quiet(not verbose):
+                start = time.perf_counter()
+                func()
+                elapsed = time.perf_counter() - start
+            if teardown:
+                teardown()
+            if i:
+                samples.append(elapsed)
+        entry = {'benchmark': name, 'size': size, **summarize(samples)}
+        if extra:
+            entry.update(extra())
+        results.append(entry)
+        print(f"  {name:<18} n={size:<6} median {entry['median_ms']:>10.2f} мс  min {entry['min_ms']:>10.2f} мс")
+
+    def reset_vault():
+        vault_path.write_bytes(pristine)
+        env.activate(vault_path)
+
+    def load():
+        with env.request('/'):
+            env.app.load_ai_services()
+    measure('load', load, extra=lambda: {'vault_bytes': len(pristine)})
+
+    with env.request('/'), quiet():
+        loaded = env.app.load_ai_services()
+
+    def save():
+        with env.request('/'):
+            env.app.save_ai_services(loaded)
+    measure('save', save, teardown=reset_vault)
+
+    def index():
+        response = env.client.get('/')
+        assert response.status_code == 200, response.status_code
+    measure('index', index)
+
+    def edit():
+        response = env.client.get(f'/edit/{edit_id}')
+        assert response.status_code == 200, response.status_code
+    measure('edit', edit)
+
+    if not only or 'import_external' in only:
+        external_path, external_key = env.make_external_vault(size)
+        external_bytes = external_path.read_bytes()
+
+        def import_external():
+            response = env.client.post('/data/import_external', data={
+                'external_key': external_key,
+                'external_file': (io.BytesIO(external_bytes), 'servers.json.enc'),
+            }, content_type='multipart/form-data')
+            assert response.status_code == 302, response.status_code
+
+        def cleanup_import():
+            merged = env.app.get_active_data_path()
+            if merged and Path(merged) != vault_path and os.path.exists(merged):
+                os.remove(merged)
+            reset_vault()
+        measure('import_external', import_external, teardown=cleanup_import)
+
+    if not only or 'change_main_key' in only:
+        from cryptography.fernet import Fernet
+        saved = (env.app.SECRET_KEY, env.app.fernet)
+        env_file = env.workdir / '.env'
+        env_text = env_file.read_text(encoding='utf-8')
+
+        def change_main_key():
+            new_key = change_main_key.key = Fernet.generate_key().decode()
+            # Маршрут в шаблоне указывает на /settings, поэтому вызываем обработчик напрямую
+            with env.request('/settings', method='POST', data={'new_key': new_key, 'confirm_key': new_key}):
+                env.app.change_main_key()
+
+        def cleanup_key_change():
+            if env.app.SECRET_KEY == change_main_key.key:
+                env.app.upload_store.rekey(change_main_key.key, saved[0])
+            for produced in (env.workdir / 'data').glob('*_????????_??????.enc'):
+                if produced.name.startswith(('backup_before_key_change_', 'ai_services_reencrypted_')):
+                    produced.unlink()
+            env_file.write_text(env_text, encoding='utf-8')
+            _restore_key(env, saved)
+            reset_vault()
+        measure('change_main_key', change_main_key, teardown=cleanup_key_change)
+
+    def export_package():
+        response = env.client.get('/data/export_package')
+        total = sum(len(chunk) for chunk in response.response)
+        response.close()
+        export_package.bytes = total
+    export_package.bytes = 0
+    measure('export_package', export_package, extra=lambda: {'archive_bytes': export_package.bytes})
+
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Замеры производительности AI Manager')
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)),
+                        help='Размеры хранилищ через запятую (по умолчанию 10,1000)')
+    parser.add_argument('--repeat', type=int, default=3, help='Число замеров на сценарий (после прогрева)')
+    parser.add_argument('--only', default='', help=f"Сценарии через запятую: {', '.join(BENCHMARKS)}")
+    parser.add_argument('--output', help='Путь к JSON с результатами (по умолчанию benchmarks/results/<commit>.json)')
+    parser.add_argument('--workdir', help='Директория данных (по умолчанию временная, удаляется после запуска)')
+    parser.add_argument('--verbose', action='store_true', help='Не скрывать вывод приложения')
+    args = parser.parse_args(argv)
+
+    sizes = [int(s) for s in args.sizes.split(',') if s.strip()]
+    only = {s.strip() for s in args.only.split(',') if s.strip()}
+    unknown = only - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"Неизвестные сценарии: {', '.join(sorted(unknown))}")
+
+    commit, dirty = git_revision()
+    output = Path(args.output) if args.output else \
+        REPO_ROOT / 'benchmarks' / 'results' / f"{commit or 'unknown'}{'-dirty' if dirty else ''}.json"
+    output = output.resolve()
+
+    workdir = Path(args.workdir).resolve() if args.workdir else Path(tempfile.mkdtemp(prefix='allmanagerc-bench-'))
+    cwd = os.getcwd()
+    env = BenchmarkEnvironment(workdir)
+    print(f"🧪 Замеры AI Manager (commit {commit or '?'}{', есть изменения' if dirty else ''})")
+    print(f"📁 Директория данных: {workdir}")
+    results = []
+    try:
+        env.setup()
+        for size in sizes:
+            print(f"▶️ Хранилище на {size} записей")
+            results += run_size(env, size, max(1, args.repeat), only, args.verbose)
+    finally:
+        os.chdir(cwd)
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        'commit': commit,
+        'dirty': dirty,
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'sizes': sizes,
+        'repeat': args.repeat,
+        'results': results,
+    }
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2, ensure_ascii=False) + '\n', encoding='utf-8')
+    print(f"📊 Результаты сохранены: {output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Генератор синтетических хранилищ для замеров.
+
+Записи похожи на настоящие: учётные данные, подписка, SSH/панель/хостер
+для серверных записей, чеки и список возможностей. Секретные поля шифруются
+функцией encrypt_data самого приложения, поэтому файл читается тем же кодом,
+что и пользовательские данные.
+"""
+
+import json
+import os
+import random
+from datetime import date, datetime, timedelta
+
+SERVICE_TYPES = [
+    "AI Development Tool", "AI Writing Assistant", "AI Image Generator",
+    "AI Video Generator", "Media Platform", "Professional Network",
+    "Cloud Service", "Productivity Tool"
+]
+PROVIDERS = ["OpenAI", "Anthropic", "Google", "Hetzner", "DigitalOcean", "Vultr", "Midjourney", "GitHub"]
+FEATURES = ["API", "Chat", "Code", "Images", "Voice", "Team", "SSO", "Backups", "IPv6", "DDoS protection"]
+CURRENCIES = ["USD", "EUR", "RUB", "GBP"]
+CYCLES = ["weekly", "monthly", "quarterly", "yearly"]
+GRADIENTS = ["#667eea", "#f093fb", "#4facfe", "#43e97b", "#fa709a", "#30cfd0"]
+
+RECEIPT_SIZE = 16 * 1024
+
+
+def _secret(rng, length=16):
+    alphabet = 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789!@#$%'
+    return ''.join(rng.choice(alphabet) for _ in range(length))
+
+
+def generate_service(service_id, encrypt, rng, receipts=0):
+    """Одна запись сервиса; каждая третья — сервер с SSH/панелью/хостером."""
+    created = datetime(2024, 1, 1) + timedelta(minutes=rng.randint(0, 600_000))
+    name = f"{rng.choice(PROVIDERS)} {service_id}"
+    service = {
+        "id": service_id,
+        "name": name,
+        "service_type": rng.choice(SERVICE_TYPES),
+        "provider": rng.choice(PROVIDERS),
+        "login_url": f"https://login.example{service_id % 97}.com/account/{service_id}",
+        "preferred_oauth_method": rng.choice(["", "google", "github"]),
+        "credentials": {
+            "username": encrypt(f"user{service_id}@example.com"),
+            "password": encrypt(_secret(rng, 20)),
+            "additional_info": encrypt(f"recovery codes: {_secret(rng, 32)}")
+        },
+        "subscription": {
+            "plan_name": rng.choice(["Free", "Plus", "Pro", "Team", "Enterprise"]),
+            "cost_monthly": round(rng.uniform(0, 200), 2),
+            "currency": rng.choice(CURRENCIES),
+            "billing_cycle": rng.choice(CYCLES),
+            "next_payment_date": (date.today() + timedelta(days=rng.randint(-30, 365))).isoformat(),
+            "auto_renewal": rng.random() < 0.7,
+            "payment_method": rng.choice(["Visa", "MasterCard", "PayPal", "Crypto"]),
+            "notes": "Синтетическая запись для замеров"
+        },
+        "personal_cabinet": {
+            "dashboard_url": f"https://dashboard.example.com/{service_id}",
+            "account_email": encrypt(f"billing{service_id}@example.com")
+        },
+        "features": rng.sample(FEATURES, rng.randint(1, 5)),
+        "status": rng.choice(["active", "active", "active", "trial", "inactive"]),
+        "notes": "",
+        "gradient_color": rng.choice(GRADIENTS),
+        "created_at": created.isoformat(),
+        "updated_at": (created + timedelta(days=rng.randint(0, 300))).isoformat()
+    }
+
+    if service_id % 3 == 0:
+        ip = f"10.{(service_id >> 16) & 255}.{(service_id >> 8) & 255}.{service_id & 255}"
+        service.update({
+            "ip": ip,
+            "os": rng.choice(["Ubuntu 22.04", "Debian 12", "Windows Server 2022"]),
+            "ssh_credentials": {
+                "user": "deploy",
+                "password": encrypt(_secret(rng, 24)),
+                "root_password": encrypt(_secret(rng, 24)),
+                "root_login_allowed": rng.random() < 0.2
+            },
+            "panel_credentials": {
+                "url": f"https://{ip}:8443/panel",
+                "user": encrypt("admin"),
+                "password": encrypt(_secret(rng, 18))
+            },
+            "hoster_credentials": {
+                "url": "https://my.hoster.example.com",
+                "user": encrypt(f"client{service_id}"),
+                "password": encrypt(_secret(rng, 18)),
+                "login_method": "password"
+            },
+            "geolocation": {"ip": ip, "country": "DE", "org": "AS24940 Hetzner Online GmbH"},
+            "payment_info": {"next_due_date": service["subscription"]["next_payment_date"],
+                             "payment_period": "monthly"}
+        })
+
+    if receipts:
+        info = service.setdefault("payment_info", {})
+        info["receipts"] = [{
+            "filename": f"{service_id}_{created:%Y%m%d%H%M%S}_{n}_receipt.pdf",
+            "original_name": f"receipt_{n}.pdf",
+            "description": f"Чек #{n}",
+            "upload_date": (created + timedelta(days=30 * n)).isoformat()
+        } for n in range(receipts)]
+    return service
+
+
+def generate_services(count, encrypt, seed=0, receipt_every=10, receipts_per_service=2):
+    """Список из count записей; у каждой receipt_every-й записи есть чеки."""
+    rng = random.Random(seed)
+    return [
+        generate_service(i, encrypt, rng,
+                         receipts=receipts_per_service if receipt_every and i % receipt_every == 0 else 0)
+        for i in range(1, count + 1)
+    ]
+
+
+def write_vault(path, services, fernet):
+    """Шифрует список записей целиком (формат активного файла данных)."""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    payload = json.dumps(services, ensure_ascii=False, indent=2).encode('utf-8')
+    with open(path, 'wb') as f:
+        f.write(fernet.encrypt(payload))
+    return path
+
+
+def write_receipt_files(upload_dir, services, size=RECEIPT_SIZE, seed=0):
+    """Создаёт файлы чеков, упомянутые в записях (для замера экспорта архива)."""
+    rng = random.Random(seed)
+    os.makedirs(upload_dir, exist_ok=True)
+    written = 0
+    for service in services:
+        for receipt in service.get("payment_info", {}).get("receipts", []):
+            with open(os.path.join(upload_dir, receipt["filename"]), 'wb') as f:
+                f.write(rng.randbytes(size))
+            written += 1
+    return written
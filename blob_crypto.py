@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+Шифрование загруженных файлов (иконки, чеки) ключом хранилища.
+
+Формат блоба:
+
+    заголовок (80 байт)
+        magic            8   b'AMBLOB\\x01\\x00'
+        chunk_size       4   размер блока открытого текста, big-endian
+        plaintext_size   8   размер исходного файла, big-endian
+        wrap_nonce      12
+        wrapped_key     48   ключ файла (32 байта), зашифрованный AES-GCM ключом KEK
+    блоки: AES-256-GCM(ключ файла), nonce = номер блока (11 байт) + признак последнего блока
+
+Ключ файла случайный; KEK выводится из SECRET_KEY через HKDF-SHA256. Поэтому
+смена главного ключа перезаписывает только 48 байт заголовка (rewrap),
+а не весь файл. Каждый блок аутентифицирован отдельно: любой диапазон байтов
+расшифровывается без чтения всего файла, а подмена, перестановка или
+обрезка блоков обнаруживаются.
+"""
+
+import base64
+import os
+import struct
+
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+MAGIC = b'AMBLOB\x01\x00'
+HEADER_STRUCT = struct.Struct('>8sIQ12s48s')
+HEADER_SIZE = HEADER_STRUCT.size
+TAG_SIZE = 16
+DEFAULT_CHUNK_SIZE = 64 * 1024
+KEK_INFO = b'allmanagerc/uploads/kek/v1'
+
+
+class BlobCryptoError(ValueError):
+    """Неверный ключ, повреждённый или подменённый блоб."""
+
+
+def derive_kek(secret_key, info=KEK_INFO):
+    """Ключ для шифрования ключей файлов, выведенный из SECRET_KEY (Fernet-ключ в base64)."""
+    if isinstance(secret_key, str):
+        secret_key = secret_key.encode()
+    try:
+        material = base64.urlsafe_b64decode(secret_key)
+    except ValueError:
+        material = secret_key
+    return HKDF(algorithm=hashes.SHA256(), length=32, salt=None, info=info).derive(material)
+
+
+def is_encrypted(path):
+    try:
+        with open(path, 'rb') as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+
+def _chunk_nonce(index, last):
+    return index.to_bytes(11, 'big') + (b'\x01' if last else b'\x00')
+
+
+def _chunk_count(size, chunk_size):
+    return max(1, -(-size // chunk_size))
+
+
+def _wrap(kek, file_key, chunk_size, size):
+    nonce = os.urandom(12)
+    aad = MAGIC + struct.pack('>IQ', chunk_size, size)
+    return HEADER_STRUCT.pack(MAGIC, chunk_size, size, nonce, AESGCM(kek).encrypt(nonce, file_key, aad))
+
+
+def _unwrap(kek, header):
+    magic, chunk_size, size, nonce, wrapped = HEADER_STRUCT.unpack(header)
+    if magic != MAGIC:
+        raise BlobCryptoError('Файл не является зашифрованным блобом')
+    try:
+        file_key = AESGCM(kek).decrypt(nonce, wrapped, MAGIC + struct.pack('>IQ', chunk_size, size))
+    except InvalidTag:
+        raise BlobCryptoError('Неверный ключ или повреждённый заголовок блоба') from None
+    return file_key, chunk_size, size
+
+
+def encrypt_stream(src, dst, secret_key, size, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Шифрует size байт из src в dst блоками; в памяти не больше одного блока."""
+    file_key = AESGCM.generate_key(bit_length=256)
+    aead = AESGCM(file_key)
+    dst.write(_wrap(derive_kek(secret_key), file_key, chunk_size, size))
+    total = _chunk_count(size, chunk_size)
+    for index in range(total):
+        block = src.read(chunk_size)
+        expected = min(chunk_size, size - index * chunk_size)
+        if len(block) != expected:
+            raise BlobCryptoError('Исходный файл изменился во время шифрования')
+        dst.write(aead.encrypt(_chunk_nonce(index, index == total - 1), block, None))
+
+
+def rewrap(path, old_key, new_key):
+    """Перешифровывает ключ файла под новый SECRET_KEY, переписывая только заголовок."""
+    with open(path, 'r+b') as f:
+        header = f.read(HEADER_SIZE)
+        if len(header) != HEADER_SIZE:
+            raise BlobCryptoError('Повреждённый заголовок блоба')
+        file_key, chunk_size, size = _unwrap(derive_kek(old_key), header)
+        f.seek(0)
+        # Заголовок короче сектора диска, запись на месте не оставляет «половинного» состояния
+        f.write(_wrap(derive_kek(new_key), file_key, chunk_size, size))
+        f.flush()
+        os.fsync(f.fileno())
+
+
+class EncryptedBlob:
+    """Чтение зашифрованного блоба: размер, произвольный диапазон, последовательное чтение."""
+
+    def __init__(self, path, secret_key):
+        self.path = path
+        with open(path, 'rb') as f:
+            header = f.read(HEADER_SIZE)
+        if len(header) != HEADER_SIZE:
+            raise BlobCryptoError('Повреждённый заголовок блоба')
+        file_key, self.chunk_size, self.size = _unwrap(derive_kek(secret_key), header)
+        self._aead = AESGCM(file_key)
+        self._chunks = _chunk_count(self.size, self.chunk_size)
+        self.mtime = os.path.getmtime(path)
+
+    def _read_chunk(self, f, index):
+        f.seek(HEADER_SIZE + index * (self.chunk_size + TAG_SIZE))
+        expected = min(self.chunk_size, self.size - index * self.chunk_size)
+        data = f.read(expected + TAG_SIZE)
+        try:
+            return self._aead.decrypt(_chunk_nonce(index, index == self._chunks - 1), data, None)
+        except InvalidTag:
+            raise BlobCryptoError(f'Блок {index} повреждён или подменён') from None
+
+    def iter_range(self, start=0, end=None):
+        """Открытый текст байтов [start, end) блоками, без чтения файла целиком."""
+        end = self.size if end is None else min(end, self.size)
+        if start >= end:
+            return
+        first, last = start // self.chunk_size, (end - 1) // self.chunk_size
+        with open(self.path, 'rb') as f:
+            for index in range(first, last + 1):
+                block = self._read_chunk(f, index)
+                offset = index * self.chunk_size
+                yield block[max(start - offset, 0):end - offset]
+
+    def open(self):
+        return _ChunkReader(self.iter_range())
+
+    def read_all(self):
+        return b''.join(self.iter_range())
+
+
+class PlainBlob:
+    """Незашифрованный блоб (старые файлы или шифрование выключено) с тем же интерфейсом."""
+
+    def __init__(self, path, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.path = path
+        self.chunk_size = chunk_size
+        st = os.stat(path)
+        self.size = st.st_size
+        self.mtime = st.st_mtime
+
+    def iter_range(self, start=0, end=None):
+        end = self.size if end is None else min(end, self.size)
+        with open(self.path, 'rb') as f:
+            f.seek(start)
+            remaining = end - start
+            while remaining > 0:
+                block = f.read(min(self.chunk_size, remaining))
+                if not block:
+                    break
+                remaining -= len(block)
+                yield block
+
+    def open(self):
+        return open(self.path, 'rb')
+
+    def read_all(self):
+        with open(self.path, 'rb') as f:
+            return f.read()
+
+
+class _ChunkReader:
+    """Файлоподобная обёртка над генератором блоков (read(n) для zipfile/shutil)."""
+
+    def __init__(self, chunks):
+        self._chunks = chunks
+        self._buffer = b''
+
+    def read(self, n=-1):
+        while n < 0 or len(self._buffer) < n:
+            block = next(self._chunks, None)
+            if block is None:
+                break
+            self._buffer += block
+        if n < 0:
+            data, self._buffer = self._buffer, b''
+        else:
+            data, self._buffer = self._buffer[:n], self._buffer[n:]
+        return data
+
+    def close(self):
+        self._chunks.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open_blob(path, secret_key):
+    """EncryptedBlob или PlainBlob в зависимости от содержимого файла."""
+    if is_encrypted(path):
+        if not secret_key:
+            raise BlobCryptoError('Файл зашифрован, но SECRET_KEY не задан')
+        return EncryptedBlob(path, secret_key)
+    return PlainBlob(path)
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Общие шаги запуска AI Manager.
+
+- Единый поиск и загрузка .env (один список путей для app.py и yubikey_auth.py)
+- Маркер версии миграций данных: миграции выполняются один раз, а не при каждом запуске
+"""
+
+import os
+import sys
+from pathlib import Path
+
+APP_NAME = "AllManagerC"
+
+# Версия схемы миграций; увеличить при добавлении нового шага в run_startup_migrations()
+# 1 — перенос старых файлов данных, 2 — упорядочивание чеков в файлах данных
+MIGRATION_VERSION = 2
+MIGRATION_MARKER = '.migration_version'
+
+_ENV_STATE = {'loaded': False, 'paths': []}
+
+
+def env_candidates():
+    """Возможные пути к .env в порядке приоритета (первый найденный важнее)."""
+    candidates = [Path.cwd() / ".env"]
+
+    if getattr(sys, 'frozen', False):
+        exe_dir = Path(sys.executable).parent
+        if sys.platform == 'darwin':
+            # Ресурсы .app бандла, затем директория данных пользователя
+            candidates.append(exe_dir.parent / "Resources" / ".env")
+            candidates.append(Path.home() / "Library" / "Application Support" / APP_NAME / ".env")
+        elif sys.platform == 'win32':
+            candidates.append(Path(os.environ.get('APPDATA', str(Path.home()))) / APP_NAME / '.env')
+        else:
+            candidates.append(Path.home() / '.local' / 'share' / APP_NAME / '.env')
+        candidates.append(exe_dir / '.env')
+
+    script_dir = Path(__file__).resolve().parent
+    candidates.append(script_dir / ".env")
+    candidates.append(script_dir.parent / ".env")
+
+    unique = []
+    for path in candidates:
+        if path not in unique:
+            unique.append(path)
+    return unique
+
+
+def load_env():
+    """
+    Загружает переменные из всех найденных .env (однократно за процесс).
+    Значения из файлов с большим приоритетом и из окружения не перезаписываются.
+    Возвращает список загруженных файлов. Содержимое файлов не выводится.
+    """
+    if _ENV_STATE['loaded']:
+        return list(_ENV_STATE['paths'])
+
+    from dotenv import load_dotenv
+
+    loaded = []
+    for env_path in env_candidates():
+        if env_path.is_file():
+            load_dotenv(env_path, override=False)
+            loaded.append(env_path)
+
+    if loaded:
+        print(f"📁 Загружен .env: {', '.join(str(p) for p in loaded)}")
+    else:
+        print("❌ .env файл не найден")
+
+    _ENV_STATE['loaded'] = True
+    _ENV_STATE['paths'] = loaded
+    return list(loaded)
+
+
+def read_migration_version(app_data_dir):
+    try:
+        with open(os.path.join(app_data_dir, 'data', MIGRATION_MARKER), 'r', encoding='utf-8') as f:
+            return int(f.read().strip() or 0)
+    except (OSError, ValueError):
+        return 0
+
+
+def write_migration_version(app_data_dir, version=MIGRATION_VERSION):
+    marker_path = os.path.join(app_data_dir, 'data', MIGRATION_MARKER)
+    os.makedirs(os.path.dirname(marker_path), exist_ok=True)
+    tmp_path = f"{marker_path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(str(version))
+    os.replace(tmp_path, marker_path)
@@ -59,7 +59,7 @@ pyinstaller --name="AllManagerC" \
     --hidden-import=cryptography \
     --hidden-import=requests \
     --hidden-import=webview \
-    --hidden-import=yubico_client \
+    --hidden-import=yubicloud_client \
     --exclude-module=PyQt5 \
     --exclude-module=PyQt6 \
     --exclude-module=PySide2 \
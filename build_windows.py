@@ -89,8 +89,7 @@ def build():
         "--hidden-import=webview.platforms.edgehtml",
         "--hidden-import=webview.platforms.mshtml",
         "--hidden-import=webview.platforms.qt",
-        "--hidden-import=yubico_client",
-        "--hidden-import=yubico_client.yubico_exceptions",
+        "--hidden-import=yubicloud_client",
         "--exclude-module=PyQt6",
         "--exclude-module=PyQt5",
         "--exclude-module=PySide6",
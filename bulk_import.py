@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""
+Массовый импорт сервисов из CSV и JSON.
+
+Поддерживаются экспорты менеджеров паролей (Chrome/Edge, Firefox, Bitwarden
+CSV и JSON, LastPass, 1Password) и собственный формат записей (JSON-список
+или {"services": [...]}, как отдаёт /api/services). Столбцы сопоставляются
+со схемой записи по таблице синонимов (COLUMN_ALIASES).
+
+CSV читается построчно; строки обрабатываются пачками: секретные поля пачки
+шифруются в пуле потоков, готовые записи добавляются к списку. Вызывающий
+код сохраняет файл данных один раз в конце.
+"""
+
+import csv
+import io
+import json
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import urlparse
+
+FORMATS = ('csv', 'json')
+BATCH_SIZE = 500
+DEFAULT_WORKERS = min(8, os.cpu_count() or 1)
+# Сколько ошибок строк перечислять в отчёте (счётчик — по всем)
+MAX_REPORTED_ERRORS = 50
+
+# Поле записи -> синонимы столбцов (после нормализации: нижний регистр, «_» вместо пробелов, точек, дефисов)
+COLUMN_ALIASES = {
+    'name': ('name', 'title', 'service', 'service_name'),
+    'login_url': ('login_url', 'url', 'login_uri', 'login_uris', 'uri', 'website', 'web_site', 'hostname'),
+    'credentials.username': ('credentials_username', 'username', 'login_username', 'user_name', 'user', 'login'),
+    'credentials.password': ('credentials_password', 'password', 'login_password'),
+    'credentials.additional_info': ('credentials_additional_info', 'additional_info', 'login_totp', 'totp', 'otpauth'),
+    'personal_cabinet.account_email': ('personal_cabinet_account_email', 'account_email', 'email'),
+    'personal_cabinet.dashboard_url': ('personal_cabinet_dashboard_url', 'dashboard_url'),
+    'service_type': ('service_type', 'category', 'folder', 'grouping'),
+    'provider': ('provider', 'vendor'),
+    'status': ('status',),
+    'notes': ('notes', 'note', 'extra', 'comments', 'comment'),
+    'features': ('features', 'tags'),
+    'subscription.plan_name': ('subscription_plan_name', 'plan_name', 'plan'),
+    'subscription.cost_monthly': ('subscription_cost_monthly', 'cost_monthly', 'cost', 'price'),
+    'subscription.currency': ('subscription_currency', 'currency'),
+    'subscription.billing_cycle': ('subscription_billing_cycle', 'billing_cycle'),
+    'subscription.next_payment_date': ('subscription_next_payment_date', 'next_payment_date'),
+    'subscription.payment_method': ('subscription_payment_method', 'payment_method'),
+    'subscription.notes': ('subscription_notes',),
+}
+_ALIAS_TO_FIELD = {alias: field for field, aliases in COLUMN_ALIASES.items() for alias in aliases}
+_NORMALIZE_RE = re.compile(r'[\s.\-]+')
+
+
+class BulkImportError(ValueError):
+    """Файл не удаётся разобрать как CSV/JSON или в нём нет ни одного известного столбца."""
+
+
+def normalize_column(column):
+    return _NORMALIZE_RE.sub('_', str(column).strip().lower()).strip('_')
+
+
+def detect_format(filename, head=b''):
+    extension = os.path.splitext(filename or '')[1].lower().lstrip('.')
+    if extension in FORMATS:
+        return extension
+    return 'json' if head.lstrip()[:1] in (b'[', b'{') else 'csv'
+
+
+def _flatten(item, prefix=''):
+    """Вложенные объекты JSON -> плоский словарь с ключами через точку."""
+    flat = {}
+    for key, value in item.items():
+        path = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(_flatten(value, f"{path}."))
+        else:
+            flat[path] = value
+    return flat
+
+
+def iter_rows(stream, fmt):
+    """Строки файла как словари «столбец -> значение». CSV читается потоково."""
+    if fmt == 'csv':
+        text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+        try:
+            yield from csv.DictReader(text)
+        except csv.Error as e:
+            raise BulkImportError(f'Ошибка разбора CSV: {e}') from None
+        finally:
+            text.detach()
+        return
+    try:
+        data = json.load(stream)
+    except (UnicodeDecodeError, ValueError) as e:
+        raise BulkImportError(f'Ошибка разбора JSON: {e}') from None
+    if isinstance(data, dict):
+        # Bitwarden: {"items": [...]}, API: {"services": [...]}
+        data = data.get('items', data.get('services'))
+    if not isinstance(data, list):
+        raise BulkImportError('Ожидается список записей или объект с полем items/services')
+    for item in data:
+        if isinstance(item, dict):
+            # У Bitwarden type 1 — логин; заметки, карты и личности пропускаем
+            if isinstance(item.get('type'), int) and item['type'] != 1:
+                continue
+            yield _flatten(item)
+
+
+def map_row(row):
+    """Строка -> {поле записи: значение} по таблице синонимов; лишние столбцы игнорируются."""
+    mapped = {}
+    for column, value in row.items():
+        field = _ALIAS_TO_FIELD.get(normalize_column(column)) if column is not None else None
+        if field is None or field in mapped:
+            continue
+        if isinstance(value, list):
+            # Bitwarden: login.uris = [{"uri": ...}], теги — список строк
+            if field == 'login_url':
+                value = next((u.get('uri') for u in value if isinstance(u, dict) and u.get('uri')), '')
+            else:
+                value = ', '.join(str(v) for v in value)
+        if value is None:
+            continue
+        value = str(value).strip() if not isinstance(value, (int, float, bool)) else value
+        if value != '':
+            mapped[field] = value
+    if 'name' not in mapped and mapped.get('login_url'):
+        mapped['name'] = urlparse(str(mapped['login_url'])).hostname or str(mapped['login_url'])
+    return mapped
+
+
+def build_service(mapped, service_id, now):
+    """Запись в схеме приложения с открытыми значениями секретных полей."""
+    try:
+        cost = float(str(mapped.get('subscription.cost_monthly', 0) or 0).replace(',', '.'))
+    except ValueError:
+        raise ValueError(f"Неверная стоимость: {mapped.get('subscription.cost_monthly')}") from None
+    features = mapped.get('features', '')
+    return {
+        'id': service_id,
+        'name': str(mapped['name']),
+        'service_type': mapped.get('service_type', ''),
+        'provider': mapped.get('provider', ''),
+        'login_url': mapped.get('login_url', ''),
+        'preferred_oauth_method': None,
+        'credentials': {
+            'username': mapped.get('credentials.username', ''),
+            'password': mapped.get('credentials.password', ''),
+            'additional_info': mapped.get('credentials.additional_info', ''),
+        },
+        'subscription': {
+            'plan_name': mapped.get('subscription.plan_name', ''),
+            'cost_monthly': cost,
+            'currency': mapped.get('subscription.currency', ''),
+            'billing_cycle': mapped.get('subscription.billing_cycle', ''),
+            'next_payment_date': mapped.get('subscription.next_payment_date', ''),
+            'auto_renewal': False,
+            'payment_method': mapped.get('subscription.payment_method', ''),
+            'notes': mapped.get('subscription.notes', ''),
+        },
+        'personal_cabinet': {
+            'dashboard_url': mapped.get('personal_cabinet.dashboard_url', ''),
+            'account_email': mapped.get('personal_cabinet.account_email', ''),
+        },
+        'features': [f.strip() for f in str(features).split(',') if f.strip()],
+        'status': mapped.get('status', 'active'),
+        'notes': mapped.get('notes', ''),
+        'created_at': now,
+        'updated_at': now,
+    }
+
+
+def encrypt_fields(services, secret_fields, encrypt_fn, workers=DEFAULT_WORKERS):
+    """Шифрует секретные поля записей пачки в пуле потоков (на месте)."""
+    slots = [(service[section], field) for service in services for section, field in secret_fields
+             if isinstance(service.get(section), dict) and service[section].get(field)]
+    if not slots:
+        return
+    values = [section[field] for section, field in slots]
+    step = max(1, len(values) // (workers * 4))
+    chunks = [values[i:i + step] for i in range(0, len(values), step)]
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        encrypted = [token for chunk in pool.map(lambda c: [encrypt_fn(v) for v in c], chunks) for token in chunk]
+    for (section, field), token in zip(slots, encrypted):
+        section[field] = token
+
+
+def _dedupe_key(service):
+    return (str(service.get('name', '')).strip().casefold(), str(service.get('login_url') or '').strip().casefold())
+
+
+def import_rows(rows, existing, secret_fields, encrypt_fn, decorate_fn=None, skip_duplicates=True,
+                workers=DEFAULT_WORKERS, batch_size=BATCH_SIZE):
+    """
+    Добавляет записи из rows к списку existing (на месте). decorate_fn(service) — оформление
+    новой записи (градиент). Дубликаты — то же имя и URL входа — пропускаются.
+    Возвращает отчёт: imported, skipped_duplicates, errors, error_rows.
+    """
+    report = {'imported': 0, 'skipped_duplicates': 0, 'errors': 0, 'error_rows': []}
+    seen = {_dedupe_key(s) for s in existing} if skip_duplicates else set()
+    next_id = max((s['id'] for s in existing if isinstance(s.get('id'), int)), default=0) + 1
+    now = datetime.now().isoformat()
+    batch = []
+    known_columns = False
+
+    def flush():
+        encrypt_fields(batch, secret_fields, encrypt_fn, workers)
+        existing.extend(batch)
+        report['imported'] += len(batch)
+        batch.clear()
+
+    for line, row in enumerate(rows, start=2):
+        mapped = map_row(row)
+        known_columns = known_columns or bool(mapped)
+        if 'name' not in mapped:
+            report['errors'] += 1
+            if len(report['error_rows']) < MAX_REPORTED_ERRORS:
+                report['error_rows'].append({'row': line, 'error': 'Нет имени и URL'})
+            continue
+        try:
+            service = build_service(mapped, next_id, now)
+        except ValueError as e:
+            report['errors'] += 1
+            if len(report['error_rows']) < MAX_REPORTED_ERRORS:
+                report['error_rows'].append({'row': line, 'error': str(e)})
+            continue
+        key = _dedupe_key(service)
+        if skip_duplicates and key in seen:
+            report['skipped_duplicates'] += 1
+            continue
+        seen.add(key)
+        if decorate_fn is not None:
+            decorate_fn(service)
+        batch.append(service)
+        next_id += 1
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+    if not known_columns and report['errors']:
+        raise BulkImportError('Не найдено ни одного известного столбца (name, url, username, password...)')
+    return report
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Лента изменений записей для AI Manager.
+
+Хранит последние события в кольцевом буфере и раздаёт их подписчикам
+(например, потокам SSE-ответов /events). Каждое событие описывает
+изменение одной записи: id, версию (ETag) и вид изменения.
+"""
+
+import itertools
+import json
+import queue
+import threading
+import time
+from collections import deque
+
+# Виды событий
+CREATED = 'created'
+UPDATED = 'updated'
+DELETED = 'deleted'
+RELOAD = 'reload'  # Сменился активный файл данных — нужен полный перерендер
+
+
+def diff_versions(old_versions, new_versions):
+    """
+    Сравнивает два словаря {id записи: версия} и возвращает список
+    кортежей (id, версия, вид изменения).
+    """
+    changes = []
+    for record_id, version in new_versions.items():
+        if record_id not in old_versions:
+            changes.append((record_id, version, CREATED))
+        elif old_versions[record_id] != version:
+            changes.append((record_id, version, UPDATED))
+    for record_id, version in old_versions.items():
+        if record_id not in new_versions:
+            changes.append((record_id, version, DELETED))
+    return changes
+
+
+class ChangeFeed:
+    """Потокобезопасная лента событий с подписчиками и буфером для догрузки."""
+
+    def __init__(self, history_size=256, subscriber_queue_size=512):
+        self._lock = threading.Lock()
+        self._history = deque(maxlen=history_size)
+        self._subscribers = set()
+        self._seq = itertools.count(1)
+        self._subscriber_queue_size = subscriber_queue_size
+
+    def publish(self, kind, record_id=None, version=None, source='app', **extra):
+        """Публикует событие и возвращает его."""
+        with self._lock:
+            event = {
+                'seq': next(self._seq),
+                'kind': kind,
+                'id': record_id,
+                'version': version,
+                'source': source,
+                'ts': time.time()
+            }
+            event.update(extra)
+            self._history.append(event)
+            subscribers = list(self._subscribers)
+
+        for q in subscribers:
+            try:
+                q.put_nowait(event)
+            except queue.Full:
+                # Медленный клиент: вместо потери событий просим его перечитать всё
+                try:
+                    while True:
+                        q.get_nowait()
+                except queue.Empty:
+                    pass
+                q.put_nowait({'seq': event['seq'], 'kind': RELOAD, 'id': None,
+                              'version': None, 'source': 'overflow', 'ts': event['ts']})
+        return event
+
+    def subscribe(self, last_seq=None):
+        """
+        Регистрирует подписчика и возвращает его очередь.
+        Если передан last_seq, в очередь сразу попадают пропущенные события из буфера.
+        """
+        q = queue.Queue(maxsize=self._subscriber_queue_size)
+        with self._lock:
+            if last_seq is not None:
+                missed = [e for e in self._history if e['seq'] > last_seq]
+                if self._history and self._history[0]['seq'] > last_seq + 1:
+                    # Часть событий уже вытеснена из буфера
+                    missed = [{'seq': self._history[-1]['seq'], 'kind': RELOAD, 'id': None,
+                               'version': None, 'source': 'history', 'ts': time.time()}]
+                for event in missed[-self._subscriber_queue_size:]:
+                    q.put_nowait(event)
+            self._subscribers.add(q)
+        return q
+
+    def unsubscribe(self, q):
+        with self._lock:
+            self._subscribers.discard(q)
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+
+def format_sse(event):
+    """Форматирует событие в кадр text/event-stream."""
+    return f"id: {event['seq']}\nevent: {event['kind']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
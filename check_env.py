@@ -89,7 +89,7 @@ def check_dependencies():
         'cryptography': 'cryptography',
         'requests': 'requests',
         'webview': 'pywebview',
-        'yubico_client': 'yubico-client',
+        'PIL': 'Pillow (миниатюры иконок, необязательно)',
     }
     
     for module_name, package_name in packages.items():
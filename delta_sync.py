@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+Разностный (delta) экспорт и импорт записей между установками.
+
+Каждая запись получает постоянный идентификатор uid (числовой id на разных
+машинах не совпадает). Для записей без uid он выводится из created_at и id,
+поэтому копии одного файла данных получают одинаковые uid, и сохраняется
+при следующей записи файла.
+
+При каждом экспорте в журнал (data/export_manifests.json) записывается
+манифест {uid: хеш записи}. Delta «с экспорта X» содержит записи, хеш которых
+отличается от манифеста X, и uid удалённых с тех пор записей; delta
+«с момента T» — записи с updated_at > T (удаления так не определяются).
+Пакет — ZIP с зашифрованным ключом хранилища delta.json.enc и файлами
+uploads/, на которые ссылаются изменённые записи.
+
+При импорте запись с тем же uid заменяется, если локальная копия не новее
+(по updated_at), иначе остаётся локальная и засчитывается конфликт. Старые
+иконки и чеки заменённых или удалённых записей убирает сборщик мусора (upload_gc).
+"""
+
+import json
+import os
+import tempfile
+import uuid
+from datetime import datetime
+
+from icon_derivatives import ICON_SIZES, derivative_name
+from upload_store import referenced_names
+
+DELTA_FORMAT = 'allmanagerc-delta/1'
+PAYLOAD_NAME = 'delta.json.enc'
+MANIFEST_NAME = 'manifest.json'
+EXPORT_LOG_NAME = 'export_manifests.json'
+KEEP_MANIFESTS = 20
+# Пространство имён для uid, выведенных из старых записей
+UID_NAMESPACE = uuid.UUID('5b0c7d3e-8f4a-4c51-9a57-1d6f2e0b9c43')
+
+
+class DeltaError(Exception):
+    """Пакет повреждён, другого формата или не подходит к этой установке."""
+
+
+def new_export_id():
+    return f"{datetime.now().strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}"
+
+
+def record_uid(record):
+    """Постоянный идентификатор записи: сохранённый uid или выведенный из created_at и id."""
+    if record.get('uid'):
+        return record['uid']
+    seed = f"{record.get('created_at') or ''}|{record.get('id')}|{'' if record.get('created_at') else record.get('name', '')}"
+    return uuid.uuid5(UID_NAMESPACE, seed).hex
+
+
+def ensure_uids(servers):
+    """Проставляет uid записям, у которых его нет. Возвращает число изменённых записей."""
+    count = 0
+    for server in servers:
+        if not server.get('uid'):
+            server['uid'] = record_uid(server)
+            count += 1
+    return count
+
+
+def _with_uid(server):
+    # Хеш считается с uid, чтобы сохранение выведенного uid не меняло хеш записи
+    return server if server.get('uid') else dict(server, uid=record_uid(server))
+
+
+def build_manifest(servers, etag_fn):
+    return {record_uid(server): etag_fn(_with_uid(server)) for server in servers}
+
+
+class ExportLog:
+    """Журнал манифестов последних экспортов (JSON рядом с файлами данных)."""
+
+    def __init__(self, path, keep=KEEP_MANIFESTS):
+        self.path = path
+        self.keep = keep
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            return data if isinstance(data, list) else []
+        except FileNotFoundError:
+            return []
+        except (OSError, ValueError) as e:
+            print(f"⚠️ Журнал экспортов повреждён и будет перезаписан: {e}")
+            return []
+
+    def entries(self):
+        """Экспорты без манифестов (для отображения), от новых к старым."""
+        return [{k: v for k, v in entry.items() if k != 'manifest'} for entry in reversed(self._load())]
+
+    def find(self, export_id):
+        return next((entry for entry in self._load() if entry.get('export_id') == export_id), None)
+
+    def latest(self):
+        entries = self._load()
+        return entries[-1] if entries else None
+
+    def record(self, export_id, manifest, kind):
+        entries = self._load()
+        entries.append({'export_id': export_id, 'created_at': datetime.now().isoformat(),
+                        'kind': kind, 'records': len(manifest), 'manifest': manifest})
+        entries = entries[-self.keep:]
+        directory = os.path.dirname(self.path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix='export_manifests.', suffix='.tmp', dir=directory)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(entries, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+
+def build_delta(servers, etag_fn, export_id, base=None, since=None, digest_fn=None):
+    """
+    Содержимое пакета: изменённые записи, удалённые uid и файлы uploads этих записей
+    с их SHA-256 (digest_fn). base — запись журнала экспорта, с которого считается
+    разница; since — ISO-время; без base и since в пакет попадают все записи.
+    Возвращает (payload, манифест для журнала).
+    """
+    manifest = build_manifest(servers, etag_fn)
+    if base is not None:
+        previous = base.get('manifest') or {}
+        changed = [s for s in servers if previous.get(record_uid(s)) != manifest[record_uid(s)]]
+        deleted = sorted(uid for uid in previous if uid not in manifest)
+    elif since:
+        changed = [s for s in servers if (s.get('updated_at') or s.get('created_at') or '') > since]
+        deleted = []
+    else:
+        changed, deleted = list(servers), []
+
+    records = [_with_uid(server) for server in changed]
+    payload = {
+        'format': DELTA_FORMAT,
+        'export_id': export_id,
+        'base_export_id': base.get('export_id') if base else None,
+        'since': since,
+        'created_at': datetime.now().isoformat(),
+        'records': records,
+        'deleted': deleted,
+        'uploads': {name: digest_fn(name) if digest_fn else None for name in sorted(referenced_names(records))},
+        'total_records': len(servers),
+    }
+    return payload, manifest
+
+
+def parse_payload(data):
+    try:
+        payload = json.loads(data.decode('utf-8'))
+    except (UnicodeDecodeError, ValueError) as e:
+        raise DeltaError(f'Повреждённый пакет: {e}') from None
+    if not isinstance(payload, dict) or payload.get('format') != DELTA_FORMAT:
+        raise DeltaError('Неизвестный формат пакета')
+    if not isinstance(payload.get('records'), list) or not isinstance(payload.get('deleted'), list):
+        raise DeltaError('Повреждённый пакет: нет списка записей')
+    if not isinstance(payload.get('uploads'), dict):
+        payload['uploads'] = {}
+    return payload
+
+
+def plan_uploads(payload, local_digest_fn, prefix):
+    """
+    Какие файлы пакета сохранять и под какими именами. Файл с тем же именем и тем же
+    SHA-256 уже есть — пропускается (не читается из архива). Имя занято другим
+    содержимым (например, 3_logo.png другой записи) — файл сохраняется под именем
+    с префиксом, ссылки в записях пакета переименовываются.
+    Возвращает {имя в пакете: имя в хранилище}.
+    """
+    plan = {}
+    for name, digest in payload['uploads'].items():
+        local = local_digest_fn(name)
+        if local is None:
+            plan[name] = name
+        elif digest is None or local != digest:
+            plan[name] = f"{prefix}_{name}"
+    # Миниатюры следуют за своей иконкой, чтобы имена оставались согласованными
+    for name, target in list(plan.items()):
+        if name != target:
+            for size in ICON_SIZES:
+                if derivative_name(name, size) in payload['uploads']:
+                    plan[derivative_name(name, size)] = derivative_name(target, size)
+    renames = {name: target for name, target in plan.items() if name != target}
+    if renames:
+        for record in payload['records']:
+            if record.get('icon_filename') in renames:
+                record['icon_filename'] = renames[record['icon_filename']]
+            for receipt in (record.get('payment_info') or {}).get('receipts') or []:
+                if receipt.get('filename') in renames:
+                    receipt['filename'] = renames[receipt['filename']]
+    return plan
+
+
+def apply_delta(servers, payload):
+    """
+    Применяет пакет к списку записей на месте. Новые записи получают следующий
+    свободный числовой id. Возвращает сводку (added, updated, unchanged, deleted, conflicts).
+    """
+    ensure_uids(servers)
+    by_uid = {server['uid']: i for i, server in enumerate(servers)}
+    next_id = max((s['id'] for s in servers if isinstance(s.get('id'), int)), default=0) + 1
+    summary = {'added': 0, 'updated': 0, 'unchanged': 0, 'deleted': 0, 'conflicts': 0}
+
+    for incoming in payload['records']:
+        if not isinstance(incoming, dict) or not incoming.get('uid'):
+            continue
+        record = dict(incoming)
+        position = by_uid.get(record['uid'])
+        if position is None:
+            record['id'] = next_id
+            next_id += 1
+            by_uid[record['uid']] = len(servers)
+            servers.append(record)
+            summary['added'] += 1
+            continue
+        local = servers[position]
+        record['id'] = local.get('id')
+        if record == local:
+            summary['unchanged'] += 1
+        elif (local.get('updated_at') or '') > (record.get('updated_at') or ''):
+            # Локальная копия изменена позже — оставляем её
+            summary['conflicts'] += 1
+        else:
+            servers[position] = record
+            summary['updated'] += 1
+
+    deleted = set(payload['deleted'])
+    if deleted:
+        created_at = payload.get('created_at') or ''
+        kept = []
+        for server in servers:
+            if server['uid'] in deleted:
+                if (server.get('updated_at') or '') > created_at:
+                    summary['conflicts'] += 1
+                else:
+                    summary['deleted'] += 1
+                    continue
+            kept.append(server)
+        servers[:] = kept
+    return summary
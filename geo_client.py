@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+Клиент геолокации IP-адресов для AI Manager.
+
+- Общая HTTP-сессия с keep-alive и пулом соединений
+- Объединение одновременных запросов одного и того же IP (single-flight)
+- Постоянный кэш с TTL на диске (JSON в директории данных приложения)
+- Пакетная проверка множества адресов с ограничением параллелизма
+"""
+
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_URL_TEMPLATE = 'https://ipinfo.io/{ip}/json'
+DEFAULT_TTL = 7 * 24 * 3600
+DEFAULT_TIMEOUT = 5
+DEFAULT_MAX_CONCURRENCY = 8
+
+
+class GeoLookupError(Exception):
+    """Ошибка запроса геолокации (сеть или неуспешный HTTP-статус)."""
+
+
+class _Flight:
+    """Запрос, который уже выполняется: остальные ждут его результат."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class GeoLookupClient:
+    def __init__(self, cache_path, url_template=DEFAULT_URL_TEMPLATE, ttl=DEFAULT_TTL,
+                 timeout=DEFAULT_TIMEOUT, max_concurrency=DEFAULT_MAX_CONCURRENCY):
+        self.cache_path = cache_path
+        self.url_template = url_template or DEFAULT_URL_TEMPLATE
+        self.ttl = ttl
+        self.timeout = timeout
+        self.max_concurrency = max(1, int(max_concurrency))
+
+        self._lock = threading.Lock()
+        self._cache = None  # загружается при первом обращении
+        self._inflight = {}
+        self._session = None
+        self.stats = {'hits': 0, 'misses': 0, 'coalesced': 0, 'errors': 0}
+
+    # --- HTTP-сессия ---
+    def _get_session(self):
+        if self._session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.max_concurrency)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            self._session = session
+        return self._session
+
+    # --- Кэш на диске ---
+    def _load_cache(self):
+        if self._cache is not None:
+            return self._cache
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self._cache = data if isinstance(data, dict) else {}
+        except (OSError, json.JSONDecodeError):
+            self._cache = {}
+        return self._cache
+
+    def save_cache(self):
+        """Атомарно записывает кэш (уникальный временный файл + замена)."""
+        with self._lock:
+            snapshot = dict(self._load_cache())
+        tmp_path = None
+        try:
+            directory = os.path.dirname(self.cache_path) or '.'
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(self.cache_path) + '.', suffix='.tmp', dir=directory)
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(snapshot, f, ensure_ascii=False)
+            os.replace(tmp_path, self.cache_path)
+            tmp_path = None
+        except OSError as e:
+            print(f"⚠️ Не удалось сохранить кэш геолокации: {e}")
+        finally:
+            if tmp_path:
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+
+    def _cached(self, ip):
+        entry = self._load_cache().get(ip)
+        if entry and time.time() - entry.get('ts', 0) < self.ttl:
+            return entry.get('data')
+        return None
+
+    # --- Запросы ---
+    def _fetch(self, ip):
+        import requests
+        url = self.url_template.format(ip=ip)
+        try:
+            response = self._get_session().get(url, timeout=self.timeout)
+        except requests.exceptions.RequestException as e:
+            raise GeoLookupError(f"Не удалось подключиться к сервису: {e}")
+        if response.status_code != 200:
+            raise GeoLookupError(f"Ошибка запроса: статус {response.status_code}")
+        try:
+            return response.json()
+        except ValueError:
+            raise GeoLookupError("Сервис вернул некорректный JSON")
+
+    def lookup(self, ip, force=False, persist=True):
+        """
+        Возвращает (данные, из_кэша). Одновременные запросы одного IP
+        выполняются одним сетевым обращением. Бросает GeoLookupError.
+        """
+        with self._lock:
+            if not force:
+                cached = self._cached(ip)
+                if cached is not None:
+                    self.stats['hits'] += 1
+                    return cached, True
+            flight = self._inflight.get(ip)
+            leader = flight is None
+            if leader:
+                flight = _Flight()
+                self._inflight[ip] = flight
+                self.stats['misses'] += 1
+            else:
+                self.stats['coalesced'] += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error:
+                raise flight.error
+            return flight.result, False
+
+        try:
+            flight.result = self._fetch(ip)
+            with self._lock:
+                self._load_cache()[ip] = {'ts': time.time(), 'data': flight.result}
+        except GeoLookupError as e:
+            flight.error = e
+            with self._lock:
+                self.stats['errors'] += 1
+        finally:
+            with self._lock:
+                self._inflight.pop(ip, None)
+            flight.done.set()
+
+        if flight.error:
+            raise flight.error
+        if persist:
+            self.save_cache()
+        return flight.result, False
+
+    def lookup_many(self, ips, force=False, max_workers=None):
+        """
+        Параллельно определяет геолокацию набора адресов (не больше max_workers
+        одновременных запросов). Возвращает {ip: {'data'|'error', 'cached'}}.
+        """
+        unique_ips = list(dict.fromkeys(ip for ip in ips if ip))
+        workers = max(1, min(max_workers or self.max_concurrency, self.max_concurrency, len(unique_ips) or 1))
+
+        def one(ip):
+            try:
+                data, cached = self.lookup(ip, force=force, persist=False)
+                return ip, {'data': data, 'cached': cached}
+            except GeoLookupError as e:
+                return ip, {'error': str(e), 'cached': False}
+
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='geo') as executor:
+            results = dict(executor.map(one, unique_ips))
+        self.save_cache()
+        return results
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self.stats, cache_entries=len(self._load_cache()))
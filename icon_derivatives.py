@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+Уменьшенные копии иконок сервисов для карточек.
+
+При загрузке иконка приводится к квадратным PNG фиксированных размеров
+(ICON_SIZES) с прозрачными полями; карточка выбирает нужный размер через
+srcset вместо того, чтобы браузер масштабировал исходник. Нужен Pillow;
+без него (или для файлов, которые не являются изображениями) копии не
+создаются и карточка показывает оригинал.
+"""
+
+import io
+
+try:
+    from PIL import Image, ImageOps
+    PIL_AVAILABLE = True
+except ImportError:
+    Image = ImageOps = None
+    PIL_AVAILABLE = False
+
+# Иконка в карточке — 40 CSS-пикселей: 64 для обычных экранов, 128 для Retina
+ICON_SIZES = (64, 128)
+CARD_ICON_SIZE = 40
+# Защита от «бомб декомпрессии» при открытии пользовательских файлов
+MAX_SOURCE_PIXELS = 40_000_000
+
+
+def derivative_name(icon_filename, size):
+    """Имя файла уменьшенной копии: 12_logo.png -> 12_logo.png.64px.png."""
+    return f"{icon_filename}.{size}px.png"
+
+
+def render_derivatives(source, sizes=ICON_SIZES):
+    """
+    Возвращает {размер: PNG-байты} для изображения source (байты или путь к файлу).
+    Пустой словарь, если Pillow нет или source не удаётся прочитать как изображение.
+    """
+    if not PIL_AVAILABLE or not source:
+        return {}
+    try:
+        with Image.open(io.BytesIO(source) if isinstance(source, bytes) else source) as opened:
+            if opened.width * opened.height > MAX_SOURCE_PIXELS:
+                return {}
+            image = ImageOps.exif_transpose(opened).convert('RGBA')
+    except Exception as e:
+        print(f"⚠️ Не удалось прочитать иконку для миниатюр: {e}")
+        return {}
+
+    result = {}
+    for size in sizes:
+        thumb = ImageOps.contain(image, (size, size), Image.LANCZOS)
+        canvas = Image.new('RGBA', (size, size), (0, 0, 0, 0))
+        canvas.paste(thumb, ((size - thumb.width) // 2, (size - thumb.height) // 2))
+        out = io.BytesIO()
+        canvas.save(out, format='PNG', optimize=True)
+        result[size] = out.getvalue()
+    return result
@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""
+Слияние записей двух файлов данных (импорт из другой установки).
+
+Записи сопоставляются по постоянному uid (delta_sync.record_uid), а если
+совпадения нет — по имени. Для каждой записи строится отпечаток полей:
+HMAC-SHA256 значения каждого поля (секретные поля — по расшифрованному
+значению, поэтому разный шифртекст одного пароля не считается изменением).
+Сопоставление и сравнение — словари, O(n) по числу записей.
+
+Конфликты разрешаются одной из стратегий:
+
+- three_way — по каждому полю с базой (отпечатками после прошлого слияния):
+  изменилась только одна сторона — берётся она; изменились обе по-разному —
+  конфликт поля, побеждает запись с более поздним updated_at;
+- newer — поля записи с более поздним updated_at.
+
+Без базы для записи three_way ведёт себя как newer, но на уровне полей.
+Поле, которое есть только с одной стороны, конфликтом не считается:
+отсутствие в импортируемой записи — удаление, только если по базе three_way
+локальное значение с прошлого слияния не менялось; иначе локальное значение
+остаётся. Поле, которого нет локально, берётся из импорта (кроме случая,
+когда по базе его удалили локально).
+
+Отпечатки результата сохраняются как база для следующего слияния — отдельно
+для каждого источника импорта (базу одного файла нельзя применять к другому);
+значения полей в базе не хранятся.
+"""
+
+import hashlib
+import hmac
+import json
+import os
+import tempfile
+
+from delta_sync import record_uid
+
+STRATEGIES = ('three_way', 'newer')
+# Поля, которые не сливаются: id локальный, uid — идентичность, updated_at вычисляется
+SKIP_FIELDS = frozenset({'id', 'uid', 'updated_at'})
+_MISSING = object()
+
+
+class MergeBase:
+    """
+    Отпечатки полей записей после последнего слияния по каждому источнику:
+    {"version": 2, "sources": {источник: {uid: {поле: hmac}}}} в JSON-файле.
+    База прежнего формата (одна на все источники) не используется.
+    """
+
+    VERSION = 2
+
+    def __init__(self, path):
+        self.path = path
+
+    def _load_all(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            print(f"⚠️ База слияния повреждена, используется слияние без базы: {e}")
+            return {}
+        if not isinstance(data, dict) or data.get('version') != self.VERSION:
+            return {}
+        sources = data.get('sources')
+        return sources if isinstance(sources, dict) else {}
+
+    def load(self, source):
+        base = self._load_all().get(source)
+        return base if isinstance(base, dict) else {}
+
+    def save(self, source, base):
+        sources = self._load_all()
+        sources[source] = base
+        directory = os.path.dirname(self.path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix='merge_base.', suffix='.tmp', dir=directory)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump({'version': self.VERSION, 'sources': sources}, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+
+def _identity_name(record):
+    name = record.get('name')
+    return name.strip().casefold() if isinstance(name, str) and name.strip() else None
+
+
+def _iter_fields(record):
+    """Пары (путь, значение): поля верхнего уровня, у словарей — на уровень глубже."""
+    for key, value in record.items():
+        if key in SKIP_FIELDS:
+            continue
+        if isinstance(value, dict):
+            for sub_key, sub_value in value.items():
+                yield f"{key}.{sub_key}", sub_value
+        else:
+            yield key, value
+
+
+def _set_field(record, path, value):
+    key, _, sub_key = path.partition('.')
+    if not sub_key:
+        if value is _MISSING:
+            record.pop(key, None)
+        else:
+            record[key] = value
+        return
+    section = record.get(key)
+    if not isinstance(section, dict):
+        section = record[key] = {}
+    if value is _MISSING:
+        section.pop(sub_key, None)
+    else:
+        section[sub_key] = value
+
+
+class MergeEngine:
+    def __init__(self, hash_key, plaintext_fn=None):
+        """
+        hash_key — ключ HMAC (байты) для отпечатков полей; plaintext_fn(путь, значение)
+        возвращает значение для сравнения (расшифровывает секретные поля).
+        """
+        self.hash_key = hash_key
+        self.plaintext_fn = plaintext_fn
+
+    def fingerprint(self, record):
+        """{путь поля: HMAC значения}."""
+        result = {}
+        for path, value in _iter_fields(record):
+            if self.plaintext_fn is not None:
+                value = self.plaintext_fn(path, value)
+            canonical = json.dumps(value, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+            result[path] = hmac.new(self.hash_key, canonical.encode('utf-8'), hashlib.sha256).hexdigest()[:32]
+        return result
+
+    def merge(self, local, remote, base=None, strategy='three_way'):
+        """
+        Сливает remote в local. Возвращает (записи, новая база, сводка).
+        Локальные записи без пары остаются как есть, удалённые без пары добавляются
+        со следующими свободными id. Сводка: added, updated, unchanged, conflicts, changes.
+        """
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Неизвестная стратегия слияния: {strategy}")
+        base = base or {}
+        merged = [dict(record) for record in local]
+        prints = [self.fingerprint(record) for record in merged]
+        by_uid = {}
+        by_name = {}
+        for i, record in enumerate(merged):
+            by_uid.setdefault(record_uid(record), i)
+            name = _identity_name(record)
+            if name is not None:
+                by_name.setdefault(name, i)
+        next_id = max((r['id'] for r in merged if isinstance(r.get('id'), int)), default=0) + 1
+        summary = {'added': 0, 'updated': 0, 'unchanged': 0, 'conflicts': 0, 'changes': []}
+        matched = set()
+
+        for incoming in remote:
+            uid = record_uid(incoming)
+            position = by_uid.get(uid)
+            if position is None:
+                name = _identity_name(incoming)
+                position = by_name.get(name) if name is not None else None
+            if position is None or position in matched:
+                record = dict(incoming, id=next_id, uid=uid)
+                next_id += 1
+                merged.append(record)
+                prints.append(self.fingerprint(record))
+                matched.add(len(merged) - 1)
+                summary['added'] += 1
+                summary['changes'].append({'uid': uid, 'name': record.get('name'), 'action': 'added'})
+                continue
+
+            matched.add(position)
+            local_record = merged[position]
+            local_print = prints[position]
+            remote_print = self.fingerprint(incoming)
+            if local_print == remote_print:
+                summary['unchanged'] += 1
+                continue
+
+            remote_newer = (incoming.get('updated_at') or '') > (local_record.get('updated_at') or '')
+            result = dict(local_record)
+            changed_fields, conflict_fields = [], []
+            record_base = base.get(record_uid(local_record)) if strategy == 'three_way' else None
+            remote_values = dict(_iter_fields(incoming))
+            for path in sorted(set(local_print) | set(remote_print)):
+                local_hash, remote_hash = local_print.get(path), remote_print.get(path)
+                if local_hash == remote_hash:
+                    continue
+                base_hash = record_base.get(path) if record_base is not None else None
+                if remote_hash is None:
+                    # Поля нет в импорте: удаляем, только если локально оно не менялось с базы
+                    take_remote = record_base is not None and local_hash == base_hash
+                elif local_hash is None:
+                    # Поля нет локально: берём из импорта, если его не удалили локально после базы
+                    if strategy == 'newer':
+                        take_remote = remote_newer
+                    else:
+                        take_remote = not (record_base is not None and remote_hash == base_hash)
+                elif strategy == 'newer':
+                    take_remote = remote_newer
+                elif record_base is not None and local_hash == base_hash:
+                    take_remote = True
+                elif record_base is not None and remote_hash == base_hash:
+                    take_remote = False
+                else:
+                    # Изменены обе стороны (или базы нет) — побеждает более поздняя запись
+                    take_remote = remote_newer
+                    conflict_fields.append(path)
+                if take_remote:
+                    _set_field(result, path, remote_values.get(path, _MISSING))
+                    changed_fields.append(path)
+
+            if remote_newer and changed_fields:
+                result['updated_at'] = incoming.get('updated_at')
+            if changed_fields:
+                merged[position] = result
+                prints[position] = self.fingerprint(result)
+                summary['updated'] += 1
+            else:
+                summary['unchanged'] += 1
+            if conflict_fields:
+                summary['conflicts'] += 1
+            if changed_fields or conflict_fields:
+                summary['changes'].append({'uid': record_uid(result), 'name': result.get('name'),
+                                           'action': 'updated' if changed_fields else 'kept_local',
+                                           'fields': changed_fields, 'conflicts': conflict_fields})
+
+        new_base = {record_uid(record): fp for record, fp in zip(merged, prints)}
+        return merged, new_base, summary
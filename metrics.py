@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Лёгкие метрики AI Manager в формате Prometheus (text exposition 0.0.4).
+
+Счётчики и гистограммы с метками хранятся в памяти процесса. Внешние
+источники (пул WSGI-сервера, кэши) подключаются через register_collector:
+функция вызывается при каждом снятии метрик и возвращает готовые сэмплы.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+
+# Границы корзин по умолчанию, секунды
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CRYPTO_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.05, 0.25, 1.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 5000)
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    type_name = 'counter'
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(n, '')) for n in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        key = tuple(str(labels.get(n, '')) for n in self.label_names)
+        with self._lock:
+            return self._values.get(key, 0)
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            yield self.name, _format_labels(self.label_names, key), value
+
+
+class Histogram:
+    type_name = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(n, '')) for n in self.label_names)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        with self._lock:
+            items = sorted((k, (list(v[0]), v[1], v[2])) for k, v in self._values.items())
+        for key, (counts, total, count) in items:
+            for bound, bucket_count in zip(self.buckets, counts):
+                yield (f'{self.name}_bucket',
+                       _format_labels(self.label_names, key, ('le', _format_value(float(bound)))), bucket_count)
+            yield f'{self.name}_bucket', _format_labels(self.label_names, key, ('le', '+Inf')), count
+            yield f'{self.name}_sum', _format_labels(self.label_names, key), total
+            yield f'{self.name}_count', _format_labels(self.label_names, key), count
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def counter(self, name, help_text, labels=()):
+        metric = Counter(name, help_text, labels)
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        metric = Histogram(name, help_text, labels, buckets)
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, collector):
+        """
+        collector() -> список (имя, тип, описание, [(метки dict, значение), ...]).
+        Ошибки сборщика не ломают выдачу остальных метрик.
+        """
+        with self._lock:
+            self._collectors.append(collector)
+
+    def render(self):
+        """Все метрики в текстовом формате Prometheus."""
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics)
+            collectors = list(self._collectors)
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.type_name}')
+            for name, labels, value in metric.samples():
+                lines.append(f'{name}{labels} {_format_value(value)}')
+        for collector in collectors:
+            try:
+                families = collector() or []
+            except Exception as e:
+                lines.append(f'# collector error: {e}')
+                continue
+            for name, type_name, help_text, samples in families:
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} {type_name}')
+                for labels, value in samples:
+                    names = tuple(sorted(labels))
+                    lines.append(f'{name}{_format_labels(names, tuple(labels[n] for n in names))} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+# --- Метрики приложения ---
+http_request_duration = registry.histogram(
+    'allmanagerc_http_request_duration_seconds', 'Время обработки запроса по эндпоинтам',
+    labels=('endpoint', 'method', 'status'))
+http_request_decrypts = registry.histogram(
+    'allmanagerc_http_request_decrypts', 'Число расшифровок Fernet за один запрос',
+    labels=('endpoint',), buckets=COUNT_BUCKETS)
+crypto_operations = registry.counter(
+    'allmanagerc_crypto_operations_total', 'Операции шифрования и расшифровки',
+    labels=('op', 'scope'))
+crypto_duration = registry.histogram(
+    'allmanagerc_crypto_duration_seconds', 'Длительность операций шифрования и расшифровки',
+    labels=('op', 'scope'), buckets=CRYPTO_BUCKETS)
+vault_io_bytes = registry.counter(
+    'allmanagerc_vault_bytes_total', 'Байты, прочитанные и записанные в файл данных',
+    labels=('direction',))
+vault_operations = registry.counter(
+    'allmanagerc_vault_operations_total', 'Загрузки и сохранения файла данных',
+    labels=('op',))
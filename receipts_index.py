@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Общий индекс чеков всех сервисов.
+
+Чеки хранятся внутри записей (payment_info.receipts). Индекс держит их
+в отсортированном по upload_date списке ключей (upload_date, id сервиса, имя файла)
+и в таких же списках по каждому сервису. Вставка и удаление — bisect,
+запрос за период — два бинарных поиска и срез: O(log n + k).
+
+Индекс строится из записей один раз и дальше обновляется точечно; stamp —
+отпечаток файла данных, по которому индекс был построен (сверяет вызывающий код).
+"""
+
+import threading
+from bisect import bisect_left, bisect_right, insort
+
+# Верхняя граница для префиксного сравнения дат: '2024-05-01' покрывает весь день
+_PREFIX_END = '\uffff'
+
+
+def insert_receipt_sorted(receipts, receipt):
+    """Вставляет чек в список записи, сохраняя порядок «от новых к старым»."""
+    date = receipt.get('upload_date', '')
+    lo, hi = 0, len(receipts)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if receipts[mid].get('upload_date', '') >= date:
+            lo = mid + 1
+        else:
+            hi = mid
+    receipts.insert(lo, receipt)
+
+
+def ensure_receipts_order(receipts):
+    """
+    Упорядочивает список чеков «от новых к старым», если порядок нарушен
+    (старые файлы, правки через API). Проверка O(k); True, если список пересортирован.
+    """
+    if all(receipts[i].get('upload_date', '') >= receipts[i + 1].get('upload_date', '')
+           for i in range(len(receipts) - 1)):
+        return False
+    receipts.sort(key=lambda r: r.get('upload_date', ''), reverse=True)
+    return True
+
+
+def _key(service_id, receipt):
+    return (receipt.get('upload_date') or '', service_id, receipt.get('filename') or '')
+
+
+class ReceiptsIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._keys = []
+        self._by_service = {}
+        self._entries = {}
+        self.stamp = None
+
+    def rebuild(self, services, stamp=None):
+        """Полная перестройка по списку записей (O(n log n))."""
+        entries = {}
+        by_service = {}
+        for service in services or []:
+            for receipt in (service.get('payment_info') or {}).get('receipts') or []:
+                key = _key(service.get('id'), receipt)
+                entries[key] = self._entry(service, receipt)
+                by_service.setdefault(service.get('id'), []).append(key)
+        for keys in by_service.values():
+            keys.sort()
+        with self._lock:
+            self._entries = entries
+            self._keys = sorted(entries)
+            self._by_service = by_service
+            self.stamp = stamp
+
+    @staticmethod
+    def _entry(service, receipt):
+        return {
+            'service_id': service.get('id'),
+            'service_name': service.get('name', ''),
+            'filename': receipt.get('filename'),
+            'original_name': receipt.get('original_name'),
+            'description': receipt.get('description'),
+            'upload_date': receipt.get('upload_date'),
+        }
+
+    def add(self, service, receipt):
+        key = _key(service.get('id'), receipt)
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = self._entry(service, receipt)
+            insort(self._keys, key)
+            insort(self._by_service.setdefault(service.get('id'), []), key)
+
+    def remove(self, service_id, receipt):
+        key = _key(service_id, receipt)
+        with self._lock:
+            if self._entries.pop(key, None) is None:
+                return
+            for keys in (self._keys, self._by_service.get(service_id, [])):
+                i = bisect_left(keys, key)
+                if i < len(keys) and keys[i] == key:
+                    del keys[i]
+            if not self._by_service.get(service_id):
+                self._by_service.pop(service_id, None)
+
+    def query(self, date_from=None, date_to=None, service_id=None, offset=0, limit=None, newest_first=True):
+        """
+        Чеки с date_from <= upload_date <= date_to (даты ISO; дата без времени покрывает весь день),
+        при service_id — только одного сервиса. Возвращает (всего найдено, страница записей).
+        """
+        with self._lock:
+            keys = self._by_service.get(service_id, []) if service_id is not None else self._keys
+            lo = bisect_left(keys, (date_from,)) if date_from else 0
+            hi = bisect_right(keys, (date_to + _PREFIX_END,)) if date_to else len(keys)
+            total = max(0, hi - lo)
+            if newest_first:
+                stop = hi - offset
+                start = stop - limit if limit is not None else lo
+                selected = keys[max(start, lo):max(stop, lo)][::-1]
+            else:
+                start = lo + offset
+                stop = start + limit if limit is not None else hi
+                selected = keys[start:min(stop, hi)]
+            return total, [dict(self._entries[key]) for key in selected]
+
+    def __len__(self):
+        with self._lock:
+            return len(self._keys)
@@ -9,45 +9,44 @@ import threading
 import time
 import signal
 
+import startup_profiler
+# Профилирование запуска: --profile-startup или ALLMANAGERC_PROFILE_STARTUP=1
+startup_profiler.start()
+startup_profiler.stage('import_webview')
+
 # Устанавливаем переменные окружения для PyWebView
 os.environ['PYWEBVIEW_GUI'] = 'cocoa'
 
 # Импортируем необходимые модули
 import webview
-import requests
-
-def run_flask():
-    """Запускает Flask-приложение."""
-    try:
-        print("🚀 Запуск Flask сервера на http://127.0.0.1:5050")
-        # Импортируем app здесь, чтобы избежать циклических импортов
-        import app
-        app.app.run(host='127.0.0.1', port=5050, debug=False, use_reloader=False, threaded=True)
-    except Exception as e:
-        print(f"❌ Ошибка запуска Flask сервера: {e}")
-        import traceback
-        traceback.print_exc()
+from urllib.request import urlopen
 
 def main():
     print("🔧 Запуск AI Manager с GUI...")
     
-    # Останавливаем процессы на порту 5050
-    os.system("lsof -ti:5050 | xargs kill -9 2>/dev/null || true")
+    # Импортируем app здесь, чтобы избежать циклических импортов
+    startup_profiler.stage('import_app')
+    import app
     
-    # Запускаем Flask в отдельном потоке
+    # Запускаем встроенный сервер с пулом потоков на свободном порту
+    # (порт можно зафиксировать через ALLMANAGERC_PORT)
     print("🔄 Запуск Flask в отдельном потоке...")
-    flask_thread = threading.Thread(target=run_flask)
-    flask_thread.daemon = True
-    flask_thread.start()
-    
-    # Ждем запуска сервера
-    time.sleep(3)
+    try:
+        requested_port = int(os.getenv('ALLMANAGERC_PORT', '0'))
+    except ValueError:
+        requested_port = 0
+    startup_profiler.stage('server_bind')
+    port = app.start_server_thread(requested_port)
+    if not port:
+        print("❌ Не удалось запустить Flask сервер")
+        sys.exit(1)
+    base_url = f'http://127.0.0.1:{port}'
     
     def on_closing():
         print("Окно закрывается, отправка запроса на выключение...")
         try:
-            requests.get('http://127.0.0.1:5050/shutdown', timeout=1)
-        except requests.exceptions.RequestException:
+            urlopen(f'{base_url}/shutdown', timeout=1)
+        except OSError:
             pass
     
     # Создаем окно PyWebView
@@ -61,9 +60,10 @@ def main():
     except:
         version = '5.6.0'
 
+    startup_profiler.stage('create_window')
     window = webview.create_window(
         f'AI Manager v{version}',
-        'http://127.0.0.1:5050',
+        base_url,
         width=1280,
         height=800,
         resizable=True,
@@ -79,14 +79,18 @@ def main():
     )
     
     window.events.closing += on_closing
+    if startup_profiler.enabled():
+        window.events.loaded += app.on_window_loaded
     
     # Запускаем GUI
     print("🚀 Запуск GUI приложения...")
     print("🌐 GUI окно должно открыться автоматически")
-    print("📱 Если окно не появилось, откройте браузер: http://127.0.0.1:5050")
+    print(f"📱 Если окно не появилось, откройте браузер: {base_url}")
     
+    startup_profiler.stage('webview_start')
     webview.start(debug=False, gui='cocoa')
     
+    startup_profiler.write_report(app.APP_DATA_DIR)
     print("Приложение закрыто.")
 
 if __name__ == "__main__":
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Запуск AI Manager без GUI: только Flask-сервер.
+
+Для серверов без дисплея, нагрузочного и интеграционного тестирования.
+
+    python run_headless.py                      # свободный порт, выбранный ОС
+    python run_headless.py --port 5050
+    python run_headless.py --host 0.0.0.0 --port 8080 --allow-ip 10.0.0.5
+    python run_headless.py --ready-fd 3         # номер порта пишется в дескриптор 3
+
+Когда сервер готов принимать соединения, в stdout печатается строка
+«READY http://host:port» (и номер порта в --ready-fd / --ready-file, если заданы).
+SIGTERM, SIGINT и GET /shutdown корректно останавливают сервер; код возврата 0.
+"""
+
+import argparse
+import os
+import signal
+import sys
+import threading
+
+import startup_profiler
+# Профилирование запуска: --profile-startup или ALLMANAGERC_PROFILE_STARTUP=1
+startup_profiler.start()
+
+READY_PREFIX = 'READY'
+
+
+def parse_args(argv=None):
+    try:
+        default_port = int(os.getenv('ALLMANAGERC_PORT', '0'))
+    except ValueError:
+        default_port = 0
+    parser = argparse.ArgumentParser(description='AI Manager без GUI (только веб-сервер)')
+    parser.add_argument('--host', default=os.getenv('ALLMANAGERC_HOST', '127.0.0.1'),
+                        help='Адрес для прослушивания (по умолчанию 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=default_port,
+                        help='Порт; 0 — свободный порт, выбранный ОС (по умолчанию ALLMANAGERC_PORT или 0)')
+    parser.add_argument('--ready-fd', type=int,
+                        help='Дескриптор, в который после запуска пишется номер порта и который затем закрывается')
+    parser.add_argument('--ready-file', help='Файл, в который после запуска атомарно пишется номер порта')
+    parser.add_argument('--allow-ip', action='append', default=[], metavar='IP',
+                        help='Дополнительный разрешённый адрес клиента (можно повторять); по умолчанию только localhost')
+    parser.add_argument('--startup-timeout', type=float, default=10.0,
+                        help='Сколько секунд ждать привязки к порту (по умолчанию 10)')
+    parser.add_argument('--profile-startup', action='store_true', help='Профиль запуска в logs/')
+    return parser.parse_args(argv)
+
+
+def signal_ready(port, url, ready_fd=None, ready_file=None):
+    """Сообщает о готовности: строка в stdout, номер порта в дескриптор и/или файл."""
+    print(f"{READY_PREFIX} {url}", flush=True)
+    if ready_fd is not None:
+        try:
+            os.write(ready_fd, f"{port}\n".encode())
+        finally:
+            os.close(ready_fd)
+    if ready_file:
+        tmp_path = f"{ready_file}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(f"{port}\n")
+        os.replace(tmp_path, ready_file)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    startup_profiler.stage('import_app')
+    import app
+
+    stop_event = threading.Event()
+
+    def request_stop(signum, frame):
+        print(f"\n🛑 Получен сигнал {signal.Signals(signum).name}, остановка сервера...", flush=True)
+        stop_event.set()
+
+    # /shutdown посылает процессу SIGINT — он попадает сюда же
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGTERM, request_stop)
+
+    for ip in args.allow_ip:
+        if ip not in app.ALLOWED_IPS:
+            app.ALLOWED_IPS.append(ip)
+    if args.host not in ('127.0.0.1', 'localhost', '::1'):
+        print(f"⚠️ Сервер слушает {args.host}; разрешённые клиенты: {', '.join(app.ALLOWED_IPS)}")
+
+    startup_profiler.stage('server_bind')
+    port = app.start_server_thread(args.port, wait_timeout=args.startup_timeout, host=args.host)
+    if not port:
+        print("❌ Не удалось запустить Flask сервер", file=sys.stderr)
+        return 1
+
+    url_host = '127.0.0.1' if args.host in ('0.0.0.0', '') else args.host
+    if ':' in url_host:
+        url_host = f"[{url_host}]"
+    url = f"http://{url_host}:{port}"
+    startup_profiler.stage(None)
+    signal_ready(port, url, args.ready_fd, args.ready_file)
+    startup_profiler.write_report(app.APP_DATA_DIR)
+
+    # Ждём сигнала; wait с таймаутом оставляет главный поток отзывчивым к сигналам на всех ОС
+    while not stop_event.wait(0.5):
+        pass
+
+    app.stop_server()
+    if args.ready_file:
+        try:
+            os.remove(args.ready_file)
+        except OSError:
+            pass
+    print("✅ Сервер остановлен", flush=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+Профилировщик запуска AI Manager.
+
+Включается флагом командной строки --profile-startup или переменной окружения
+ALLMANAGERC_PROFILE_STARTUP=1. Записывает время (настенное и CPU) каждого этапа
+запуска, а также каждого импорта (по модулю и в сумме по этапу), затем сохраняет JSON-отчёт и краткую
+сводку в APP_DATA_DIR/logs. Без флага все вызовы ничего не делают.
+
+Этапы идут последовательно: stage('имя') закрывает предыдущий этап и открывает новый.
+"""
+
+import builtins
+import json
+import os
+import platform
+import sys
+import threading
+import time
+from datetime import datetime
+
+ENV_FLAG = 'ALLMANAGERC_PROFILE_STARTUP'
+CLI_FLAG = '--profile-startup'
+
+_lock = threading.Lock()
+_state = {
+    'enabled': False,
+    'started_wall': None,
+    'started_cpu': None,
+    'started_at': None,
+    'current': None,
+    'stages': [],
+    'marks': [],
+    'imports': {},
+    'import_stages': {},
+    'report_path': None,
+}
+_original_import = builtins.__import__
+_import_stack = []
+
+
+def is_requested():
+    return CLI_FLAG in sys.argv or os.getenv(ENV_FLAG, '').strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def enabled():
+    return _state['enabled']
+
+
+def _timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+    # Уже загруженные модули и относительные импорты не замеряем
+    if level != 0 or name in sys.modules or threading.current_thread() is not threading.main_thread():
+        return _original_import(name, globals, locals, fromlist, level)
+
+    # Элемент стека — [настенное, CPU] время вложенных импортов
+    _import_stack.append([0.0, 0.0])
+    wall, cpu = time.perf_counter(), time.process_time()
+    try:
+        return _original_import(name, globals, locals, fromlist, level)
+    finally:
+        elapsed = time.perf_counter() - wall
+        elapsed_cpu = time.process_time() - cpu
+        children, children_cpu = _import_stack.pop()
+        stage_name = _state['current']['name'] if _state['current'] else None
+        if _import_stack:
+            _import_stack[-1][0] += elapsed
+            _import_stack[-1][1] += elapsed_cpu
+        else:
+            # Импорты верхнего уровня суммируются по этапам (вложенные уже входят в них)
+            totals = _state['import_stages'].setdefault(stage_name, {'wall_ms': 0.0, 'cpu_ms': 0.0})
+            totals['wall_ms'] += elapsed * 1000
+            totals['cpu_ms'] += elapsed_cpu * 1000
+        entry = _state['imports'].setdefault(name, {'cumulative_ms': 0.0, 'self_ms': 0.0,
+                                                    'cumulative_cpu_ms': 0.0, 'self_cpu_ms': 0.0,
+                                                    'stage': stage_name})
+        entry['cumulative_ms'] += elapsed * 1000
+        entry['self_ms'] += (elapsed - children) * 1000
+        entry['cumulative_cpu_ms'] += elapsed_cpu * 1000
+        entry['self_cpu_ms'] += (elapsed_cpu - children_cpu) * 1000
+
+
+def start(force=False):
+    """Включает профилирование, если оно запрошено (или force). Повторный вызов ничего не делает."""
+    if _state['enabled'] or not (force or is_requested()):
+        return _state['enabled']
+    _state.update(enabled=True, started_wall=time.perf_counter(), started_cpu=time.process_time(),
+                  started_at=datetime.now().isoformat())
+    builtins.__import__ = _timed_import
+    return True
+
+
+def stage(name):
+    """Закрывает текущий этап и начинает новый (name=None — только закрыть)."""
+    if not _state['enabled']:
+        return
+    now_wall, now_cpu = time.perf_counter(), time.process_time()
+    with _lock:
+        current = _state['current']
+        if current:
+            current['wall_ms'] = round((now_wall - current['_wall']) * 1000, 3)
+            current['cpu_ms'] = round((now_cpu - current['_cpu']) * 1000, 3)
+            imports = _state['import_stages'].get(current['name'], {})
+            current['import_wall_ms'] = round(imports.get('wall_ms', 0.0), 3)
+            current['import_cpu_ms'] = round(imports.get('cpu_ms', 0.0), 3)
+            current['start_ms'] = round((current.pop('_wall') - _state['started_wall']) * 1000, 3)
+            current.pop('_cpu')
+            _state['stages'].append(current)
+        _state['current'] = {'name': name, '_wall': now_wall, '_cpu': now_cpu} if name else None
+
+
+def mark(name):
+    """Отмечает момент времени (например, «окно загружено») от начала профилирования."""
+    if not _state['enabled']:
+        return
+    with _lock:
+        _state['marks'].append({
+            'name': name,
+            'at_ms': round((time.perf_counter() - _state['started_wall']) * 1000, 3),
+            'cpu_ms': round((time.process_time() - _state['started_cpu']) * 1000, 3)
+        })
+
+
+def build_report(top_imports=40):
+    imports = sorted(_state['imports'].items(), key=lambda kv: kv[1]['cumulative_ms'], reverse=True)
+    return {
+        'started_at': _state['started_at'],
+        'frozen': bool(getattr(sys, 'frozen', False)),
+        'platform': platform.platform(),
+        'python': sys.version.split()[0],
+        'total_wall_ms': round((time.perf_counter() - _state['started_wall']) * 1000, 3),
+        'total_cpu_ms': round((time.process_time() - _state['started_cpu']) * 1000, 3),
+        'stages': list(_state['stages']),
+        'marks': list(_state['marks']),
+        'imports': [
+            {'module': name, 'cumulative_ms': round(v['cumulative_ms'], 3),
+             'self_ms': round(v['self_ms'], 3), 'cumulative_cpu_ms': round(v['cumulative_cpu_ms'], 3),
+             'self_cpu_ms': round(v['self_cpu_ms'], 3), 'stage': v['stage']}
+            for name, v in imports
+        ],
+        'top_imports': [name for name, _ in imports[:top_imports]],
+    }
+
+
+def format_summary(report, top=15):
+    lines = [
+        f"Профиль запуска AI Manager ({report['started_at']})",
+        f"Всего: {report['total_wall_ms']:.1f} мс (CPU {report['total_cpu_ms']:.1f} мс), "
+        f"frozen={report['frozen']}, Python {report['python']}",
+        "",
+        "Этапы:",
+    ]
+    for st in report['stages']:
+        lines.append(f"  {st['name']:<24} {st['wall_ms']:>9.1f} мс  CPU {st['cpu_ms']:>8.1f} мс  "
+                     f"импорты {st['import_wall_ms']:.1f}/{st['import_cpu_ms']:.1f} мс  (с {st['start_ms']:.1f} мс)")
+    if report['marks']:
+        lines += ["", "Отметки:"]
+        for m in report['marks']:
+            lines.append(f"  {m['name']:<24} {m['at_ms']:>9.1f} мс")
+    lines += ["", f"Самые медленные импорты (top {top}):"]
+    for item in report['imports'][:top]:
+        lines.append(f"  {item['module']:<32} {item['cumulative_ms']:>9.1f} мс  CPU {item['cumulative_cpu_ms']:>8.1f} мс  "
+                     f"(собственное {item['self_ms']:.1f} мс, CPU {item['self_cpu_ms']:.1f} мс)")
+    return "\n".join(lines)
+
+
+def write_report(app_data_dir):
+    """
+    Закрывает текущий этап, сохраняет JSON и текстовую сводку в app_data_dir/logs,
+    печатает сводку. Возвращает путь к JSON или None. Отчёт пишется один раз.
+    """
+    if not _state['enabled'] or _state['report_path']:
+        return _state['report_path']
+    stage(None)
+    builtins.__import__ = _original_import
+
+    report = build_report()
+    summary = format_summary(report)
+    try:
+        logs_dir = os.path.join(app_data_dir, 'logs')
+        os.makedirs(logs_dir, exist_ok=True)
+        stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        json_path = os.path.join(logs_dir, f'startup_profile_{stamp}.json')
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        with open(os.path.join(logs_dir, f'startup_profile_{stamp}.txt'), 'w', encoding='utf-8') as f:
+            f.write(summary + "\n")
+        _state['report_path'] = json_path
+    except OSError as e:
+        print(f"⚠️ Не удалось сохранить профиль запуска: {e}")
+        json_path = None
+
+    print(summary)
+    if json_path:
+        print(f"📊 Профиль запуска сохранён: {json_path}")
+    return json_path
@@ -0,0 +1,93 @@
+"""Тесты слияния записей (merge_engine.py)."""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from merge_engine import MergeBase, MergeEngine  # noqa: E402
+
+LOCAL = {
+    'id': 1, 'uid': 'u1', 'name': 'Service', 'status': 'Active', 'notes': 'local notes',
+    'features': ['a'], 'created_at': '2024-01-01',
+    'credentials': {'username': 'user', 'password': 'old'},
+    'updated_at': '2024-01-01T00:00:00',
+}
+
+
+def engine():
+    return MergeEngine(b'test-key')
+
+
+def sparse_newer():
+    return {'uid': 'u1', 'name': 'Service', 'credentials': {'password': 'new'},
+            'updated_at': '2024-06-01T00:00:00'}
+
+
+def test_no_base_keeps_fields_missing_from_newer_sparse_record():
+    merged, _base, summary = engine().merge([dict(LOCAL)], [sparse_newer()])
+    record = merged[0]
+    assert record['credentials'] == {'username': 'user', 'password': 'new'}
+    for field in ('status', 'notes', 'features', 'created_at'):
+        assert record[field] == LOCAL[field]
+    # Поля только с одной стороны конфликтом не считаются
+    change = summary['changes'][0]
+    assert change['conflicts'] == ['credentials.password']
+    assert change['fields'] == ['credentials.password']
+
+
+def test_field_only_in_remote_is_added_without_conflict():
+    remote = dict(LOCAL, tags=['x'], updated_at='2023-01-01T00:00:00')
+    merged, _base, summary = engine().merge([dict(LOCAL)], [remote])
+    assert merged[0]['tags'] == ['x']
+    assert summary['conflicts'] == 0
+
+
+def test_three_way_deletes_field_unchanged_locally():
+    eng = engine()
+    base = {'u1': eng.fingerprint(LOCAL)}
+    remote = {k: v for k, v in LOCAL.items() if k != 'notes'}
+    merged, _base, summary = eng.merge([dict(LOCAL)], [remote], base)
+    assert 'notes' not in merged[0]
+    assert summary['updated'] == 1 and summary['conflicts'] == 0
+
+
+def test_three_way_keeps_field_changed_locally_after_base():
+    eng = engine()
+    base = {'u1': eng.fingerprint(LOCAL)}
+    local = dict(LOCAL, notes='edited locally')
+    remote = {k: v for k, v in LOCAL.items() if k != 'notes'}
+    merged, _base, _summary = eng.merge([local], [remote], base)
+    assert merged[0]['notes'] == 'edited locally'
+
+
+def test_three_way_does_not_restore_field_deleted_locally():
+    eng = engine()
+    base = {'u1': eng.fingerprint(LOCAL)}
+    local = {k: v for k, v in LOCAL.items() if k != 'notes'}
+    merged, _base, _summary = eng.merge([local], [dict(LOCAL)], base)
+    assert 'notes' not in merged[0]
+
+
+def test_newer_strategy_takes_newer_values_and_keeps_missing_fields():
+    remote = dict(sparse_newer(), status='Paused')
+    merged, _base, summary = engine().merge([dict(LOCAL)], [remote], strategy='newer')
+    record = merged[0]
+    assert record['status'] == 'Paused'
+    assert record['credentials'] == {'username': 'user', 'password': 'new'}
+    assert record['notes'] == LOCAL['notes']
+    assert record['updated_at'] == remote['updated_at']
+    assert summary['conflicts'] == 0
+
+    older = dict(LOCAL, status='Old', updated_at='2023-01-01T00:00:00')
+    merged, _base, _summary = engine().merge([dict(LOCAL)], [older], strategy='newer')
+    assert merged[0]['status'] == 'Active'
+
+
+def test_merge_base_is_kept_per_source(tmp_path):
+    store = MergeBase(str(tmp_path / 'merge_base.json'))
+    store.save('source-a', {'u1': {'name': 'h'}})
+    store.save('source-b', {'u2': {'name': 'h'}})
+    assert store.load('source-a') == {'u1': {'name': 'h'}}
+    assert store.load('source-b') == {'u2': {'name': 'h'}}
+    assert store.load('unknown') == {}
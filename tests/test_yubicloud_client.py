@@ -0,0 +1,89 @@
+"""Тесты клиента YubiCloud (yubicloud_client.py) против локальной заглушки tools/yubicloud_stub.py."""
+
+import base64
+import os
+import sys
+import threading
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'tools'))
+
+from yubicloud_client import (  # noqa: E402
+    YubiCloudClient, YubiCloudError, YubiCloudSignatureError, parse_response, sign_params,
+)
+from yubicloud_stub import make_handler  # noqa: E402
+
+CLIENT_ID = '12345'
+SECRET = base64.b64encode(b'stub-secret-key-0123').decode('ascii')
+OTHER_SECRET = base64.b64encode(b'another-secret-key-9').decode('ascii')
+OTP = 'cccccccbcjdk' + 'c' * 32
+
+
+@pytest.fixture
+def stub_url():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), make_handler({CLIENT_ID: SECRET}))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_port}/wsapi/2.0/verify'
+    server.shutdown()
+    server.server_close()
+
+
+def signed(data, secret=SECRET):
+    return dict(data, h=sign_params(data, secret))
+
+
+def test_sign_params_ignores_h_and_order():
+    params = {'otp': OTP, 'id': CLIENT_ID, 'nonce': 'abc'}
+    assert sign_params(params, SECRET) == sign_params(dict(reversed(list(params.items())), h='x'), SECRET)
+    assert sign_params(params, SECRET) != sign_params(params, OTHER_SECRET)
+
+
+def test_parse_response():
+    assert parse_response('status=OK\r\nh=a=b\r\n\r\n') == {'status': 'OK', 'h': 'a=b'}
+
+
+def test_verify_ok_then_replayed(stub_url):
+    client = YubiCloudClient([stub_url], timeout=2)
+    assert client.verify(CLIENT_ID, SECRET, OTP) == 'OK'
+    assert client.verify(CLIENT_ID, SECRET, OTP) == 'REPLAYED_OTP'
+
+
+def test_bad_otp_and_unknown_client(stub_url):
+    client = YubiCloudClient([stub_url], timeout=2)
+    assert client.verify(CLIENT_ID, SECRET, 'not-an-otp') == 'BAD_OTP'
+    assert client.verify('999', SECRET, OTP) == 'NO_SUCH_CLIENT'
+
+
+def test_wrong_secret_fails_response_signature(stub_url):
+    client = YubiCloudClient([stub_url], timeout=2)
+    # Заглушка подписывает ответ BAD_SIGNATURE настоящим секретом клиента
+    with pytest.raises(YubiCloudSignatureError):
+        client.verify(CLIENT_ID, OTHER_SECRET, OTP)
+
+
+def test_tampered_response_is_rejected():
+    data = signed({'status': 'OK', 'otp': OTP, 'nonce': 'n1'})
+    assert YubiCloudClient._check_response(dict(data), OTP, 'n1', SECRET) == 'OK'
+    with pytest.raises(YubiCloudSignatureError):
+        YubiCloudClient._check_response(dict(data, status='REPLAYED_OTP'), OTP, 'n1', SECRET)
+    with pytest.raises(YubiCloudSignatureError):
+        YubiCloudClient._check_response({'status': 'OK', 'otp': OTP, 'nonce': 'n1'}, OTP, 'n1', SECRET)
+
+
+def test_ok_with_foreign_nonce_or_otp_is_rejected():
+    with pytest.raises(YubiCloudError, match='nonce'):
+        YubiCloudClient._check_response(signed({'status': 'OK', 'otp': OTP, 'nonce': 'other'}), OTP, 'n1', SECRET)
+    with pytest.raises(YubiCloudError, match='nonce'):
+        YubiCloudClient._check_response(signed({'status': 'OK', 'otp': OTP[:-1] + 'd', 'nonce': 'n1'}),
+                                        OTP, 'n1', SECRET)
+
+
+def test_unreachable_server_raises():
+    client = YubiCloudClient(['http://127.0.0.1:9/wsapi/2.0/verify'], timeout=1)
+    with pytest.raises(YubiCloudError):
+        client.verify(CLIENT_ID, SECRET, OTP)
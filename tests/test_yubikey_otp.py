@@ -0,0 +1,82 @@
+"""Тесты локальной проверки Yubico OTP (yubikey_otp.py)."""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from yubikey_otp import (  # noqa: E402
+    CRC_OK_RESIDUAL, LocalOTPValidator, OTPValidationError,
+    crc16, decode_token, generate_otp, modhex_decode, modhex_encode,
+)
+
+PUBLIC_ID = 'cccccccbcjdk'
+AES_KEY = '000102030405060708090a0b0c0d0e0f'
+PRIVATE_ID = 'a1b2c3d4e5f6'
+
+
+def make_validator(tmp_path):
+    keys = [{'public_id': PUBLIC_ID, 'aes_key': AES_KEY, 'private_id': PRIVATE_ID, 'name': 'test'}]
+    return LocalOTPValidator(keys, str(tmp_path / 'counters.json'))
+
+
+def test_crc16_residual_of_valid_token():
+    otp = generate_otp(PUBLIC_ID, AES_KEY, PRIVATE_ID, 1, 0)
+    token = decode_token(otp, AES_KEY)
+    assert token['private_id'] == PRIVATE_ID
+    # Данные вместе с записанным CRC дают фиксированный остаток
+    data = bytes(range(14))
+    checksum = (~crc16(data)) & 0xFFFF
+    assert crc16(data + checksum.to_bytes(2, 'little')) == CRC_OK_RESIDUAL
+
+
+def test_decode_token_round_trip():
+    otp = generate_otp(PUBLIC_ID, AES_KEY, PRIVATE_ID, 7, 3, timestamp=0x123456)
+    assert otp.startswith(PUBLIC_ID) and len(otp) == 44
+    token = decode_token(otp, AES_KEY)
+    assert token['use_counter'] == 7
+    assert token['session_counter'] == 3
+    assert token['timestamp'] == 0x123456
+
+
+def test_wrong_aes_key_fails_crc():
+    otp = generate_otp(PUBLIC_ID, AES_KEY, PRIVATE_ID, 1, 0)
+    with pytest.raises(OTPValidationError):
+        decode_token(otp, 'ff' * 16)
+
+
+def test_corrupted_otp_is_rejected():
+    otp = generate_otp(PUBLIC_ID, AES_KEY, PRIVATE_ID, 1, 0)
+    raw = bytearray(modhex_decode(otp[12:]))
+    raw[5] ^= 0x01
+    with pytest.raises(OTPValidationError):
+        decode_token(otp[:12] + modhex_encode(bytes(raw)), AES_KEY)
+
+
+def test_validator_accepts_and_rejects_replay(tmp_path):
+    validator = make_validator(tmp_path)
+    otp = generate_otp(PUBLIC_ID, AES_KEY, PRIVATE_ID, 2, 5)
+    assert validator.verify(otp) == PUBLIC_ID
+    with pytest.raises(OTPValidationError, match='уже был использован'):
+        validator.verify(otp)
+    # Более старый счётчик тоже отклоняется
+    with pytest.raises(OTPValidationError):
+        validator.verify(generate_otp(PUBLIC_ID, AES_KEY, PRIVATE_ID, 2, 4))
+    assert validator.verify(generate_otp(PUBLIC_ID, AES_KEY, PRIVATE_ID, 2, 6)) == PUBLIC_ID
+
+
+def test_counters_survive_restart(tmp_path):
+    otp = generate_otp(PUBLIC_ID, AES_KEY, PRIVATE_ID, 3, 0)
+    make_validator(tmp_path).verify(otp)
+    with pytest.raises(OTPValidationError):
+        make_validator(tmp_path).verify(otp)
+
+
+def test_unknown_key_and_private_id_mismatch(tmp_path):
+    validator = make_validator(tmp_path)
+    with pytest.raises(OTPValidationError):
+        validator.verify(generate_otp('cccccccbcjdl', AES_KEY, PRIVATE_ID, 1, 0))
+    with pytest.raises(OTPValidationError, match='private id'):
+        validator.verify(generate_otp(PUBLIC_ID, AES_KEY, '000000000000', 1, 0))
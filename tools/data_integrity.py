@@ -20,19 +20,23 @@ def verify_data_integrity(servers):
     warnings = []
     
     if not isinstance(servers, list):
-        return False, ["Data is not a list"]
+        return False, ["Data is not a list"], []
     
     for i, server in enumerate(servers):
+        if not isinstance(server, dict):
+            errors.append(f"Server {i}: record must be dict, got {type(server).__name__}")
+            continue
+        
         # Проверяем обязательные поля
         required_fields = ['id', 'name', 'provider']
         for field in required_fields:
             if field not in server:
                 errors.append(f"Server {i}: Missing required field '{field}'")
         
-        # Проверяем формат UUID
-        if 'id' in server:
+        # Проверяем формат id: целое число (файлы данных приложения) или UUID
+        if 'id' in server and (isinstance(server['id'], bool) or not isinstance(server['id'], int)):
             try:
-                uuid.UUID(server['id'])
+                uuid.UUID(str(server['id']))
             except ValueError:
                 errors.append(f"Server {i}: Invalid UUID format '{server['id']}'")
         
@@ -1,14 +1,50 @@
 #!/usr/bin/env python3
 """
 Скрипт для диагностики и исправления проблем с данными AI Manager
+
+Проверяет все файлы данных (data/*.enc) и снимки резервных копий (data/backups)
+параллельно на всех ядрах, перебирая один или несколько ключей-кандидатов:
+какой ключ подходит, сколько записей, ошибки схемы (verify_data_integrity),
+секретные поля, зашифрованные другим ключом, и время каждого этапа.
+Отчёт сохраняется в logs/integrity_scan_*.json.
+
+    python tools/fix_data_integrity.py
+    python tools/fix_data_integrity.py --scan-only --key <старый ключ> --keys-file keys.txt
 """
 
+import argparse
 import os
+import sys
 import json
-import base64
-from cryptography.fernet import Fernet
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from cryptography.fernet import Fernet, InvalidToken
 from pathlib import Path
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from backup_store import BackupStore, BackupStoreError, key_fingerprint  # noqa: E402
+from data_integrity import verify_data_integrity  # noqa: E402
+
+# Секретные поля записей (как ENCRYPTED_FIELDS в app.py)
+ENCRYPTED_FIELDS = [
+    ('credentials', 'username'),
+    ('credentials', 'password'),
+    ('credentials', 'additional_info'),
+    ('personal_cabinet', 'account_email'),
+    ('ssh_credentials', 'password'),
+    ('ssh_credentials', 'root_password'),
+    ('panel_credentials', 'user'),
+    ('panel_credentials', 'password'),
+    ('hoster_credentials', 'user'),
+    ('hoster_credentials', 'password')
+]
+# Начало любого токена Fernet (версия 0x80 в base64)
+FERNET_PREFIX = 'gAAAAA'
+# Сколько ошибок схемы и полей со старым ключом перечислять на файл (счётчики — по всем)
+MAX_LISTED = 50
+
 def load_secret_key():
     """Загружает SECRET_KEY из .env файла"""
     try:
@@ -21,25 +57,211 @@ def load_secret_key():
         return None
     return None
 
-def test_decryption(file_path, secret_key):
-    """Тестирует расшифровку файла"""
+def _ms(started):
+    return round((time.perf_counter() - started) * 1000, 1)
+
+def _new_result(kind, path):
+    return {
+        'type': kind,
+        'path': str(path),
+        'size': None,
+        'key': None,
+        'key_fingerprint': None,
+        'records': None,
+        'schema_ok': None,
+        'schema_errors_total': 0,
+        'schema_errors': [],
+        'schema_warnings': 0,
+        'fields': None,
+        'error': None,
+        'timings_ms': {},
+    }
+
+def classify_fields(records, fernets, expected):
+    """
+    Каким ключом зашифровано каждое секретное поле. expected — индекс ключа, которым
+    поля должны быть зашифрованы; поля под другим ключом-кандидатом считаются старыми.
+    """
+    fields = {'total': 0, 'by_key': {}, 'old_key': 0, 'undecryptable': 0, 'plaintext': 0, 'old_key_fields': []}
+    order = ([expected] if expected is not None else []) + [i for i in range(len(fernets)) if i != expected]
+    for index, record in enumerate(records):
+        if not isinstance(record, dict):
+            continue
+        for section, field in ENCRYPTED_FIELDS:
+            block = record.get(section)
+            value = block.get(field) if isinstance(block, dict) else None
+            if not isinstance(value, str) or not value:
+                continue
+            fields['total'] += 1
+            match = None
+            for candidate in order:
+                try:
+                    fernets[candidate][1].decrypt(value.encode())
+                except InvalidToken:
+                    continue
+                match = candidate
+                break
+            if match is None:
+                fields['undecryptable' if value.startswith(FERNET_PREFIX) else 'plaintext'] += 1
+                continue
+            label = fernets[match][0]
+            fields['by_key'][label] = fields['by_key'].get(label, 0) + 1
+            if match != expected:
+                fields['old_key'] += 1
+                if len(fields['old_key_fields']) < MAX_LISTED:
+                    fields['old_key_fields'].append({'record': index, 'name': record.get('name'),
+                                                     'field': f"{section}.{field}", 'key': label})
+    return fields
+
+def _check_records(result, records, fernets, expected):
+    """Схема и секретные поля расшифрованного списка записей."""
+    if not isinstance(records, list):
+        result['error'] = 'Данные не являются списком записей'
+        return
+    result['records'] = len(records)
+    started = time.perf_counter()
     try:
-        with open(file_path, 'rb') as f:
-            encrypted_data = f.read()
-        
-        if not encrypted_data:
-            return False, "Файл пустой"
-            
-        fernet = Fernet(secret_key.encode())
-        decrypted_data = fernet.decrypt(encrypted_data)
-        data = json.loads(decrypted_data.decode('utf-8'))
-        
-        return True, f"Успешно расшифровано: {len(data)} сервисов"
+        schema = verify_data_integrity(records)
+        result['schema_ok'], errors = schema[0], schema[1]
+        result['schema_warnings'] = len(schema[2]) if len(schema) > 2 else 0
+        result['schema_errors_total'] = len(errors)
+        result['schema_errors'] = errors[:MAX_LISTED]
     except Exception as e:
-        return False, str(e)
+        result['schema_ok'] = False
+        result['schema_errors'] = [f"Проверка схемы прервана: {e}"]
+        result['schema_errors_total'] = 1
+    result['timings_ms']['schema'] = _ms(started)
+    started = time.perf_counter()
+    result['fields'] = classify_fields(records, fernets, expected)
+    result['timings_ms']['fields'] = _ms(started)
 
-def analyze_data_files():
-    """Анализирует все файлы данных"""
+def _decrypt_vault(result, encrypted_data, fernets):
+    """Расшифровывает файл данных первым подходящим ключом и проверяет записи."""
+    if not encrypted_data:
+        result['error'] = 'Файл пустой'
+        return
+    started = time.perf_counter()
+    for index, (label, fernet, fingerprint) in enumerate(fernets):
+        try:
+            decrypted_data = fernet.decrypt(encrypted_data)
+        except InvalidToken:
+            continue
+        result['timings_ms']['decrypt'] = _ms(started)
+        result['key'], result['key_fingerprint'] = label, fingerprint
+        started = time.perf_counter()
+        try:
+            records = json.loads(decrypted_data.decode('utf-8'))
+        except (UnicodeDecodeError, ValueError) as e:
+            result['error'] = f'Расшифровано, но содержимое не JSON: {e}'
+            return
+        result['timings_ms']['parse'] = _ms(started)
+        _check_records(result, records, fernets, index)
+        return
+    result['timings_ms']['decrypt'] = _ms(started)
+    result['error'] = 'Не расшифровывается ни одним из ключей'
+
+def _fernets(keys):
+    return [(label, Fernet(key.encode()), key_fingerprint(key)) for label, key in keys]
+
+def scan_vault_file(path, keys):
+    """Проверка одного .enc файла (выполняется в отдельном процессе). keys — [(метка, ключ)]."""
+    total = time.perf_counter()
+    result = _new_result('file', path)
+    started = time.perf_counter()
+    try:
+        encrypted_data = Path(path).read_bytes()
+    except OSError as e:
+        result['error'] = str(e)
+        return result
+    result['timings_ms']['read'] = _ms(started)
+    result['size'] = len(encrypted_data)
+    _decrypt_vault(result, encrypted_data, _fernets(keys))
+    result['timings_ms']['total'] = _ms(total)
+    return result
+
+def scan_snapshot(root, snapshot_id, keys):
+    """Проверка снимка хранилища резервных копий (выполняется в отдельном процессе)."""
+    total = time.perf_counter()
+    result = _new_result('snapshot', os.path.join(root, 'snapshots', f'{snapshot_id}.json'))
+    result['snapshot_id'] = snapshot_id
+    fernets = _fernets(keys)
+    probe = BackupStore(root, key_provider=None)
+    store_key = next((key for _label, key in keys if probe.unlocks(key)), None)
+    if store_key is None:
+        result['error'] = 'Ключ хранилища резервных копий не подходит ни к одному из ключей'
+        return result
+    result['store_key'] = next(label for label, key in keys if key == store_key)
+    started = time.perf_counter()
+    try:
+        manifest, content = BackupStore(root, key_provider=lambda: store_key).restore(snapshot_id)
+    except BackupStoreError as e:
+        result['error'] = str(e)
+        return result
+    result['timings_ms']['restore'] = _ms(started)
+    result['size'] = manifest.get('size')
+    result['reason'] = manifest.get('reason')
+    result['created_at'] = manifest.get('created_at')
+    if manifest.get('kind') == 'raw':
+        _decrypt_vault(result, content, fernets)
+    else:
+        # Поля снимка зашифрованы ключом, действовавшим при его создании
+        expected = next((i for i, f in enumerate(fernets) if f[2] == manifest.get('key_fingerprint')), None)
+        if expected is not None:
+            result['key'], result['key_fingerprint'] = fernets[expected][0], fernets[expected][2]
+        else:
+            result['key_fingerprint'] = manifest.get('key_fingerprint')
+        _check_records(result, content, fernets, expected)
+    result['timings_ms']['total'] = _ms(total)
+    return result
+
+def _snapshot_ids(backups_root):
+    snapshots_dir = Path(backups_root) / 'snapshots'
+    if not snapshots_dir.is_dir():
+        return []
+    return sorted(p.stem for p in snapshots_dir.glob('*.json'))
+
+def scan_data_files(keys, data_dir='data', workers=None):
+    """
+    Параллельная проверка всех файлов данных и снимков. keys — [(метка, ключ)], первый —
+    текущий ключ. Возвращает отчёт (словарь) со списком результатов по файлам.
+    """
+    started = time.perf_counter()
+    data_path = Path(data_dir)
+    backups_root = str(data_path / 'backups')
+    enc_files = sorted(data_path.glob('*.enc'))
+    snapshot_ids = _snapshot_ids(backups_root)
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(scan_vault_file, str(path), keys) for path in enc_files]
+        futures += [pool.submit(scan_snapshot, backups_root, snapshot_id, keys) for snapshot_id in snapshot_ids]
+        results = [future.result() for future in futures]
+    return {
+        'generated_at': datetime.now().isoformat(timespec='seconds'),
+        'data_dir': str(data_path.absolute()),
+        'keys': [{'label': label, 'fingerprint': key_fingerprint(key)} for label, key in keys],
+        'workers': workers,
+        'duration_ms': _ms(started),
+        'summary': {
+            'files': len(enc_files),
+            'snapshots': len(snapshot_ids),
+            'readable': sum(1 for r in results if r['records'] is not None),
+            'unreadable': sum(1 for r in results if r['records'] is None),
+            'with_schema_errors': sum(1 for r in results if r['schema_ok'] is False),
+            'with_old_key_fields': sum(1 for r in results if r['fields'] and r['fields']['old_key']),
+        },
+        'files': results,
+    }
+
+def write_report(report, report_path=None):
+    if report_path is None:
+        Path('logs').mkdir(exist_ok=True)
+        report_path = Path('logs') / f"integrity_scan_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    return report_path
+
+def analyze_data_files(extra_keys=(), data_dir='data', workers=None, report_path=None):
+    """Анализирует все файлы данных и снимки; возвращает файлы, которые читаются текущим ключом"""
     print("🔍 АНАЛИЗ ФАЙЛОВ ДАННЫХ")
     print("=" * 50)
     
@@ -48,31 +270,49 @@ def analyze_data_files():
         print("❌ Не удалось загрузить SECRET_KEY")
         return
     
-    data_dir = Path("data")
-    if not data_dir.exists():
+    data_path = Path(data_dir)
+    if not data_path.exists():
         print("❌ Папка data не найдена")
         return
     
-    # Находим все .enc файлы
-    enc_files = list(data_dir.glob("*.enc"))
+    keys = [('SECRET_KEY (.env)', secret_key)]
+    for number, key in enumerate(extra_keys, start=2):
+        try:
+            Fernet(key.encode())
+        except ValueError:
+            print(f"⚠️ Ключ #{number} пропущен: неверный формат Fernet")
+            continue
+        keys.append((f'key{number}', key))
     
-    print(f"Найдено файлов: {len(enc_files)}")
+    report = scan_data_files(keys, data_path, workers)
+    summary = report['summary']
+    print(f"Найдено файлов: {summary['files']}, снимков: {summary['snapshots']}, "
+          f"ключей: {len(keys)}, процессов: {report['workers']}")
     print()
     
     working_files = []
-    
-    for file_path in enc_files:
-        print(f"📁 {file_path.name}:")
-        print(f"   Размер: {file_path.stat().st_size} байт")
-        
-        success, message = test_decryption(file_path, secret_key)
-        if success:
-            print(f"   ✅ {message}")
-            working_files.append(file_path)
+    for result in report['files']:
+        name = result.get('snapshot_id') or Path(result['path']).name
+        print(f"📁 {name}{' (снимок)' if result['type'] == 'snapshot' else ''}:")
+        if result['size'] is not None:
+            print(f"   Размер: {result['size']} байт")
+        if result['records'] is None:
+            print(f"   ❌ {result['error']}")
         else:
-            print(f"   ❌ {message}")
+            print(f"   ✅ Ключ: {result['key'] or result['key_fingerprint']}, сервисов: {result['records']}, "
+                  f"{result['timings_ms'].get('total', 0)} мс")
+            if not result['schema_ok']:
+                print(f"   ⚠️ Ошибок схемы: {result['schema_errors_total']}")
+            fields = result['fields']
+            if fields['old_key'] or fields['undecryptable']:
+                print(f"   ⚠️ Поля под другим ключом: {fields['old_key']}, не расшифровываются: {fields['undecryptable']}")
+            if result['type'] == 'file' and result['key'] == keys[0][0]:
+                working_files.append(Path(result['path']))
         print()
     
+    saved = write_report(report, report_path)
+    print(f"📝 Отчёт: {saved} ({report['duration_ms']} мс)")
+    print()
     return working_files
 
 def fix_active_file(working_files):
@@ -180,11 +420,28 @@ print(f"Результат: {message}")
 
 def main():
     """Главная функция"""
+    parser = argparse.ArgumentParser(description='Проверка и исправление файлов данных AI Manager')
+    parser.add_argument('--key', action='append', default=[],
+                        help='Дополнительный ключ-кандидат (например, прежний SECRET_KEY), можно указать несколько раз')
+    parser.add_argument('--keys-file', help='Файл с ключами-кандидатами, по одному в строке')
+    parser.add_argument('--data-dir', default='data', help='Папка с файлами данных')
+    parser.add_argument('--workers', type=int, default=None, help='Число процессов (по умолчанию — число ядер)')
+    parser.add_argument('--report', help='Путь к JSON-отчёту (по умолчанию logs/integrity_scan_*.json)')
+    parser.add_argument('--scan-only', action='store_true', help='Только проверка и отчёт, без исправления конфигурации')
+    args = parser.parse_args()
+
+    extra_keys = list(args.key)
+    if args.keys_file:
+        with open(args.keys_file, 'r', encoding='utf-8') as f:
+            extra_keys += [line.strip() for line in f if line.strip() and not line.startswith('#')]
+
     print("🤖 AI MANAGER - ИСПРАВЛЕНИЕ ЦЕЛОСТНОСТИ ДАННЫХ")
     print("=" * 60)
     
     # Анализируем файлы
-    working_files = analyze_data_files()
+    working_files = analyze_data_files(extra_keys, args.data_dir, args.workers, args.report)
+    if args.scan_only:
+        return
     
     if not working_files:
         print("❌ Нет рабочих файлов данных для восстановления")
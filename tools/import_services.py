@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+Массовый импорт сервисов из CSV/JSON в активный файл данных (без веб-интерфейса).
+
+Понимает экспорты паролей браузеров и менеджеров паролей (Chrome, Firefox,
+Bitwarden, LastPass, 1Password) и собственные таблицы; см. bulk_import.py.
+Запускать из папки проекта, пока приложение не работает с тем же файлом:
+
+    python tools/import_services.py passwords.csv
+    python tools/import_services.py bitwarden_export.json --allow-duplicates
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Массовый импорт сервисов из CSV/JSON')
+    parser.add_argument('file', help='Файл экспорта (.csv или .json)')
+    parser.add_argument('--format', choices=('csv', 'json'), help='Формат файла (по умолчанию — по расширению)')
+    parser.add_argument('--allow-duplicates', action='store_true',
+                        help='Импортировать и записи с тем же именем и URL, что у существующих')
+    parser.add_argument('--workers', type=int, default=None, help='Потоков шифрования')
+    parser.add_argument('--json', action='store_true', help='Вывести отчёт в формате JSON')
+    args = parser.parse_args()
+
+    import app  # noqa: E402  — загружает ключ и конфигурацию активного файла
+    from bulk_import import BulkImportError
+
+    started = time.perf_counter()
+    try:
+        with open(args.file, 'rb') as f:
+            report = app.bulk_import_services(f, args.file, fmt=args.format,
+                                              skip_duplicates=not args.allow_duplicates,
+                                              workers=args.workers)
+    except (OSError, BulkImportError) as e:
+        print(f"❌ Ошибка импорта: {e}")
+        return 1
+    report['duration_s'] = round(time.perf_counter() - started, 2)
+
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        return 0
+    print(f"✅ Импортировано сервисов: {report['imported']} ({report['format']}, {report['duration_s']} с)")
+    print(f"   Пропущено дубликатов: {report['skipped_duplicates']}")
+    if report['errors']:
+        print(f"⚠️ Строк с ошибками: {report['errors']}")
+        for item in report['error_rows']:
+            print(f"   строка {item['row']}: {item['error']}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
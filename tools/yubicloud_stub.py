@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Локальная заглушка сервера проверки YubiCloud (протокол 2.0).
+
+Принимает любой OTP правильного формата ровно один раз (повтор — REPLAYED_OTP),
+подписывает ответы секретами указанных клиентов. Нужна для проверки и замера
+входа без сети:
+
+    python tools/yubicloud_stub.py --client 12345:<base64 secret> --port 8765
+    YUBIKEY_API_URL=http://127.0.0.1:8765/wsapi/2.0/verify python run_app.py
+"""
+
+import argparse
+import os
+import re
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from yubicloud_client import sign_params  # noqa: E402
+
+OTP_RE = re.compile(r'^[cbdefghijklnrtuv]{32,48}$')
+
+
+def make_handler(clients, delay=0.0):
+    seen = set()
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def _reply(self, status, params, secret):
+            data = {
+                't': datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ0000'),
+                'status': status
+            }
+            for key in ('otp', 'nonce'):
+                if key in params:
+                    data[key] = params[key]
+            if secret:
+                data['h'] = sign_params(data, secret)
+            body = ''.join(f"{k}={v}\r\n" for k, v in data.items()).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if delay:
+                time.sleep(delay)
+            params = dict(parse_qsl(urlparse(self.path).query))
+            secret = clients.get(params.get('id'))
+            if secret is None:
+                return self._reply('NO_SUCH_CLIENT', params, None)
+            if params.get('h') != sign_params(params, secret):
+                return self._reply('BAD_SIGNATURE', params, secret)
+            otp = params.get('otp', '')
+            if not OTP_RE.match(otp):
+                return self._reply('BAD_OTP', params, secret)
+            with lock:
+                if otp in seen:
+                    return self._reply('REPLAYED_OTP', params, secret)
+                seen.add(otp)
+            self._reply('OK', params, secret)
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Локальная заглушка YubiCloud')
+    parser.add_argument('--client', action='append', default=[], metavar='ID:SECRET',
+                        help='Client ID и Secret Key (base64), можно указать несколько раз')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--delay', type=float, default=0.0, help='Искусственная задержка ответа, сек')
+    args = parser.parse_args()
+
+    clients = {}
+    for item in args.client:
+        client_id, _, secret = item.partition(':')
+        if not client_id or not secret:
+            parser.error(f'Ожидается ID:SECRET, получено: {item}')
+        clients[client_id] = secret
+
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(clients, args.delay))
+    print(f"🔑 Заглушка YubiCloud: http://{args.host}:{server.server_port}/wsapi/2.0/verify")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
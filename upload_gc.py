@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+Фоновая сборка мусора в хранилище загрузок.
+
+Имена в индексе UploadStore сверяются с именами, на которые ссылаются записи
+(referenced_names по файлам данных). Имя без ссылок сначала только помечается
+«сиротой» (время первого обнаружения хранится в .store/gc.json) и удаляется
+при одном из следующих проходов, если за grace-период на него так никто и не
+сослался. Файлы, которых нет в индексе (блобы после сбоя, брошенные временные
+файлы загрузок), удаляются, если не менялись дольше grace-периода.
+
+Имена обрабатываются пачками: блокировка хранилища берётся на одну пачку,
+между пачками поток уступает запросам. Режим dry_run только строит отчёт
+и ничего не меняет (в том числе отметки в gc.json).
+"""
+
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+DEFAULT_GRACE = 24 * 3600
+DEFAULT_INTERVAL = 6 * 3600
+DEFAULT_BATCH_SIZE = 200
+BATCH_PAUSE = 0.05
+STATE_NAME = 'gc.json'
+# Сколько имён-сирот перечислять в отчёте (счётчики считаются по всем)
+REPORT_LIMIT = 500
+
+
+def _iso(ts):
+    return datetime.fromtimestamp(ts).isoformat(timespec='seconds')
+
+
+class UploadGC:
+    def __init__(self, store, referenced_provider, grace=DEFAULT_GRACE, interval=DEFAULT_INTERVAL,
+                 batch_size=DEFAULT_BATCH_SIZE, dry_run=False):
+        """
+        referenced_provider() возвращает множество имён, на которые есть ссылки,
+        или None, если это сейчас нельзя определить (тогда проход пропускается).
+        Вызывается перед каждой пачкой, поэтому должен быть дешёвым при неизменных данных.
+        """
+        self.store = store
+        self.referenced_provider = referenced_provider
+        self.grace = grace
+        self.interval = interval
+        self.batch_size = max(1, int(batch_size))
+        self.dry_run = dry_run
+        self.state_path = os.path.join(store.store_dir, STATE_NAME)
+        self.last_report = None
+        self._run_lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+
+    # --- Состояние: время первого обнаружения сирот ---
+    def _load_state(self):
+        try:
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            return {name: float(ts) for name, ts in (data.get('orphans') or {}).items()}
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError, AttributeError) as e:
+            print(f"⚠️ Состояние сборщика мусора повреждено, отметки сброшены: {e}")
+            return {}
+
+    def _save_state(self, orphans):
+        os.makedirs(os.path.dirname(self.state_path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix='gc.', suffix='.tmp', dir=os.path.dirname(self.state_path))
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump({'orphans': orphans}, f, ensure_ascii=False)
+            os.replace(tmp_path, self.state_path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    # --- Проход ---
+    def run(self, dry_run=None):
+        """Один проход сборки мусора. Возвращает отчёт (словарь); одновременно выполняется один проход."""
+        dry_run = self.dry_run if dry_run is None else dry_run
+        with self._run_lock:
+            report = self._run(dry_run)
+        if not dry_run:
+            self.last_report = report
+        return report
+
+    def _run(self, dry_run):
+        started = time.time()
+        report = {
+            'dry_run': dry_run,
+            'started_at': _iso(started),
+            'grace_hours': round(self.grace / 3600, 2),
+            'checked': 0,
+            'orphans_total': 0,
+            'orphans': [],
+            'removed': 0,
+            'removed_bytes': 0,
+            'stray_files': 0,
+            'stray_removed': 0,
+            'skipped': None,
+        }
+        if self.referenced_provider() is None:
+            report['skipped'] = 'Нет доступного файла данных: неизвестно, какие файлы используются'
+            return report
+
+        previous = self._load_state()
+        orphans = {}
+        sizes = {name: size for name, _path, size in self.store.iter_files()}
+        names = self.store.names()
+        for offset in range(0, len(names), self.batch_size):
+            batch = names[offset:offset + self.batch_size]
+            referenced = self.referenced_provider()
+            if referenced is None:
+                report['skipped'] = 'Файл данных стал недоступен во время прохода'
+                break
+            for name in batch:
+                report['checked'] += 1
+                if name in referenced:
+                    continue
+                since = previous.get(name, started)
+                eligible = started - since >= self.grace
+                if eligible and not dry_run:
+                    if self.store.release_if_untouched(name, since):
+                        report['removed'] += 1
+                        report['removed_bytes'] += sizes.get(name, 0)
+                        continue
+                    # Имя загружено заново после первого обнаружения — grace-период отсчитывается снова
+                    since = started
+                orphans[name] = since
+                report['orphans_total'] += 1
+                if len(report['orphans']) < REPORT_LIMIT:
+                    report['orphans'].append({
+                        'name': name,
+                        'size': sizes.get(name, 0),
+                        'orphan_since': _iso(since),
+                        'removable_after': _iso(since + self.grace),
+                    })
+            # Уступаем потоки запросам между пачками
+            time.sleep(BATCH_PAUSE)
+
+        for path, size in self.store.stray_files(started - self.grace):
+            report['stray_files'] += 1
+            if not dry_run and self.store.remove_stray(path):
+                report['stray_removed'] += 1
+                report['removed_bytes'] += size
+
+        if not dry_run and report['skipped'] is None:
+            try:
+                self._save_state(orphans)
+            except OSError as e:
+                print(f"⚠️ Не удалось сохранить состояние сборщика мусора: {e}")
+        report['duration_ms'] = round((time.time() - started) * 1000, 1)
+        return report
+
+    # --- Фоновый поток ---
+    def start(self):
+        """Запускает периодическую сборку мусора в фоновом потоке (однократно)."""
+        if self._thread is not None or self.interval <= 0:
+            return
+        self._thread = threading.Thread(target=self._loop, name='upload-gc', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            try:
+                report = self.run()
+            except Exception as e:
+                print(f"⚠️ Ошибка сборки мусора в хранилище загрузок: {e}")
+                continue
+            if report['removed'] or report['stray_removed']:
+                print(f"🧹 Хранилище загрузок: удалено файлов {report['removed'] + report['stray_removed']}, "
+                      f"освобождено {report['removed_bytes']} байт")
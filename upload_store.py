@@ -0,0 +1,538 @@
+#!/usr/bin/env python3
+"""
+Хранилище загруженных файлов (иконки, чеки) с адресацией по содержимому.
+
+Содержимое хранится один раз под своим SHA-256 в шардированных каталогах
+uploads/.store/blobs/ab/<sha256>. Записи сервисов по-прежнему ссылаются на
+файл по имени (icon_filename, receipts[].filename); индекс сопоставляет имя
+с хешем и считает ссылки на каждый блоб:
+
+- повторная загрузка того же файла не занимает места — добавляется только имя;
+- блоб удаляется, когда на него не остаётся ни одного имени;
+- экспорт и сборка мусора читают индекс, а не os.listdir каталога.
+
+Загрузка проходит за один проход: Werkzeug пишет файл из запроса прямо в
+SpoolFile (временный файл в .store/tmp), который по мере записи считает
+SHA-256, размер и запоминает начало файла для определения типа. put() затем
+только проверяет тип/размер и атомарно переименовывает файл в блоб — без
+повторного копирования и с постоянным расходом памяти.
+
+При включённом шифровании (encrypt=True) блобы хранятся в формате blob_crypto:
+блоки AES-GCM с ключом файла, обёрнутым ключом хранилища. Индекс по-прежнему
+адресует содержимое по SHA-256 открытого текста, поэтому дедупликация работает.
+
+Файлы, лежащие прямо в uploads/ (старый формат или скопированные вручную
+из архива экспорта), переносятся в хранилище adopt_legacy_files().
+"""
+
+import hashlib
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import blob_crypto
+from icon_derivatives import ICON_SIZES, derivative_name
+
+STORE_DIR = '.store'
+INDEX_NAME = 'index.json'
+INDEX_VERSION = 1
+CHUNK_SIZE = 1024 * 1024
+SNIFF_BYTES = 512
+
+IMAGE_TYPES = frozenset({'png', 'jpeg', 'gif', 'webp', 'bmp', 'ico'})
+DOCUMENT_TYPES = frozenset({'pdf', 'png', 'jpeg', 'rtf', 'text'})
+
+
+class UploadStoreError(Exception):
+    """Недопустимое имя файла или ошибка записи в хранилище."""
+
+
+class UploadTooLarge(UploadStoreError):
+    """Файл больше допустимого размера."""
+
+
+class UploadTypeError(UploadStoreError):
+    """Содержимое файла не соответствует допустимым типам."""
+
+
+def sniff_type(head):
+    """Тип файла по первым байтам: png, jpeg, gif, webp, bmp, ico, pdf, rtf, text или None."""
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'png'
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'jpeg'
+    if head[:6] in (b'GIF87a', b'GIF89a'):
+        return 'gif'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'webp'
+    if head.startswith(b'%PDF-'):
+        return 'pdf'
+    if head.startswith(b'{\\rtf'):
+        return 'rtf'
+    if head.startswith(b'BM') and len(head) >= 14:
+        return 'bmp'
+    if head.startswith(b'\x00\x00\x01\x00'):
+        return 'ico'
+    if head and b'\x00' not in head:
+        try:
+            # Последний символ мог быть обрезан на границе SNIFF_BYTES
+            head.decode('utf-8')
+            return 'text'
+        except UnicodeDecodeError as e:
+            if e.start >= len(head) - 3:
+                return 'text'
+    return None
+
+
+class SpoolFile:
+    """
+    Временный файл для загрузки, который при записи считает SHA-256, размер
+    и сохраняет первые SNIFF_BYTES байт. Если файл не был передан в put(),
+    он удаляется при закрытии.
+    """
+
+    def __init__(self, tmp_dir, max_size=None):
+        os.makedirs(tmp_dir, exist_ok=True)
+        fd, self.path = tempfile.mkstemp(dir=tmp_dir, suffix='.part')
+        self._file = os.fdopen(fd, 'w+b')
+        self._hash = hashlib.sha256()
+        self.tmp_dir = tmp_dir
+        self.max_size = max_size
+        self.size = 0
+        self.head = b''
+        self._moved = False
+
+    def write(self, data):
+        if self.max_size is not None and self.size + len(data) > self.max_size:
+            raise UploadTooLarge(f'Файл больше {self.max_size // (1024 * 1024)} МБ')
+        if len(self.head) < SNIFF_BYTES:
+            self.head += bytes(data[:SNIFF_BYTES - len(self.head)])
+        self._hash.update(data)
+        self.size += len(data)
+        return self._file.write(data)
+
+    @property
+    def digest(self):
+        return self._hash.hexdigest()
+
+    @property
+    def closed(self):
+        return self._file.closed
+
+    def move_to(self, target):
+        self._file.close()
+        os.replace(self.path, target)
+        self._moved = True
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+        if not self._moved:
+            self._moved = True
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+    def __getattr__(self, name):
+        # read/readline/seek/tell/flush и прочее — от настоящего файла
+        if name == '_file':
+            raise AttributeError(name)
+        return getattr(self._file, name)
+
+
+def referenced_names(services):
+    """Имена файлов, на которые ссылаются записи сервисов (иконки с миниатюрами и чеки)."""
+    names = set()
+    for service in services or []:
+        if service.get('icon_filename'):
+            names.add(service['icon_filename'])
+            names.update(derivative_name(service['icon_filename'], size) for size in ICON_SIZES)
+        for receipt in (service.get('payment_info') or {}).get('receipts') or []:
+            if receipt.get('filename'):
+                names.add(receipt['filename'])
+    return names
+
+
+class UploadStore:
+    def __init__(self, root, key_provider=None, encrypt=False):
+        """
+        key_provider() возвращает текущий SECRET_KEY (он меняется при смене главного ключа);
+        encrypt — шифровать новые блобы. Зашифрованные блобы читаются в любом режиме.
+        """
+        self.root = root
+        self.key_provider = key_provider
+        self.encrypt = encrypt
+        self.store_dir = os.path.join(root, STORE_DIR)
+        self.blobs_dir = os.path.join(self.store_dir, 'blobs')
+        self.tmp_dir = os.path.join(self.store_dir, 'tmp')
+        self.index_path = os.path.join(self.store_dir, INDEX_NAME)
+        self._lock = threading.RLock()
+        self._index = None  # загружается при первом обращении
+        self._touched = {}  # имя -> time.time() последней привязки в этом процессе (для сборки мусора)
+
+    # --- Индекс ---
+    def _load_index(self):
+        if self._index is None:
+            index = {'version': INDEX_VERSION, 'names': {}, 'blobs': {}}
+            try:
+                with open(self.index_path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                if isinstance(data, dict):
+                    index['names'] = dict(data.get('names') or {})
+                    index['blobs'] = dict(data.get('blobs') or {})
+            except FileNotFoundError:
+                pass
+            except (OSError, ValueError) as e:
+                print(f"⚠️ Индекс хранилища загрузок повреждён, будет пересобран: {e}")
+            self._index = index
+        return self._index
+
+    def _save_index(self):
+        os.makedirs(self.store_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix='index.', suffix='.tmp', dir=self.store_dir)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(self._index, f, ensure_ascii=False)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.index_path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    def blob_path(self, digest):
+        return os.path.join(self.blobs_dir, digest[:2], digest)
+
+    @staticmethod
+    def _check_name(name):
+        if not name or '/' in name or '\\' in name or name.startswith('.'):
+            raise UploadStoreError(f'Недопустимое имя файла: {name!r}')
+
+    # --- Запись ---
+    def open_spool(self, max_size=None):
+        """Файл, в который Werkzeug пишет загрузку (см. Request._get_file_stream)."""
+        return SpoolFile(self.tmp_dir, max_size)
+
+    def _spool(self, stream, max_size=None):
+        """Копирует поток в SpoolFile блоками по CHUNK_SIZE."""
+        spool = self.open_spool(max_size)
+        try:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                spool.write(chunk)
+        except BaseException:
+            spool.close()
+            raise
+        return spool
+
+    def _link(self, name, digest, size):
+        """Привязывает имя к блобу (под self._lock). Старый блоб имени освобождается."""
+        index = self._load_index()
+        previous = index['names'].get(name)
+        if previous == digest:
+            return
+        blob = index['blobs'].setdefault(digest, {'size': size, 'refs': 0,
+                                                  'created_at': datetime.now().isoformat()})
+        blob['refs'] += 1
+        index['names'][name] = digest
+        self._touched[name] = time.time()
+        if previous:
+            self._unref(previous)
+
+    def _unref(self, digest):
+        index = self._load_index()
+        blob = index['blobs'].get(digest)
+        if blob is None:
+            return
+        blob['refs'] -= 1
+        if blob['refs'] <= 0:
+            del index['blobs'][digest]
+            try:
+                os.remove(self.blob_path(digest))
+            except FileNotFoundError:
+                pass
+
+    def put(self, name, stream, max_size=None, allowed_types=None):
+        """
+        Сохраняет содержимое потока под именем name. Если такой блоб уже есть,
+        новый файл не создаётся. Поток, уже записанный в SpoolFile этого хранилища,
+        не копируется повторно, а переименовывается.
+
+        max_size — предел размера в байтах (UploadTooLarge), allowed_types — допустимые
+        типы по sniff_type (UploadTypeError). Возвращает (sha256, тип, было ли содержимое
+        уже в хранилище).
+        """
+        self._check_name(name)
+        encrypted = None
+        if isinstance(stream, SpoolFile) and not stream.closed and stream.tmp_dir == self.tmp_dir:
+            spool = stream
+        else:
+            spool = self._spool(stream, max_size)
+        try:
+            if max_size is not None and spool.size > max_size:
+                raise UploadTooLarge(f'Файл больше {max_size // (1024 * 1024)} МБ')
+            kind = sniff_type(spool.head)
+            if allowed_types is not None and kind not in allowed_types:
+                raise UploadTypeError(f"Недопустимый тип файла: {kind or 'неизвестный'}")
+            digest = spool.digest
+            target = self.blob_path(digest)
+            key = self._key()
+            needs_encryption = bool(self.encrypt and key)
+            while True:
+                with self._lock:
+                    existed = self._has_blob(digest)
+                    # Блоб мог исчезнуть после первой проверки: без шифртекста не записываем
+                    if existed or not needs_encryption or encrypted:
+                        if not existed:
+                            os.makedirs(os.path.dirname(target), exist_ok=True)
+                            if encrypted:
+                                os.replace(encrypted, target)
+                                encrypted = None
+                            else:
+                                spool.move_to(target)
+                        self._link(name, digest, spool.size)
+                        self._save_index()
+                        break
+                # Шифруем вне блокировки: большие файлы не задерживают другие загрузки
+                spool.seek(0)
+                encrypted = self._encrypt_to_temp(spool, spool.size, key)
+        finally:
+            spool.close()
+            if encrypted:
+                os.remove(encrypted)
+        return digest, kind, existed
+
+    def _key(self):
+        return self.key_provider() if self.key_provider else None
+
+    def _has_blob(self, digest):
+        return digest in self._load_index()['blobs'] and os.path.exists(self.blob_path(digest))
+
+    def _encrypt_to_temp(self, src, size, key):
+        """Шифрует поток во временный файл хранилища и возвращает его путь."""
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.tmp_dir, suffix='.enc')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                blob_crypto.encrypt_stream(src, f, key, size)
+                f.flush()
+                os.fsync(f.fileno())
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        return tmp_path
+
+    def put_bytes(self, name, data):
+        return self.put(name, io.BytesIO(data))
+
+    def release(self, name):
+        """Удаляет имя; блоб удаляется вместе с последней ссылкой. Возвращает True, если имя было."""
+        with self._lock:
+            index = self._load_index()
+            self._touched.pop(name, None)
+            digest = index['names'].pop(name, None)
+            if digest is None:
+                return self._remove_legacy(name)
+            self._unref(digest)
+            self._save_index()
+            return True
+
+    def _remove_legacy(self, name):
+        try:
+            self._check_name(name)
+            os.remove(os.path.join(self.root, name))
+            return True
+        except (UploadStoreError, OSError):
+            return False
+
+    # --- Чтение ---
+    def digest(self, name):
+        with self._lock:
+            return self._load_index()['names'].get(name)
+
+    def path_for(self, name):
+        """Путь к содержимому файла name (блоб или файл старого формата) либо None."""
+        digest = self.digest(name)
+        if digest:
+            path = self.blob_path(digest)
+            if os.path.exists(path):
+                return path
+        try:
+            self._check_name(name)
+        except UploadStoreError:
+            return None
+        legacy = os.path.join(self.root, name)
+        return legacy if os.path.isfile(legacy) else None
+
+    def exists(self, name):
+        return self.path_for(name) is not None
+
+    def open_blob(self, name):
+        """Объект для чтения открытого текста (size, iter_range, open, read_all) или None."""
+        path = self.path_for(name)
+        if path is None:
+            return None
+        return blob_crypto.open_blob(path, self._key())
+
+    def iter_blobs(self):
+        """Список (имя, объект чтения) по индексу; блобы, которые нельзя открыть, пропускаются."""
+        result = []
+        for name, path, _size in self.iter_files():
+            try:
+                result.append((name, blob_crypto.open_blob(path, self._key())))
+            except (OSError, blob_crypto.BlobCryptoError) as e:
+                print(f"⚠️ Не удалось открыть {name}: {e}")
+        return result
+
+    def iter_files(self):
+        """Снимок индекса: список (имя, путь к блобу, размер), отсортированный по имени."""
+        with self._lock:
+            index = self._load_index()
+            items = [(name, digest, index['blobs'].get(digest, {}).get('size', 0))
+                     for name, digest in index['names'].items()]
+        return [(name, self.blob_path(digest), size) for name, digest, size in sorted(items)]
+
+    def stats(self):
+        with self._lock:
+            index = self._load_index()
+            stored = sum(b.get('size', 0) for b in index['blobs'].values())
+            logical = sum(index['blobs'].get(d, {}).get('size', 0) for d in index['names'].values())
+            return {
+                'names': len(index['names']),
+                'blobs': len(index['blobs']),
+                'stored_bytes': stored,
+                'deduplicated_bytes': logical - stored,
+            }
+
+    # --- Сборка мусора (см. upload_gc) ---
+    def names(self):
+        """Отсортированный снимок имён из индекса."""
+        with self._lock:
+            return sorted(self._load_index()['names'])
+
+    def release_if_untouched(self, name, since):
+        """
+        Освобождает имя, если оно не привязывалось заново после момента since (time.time()):
+        файл, повторно загруженный под тем же именем во время проверки, не удаляется.
+        """
+        with self._lock:
+            if self._touched.get(name, 0) >= since:
+                return False
+            return self.release(name)
+
+    def stray_files(self, older_than):
+        """
+        Файлы хранилища, которых нет в индексе и которые не менялись с момента older_than:
+        блобы, оставшиеся после сбоя между записью файла и индекса, и брошенные
+        временные файлы загрузок. Список (путь, размер).
+        """
+        known = set(self._blob_digests())
+        result = []
+        for directory, is_tmp in ((self.blobs_dir, False), (self.tmp_dir, True)):
+            for dirpath, _dirnames, filenames in os.walk(directory):
+                for filename in filenames:
+                    if not is_tmp and filename in known:
+                        continue
+                    path = os.path.join(dirpath, filename)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    if st.st_mtime < older_than:
+                        result.append((path, st.st_size))
+        return result
+
+    def remove_stray(self, path):
+        """Удаляет файл из stray_files(), если он так и не попал в индекс."""
+        with self._lock:
+            if os.path.basename(path) in self._load_index()['blobs']:
+                return False
+            try:
+                os.remove(path)
+                return True
+            except OSError:
+                return False
+
+    # --- Шифрование ---
+    def _blob_digests(self):
+        with self._lock:
+            return list(self._load_index()['blobs'])
+
+    def encrypt_existing(self):
+        """Шифрует незашифрованные блобы (после включения шифрования). Возвращает их число."""
+        key = self._key()
+        if not (self.encrypt and key):
+            return 0
+        count = 0
+        for digest in self._blob_digests():
+            path = self.blob_path(digest)
+            if not os.path.exists(path) or blob_crypto.is_encrypted(path):
+                continue
+            try:
+                with open(path, 'rb') as src:
+                    encrypted = self._encrypt_to_temp(src, os.fstat(src.fileno()).st_size, key)
+                with self._lock:
+                    if os.path.exists(path):
+                        os.replace(encrypted, path)
+                        count += 1
+                    else:
+                        os.remove(encrypted)
+            except (OSError, blob_crypto.BlobCryptoError) as e:
+                print(f"⚠️ Не удалось зашифровать блоб {digest[:12]}: {e}")
+        return count
+
+    def rekey(self, old_key, new_key):
+        """
+        Переводит зашифрованные блобы на новый ключ (перезаписываются только заголовки).
+        При ошибке уже обработанные блобы возвращаются на старый ключ и ошибка пробрасывается.
+        """
+        done = []
+        with self._lock:
+            try:
+                for digest in list(self._load_index()['blobs']):
+                    path = self.blob_path(digest)
+                    if blob_crypto.is_encrypted(path):
+                        blob_crypto.rewrap(path, old_key, new_key)
+                        done.append(path)
+            except Exception:
+                for path in done:
+                    try:
+                        blob_crypto.rewrap(path, new_key, old_key)
+                    except Exception as e:
+                        print(f"❌ Не удалось вернуть старый ключ блобу {path}: {e}")
+                raise
+        return len(done)
+
+    # --- Миграция ---
+    def adopt_legacy_files(self):
+        """Переносит файлы из корня uploads/ в хранилище (имя сохраняется). Возвращает их число."""
+        if not os.path.isdir(self.root):
+            return 0
+        adopted = 0
+        with os.scandir(self.root) as it:
+            entries = [e for e in it if e.is_file() and not e.name.startswith('.')]
+        for entry in entries:
+            try:
+                with open(entry.path, 'rb') as f:
+                    self.put(entry.name, f)
+                os.remove(entry.path)
+                adopted += 1
+            except (OSError, UploadStoreError) as e:
+                print(f"⚠️ Не удалось перенести {entry.name} в хранилище загрузок: {e}")
+        return adopted
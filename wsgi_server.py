@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+Встроенный WSGI-сервер AI Manager с пулом рабочих потоков.
+
+Принятые соединения попадают в ограниченную очередь и обрабатываются
+фиксированным числом потоков. Медленный запрос (например, /check_ip или
+проверка OTP в YubiCloud) занимает один поток и не блокирует остальные.
+Если очередь переполнена, соединение сразу получает 503.
+
+Приложению через environ['allmanagerc.sendfile'] доступна отправка диапазона
+файла системным вызовом sendfile — без чтения файла в пространство процесса.
+"""
+
+import queue
+import threading
+import time
+
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+DEFAULT_WORKERS = 16
+DEFAULT_QUEUE_SIZE = 64
+DEFAULT_KEEP_ALIVE_TIMEOUT = 2.0
+DEFAULT_IO_TIMEOUT = 30.0
+
+# Расширение environ: callable(file, offset, count) -> тело ответа, отправляемое через sendfile
+SENDFILE_ENVIRON_KEY = "allmanagerc.sendfile"
+
+_REJECT_BODY = b"Server is overloaded, retry later\n"
+_REJECT_RESPONSE = (
+    b"HTTP/1.1 503 Service Unavailable\r\n"
+    b"Content-Type: text/plain; charset=utf-8\r\n"
+    b"Content-Length: " + str(len(_REJECT_BODY)).encode() + b"\r\n"
+    b"Retry-After: 1\r\n"
+    b"Connection: close\r\n\r\n" + _REJECT_BODY
+)
+
+
+class SendfileBody:
+    """
+    Тело ответа из открытого файла. Пустой первый блок заставляет сервер отправить
+    статус и заголовки, после чего байты [offset, offset + count) уходят в сокет
+    через socket.sendfile (os.sendfile, где он есть). Файл закрывается в close().
+    """
+
+    def __init__(self, connection, file, offset, count):
+        self._connection = connection
+        self.file = file
+        self.offset = offset
+        self.count = count
+
+    def __iter__(self):
+        yield b""
+        if self.count > 0:
+            self._connection.sendfile(self.file, self.offset, self.count)
+
+    def close(self):
+        self.file.close()
+
+
+class PooledRequestHandler(WSGIRequestHandler):
+    """
+    Обработчик с keep-alive (HTTP/1.1). Короткий тайм-аут простоя (keep_alive_timeout)
+    действует только между запросами, пока ждём следующую строку запроса; чтение тела
+    и отправка ответа идут с обычным тайм-аутом ввода-вывода (timeout).
+    """
+
+    protocol_version = "HTTP/1.1"
+    keep_alive_timeout = None
+
+    def setup(self):
+        super().setup()
+        self._requests_served = 0
+
+    def handle_one_request(self):
+        if self._requests_served and not self._wait_for_next_request():
+            self.close_connection = True
+            return
+        super().handle_one_request()
+        self._requests_served += 1
+        # Не держим простаивающее соединение, если в очереди ждут другие клиенты
+        if self.server.queue_depth() > 0:
+            self.close_connection = True
+
+    def _wait_for_next_request(self):
+        """Ждёт первый байт следующего запроса не дольше keep_alive_timeout."""
+        if not self.keep_alive_timeout:
+            return True
+        self.connection.settimeout(self.keep_alive_timeout)
+        try:
+            return bool(self.rfile.peek(1))
+        except OSError:
+            # Тайм-аут простоя или разрыв — соединение просто закрывается
+            return False
+        finally:
+            self.connection.settimeout(self.timeout)
+
+    def make_environ(self):
+        environ = super().make_environ()
+        environ[SENDFILE_ENVIRON_KEY] = self._sendfile_body
+        return environ
+
+    def _sendfile_body(self, file, offset, count):
+        return SendfileBody(self.connection, file, offset, count)
+
+    def log_error(self, format, *args):
+        # Закрытие простаивающего keep-alive соединения по тайм-ауту — штатная ситуация
+        if format.startswith("Request timed out"):
+            return
+        super().log_error(format, *args)
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    """WSGI-сервер с фиксированным пулом потоков и ограниченной очередью соединений."""
+
+    multithread = True
+
+    def __init__(self, host, port, app, workers=DEFAULT_WORKERS, queue_size=DEFAULT_QUEUE_SIZE,
+                 keep_alive_timeout=DEFAULT_KEEP_ALIVE_TIMEOUT, io_timeout=DEFAULT_IO_TIMEOUT, handler=None):
+        self.workers = max(1, int(workers))
+        self.queue_size = max(1, int(queue_size))
+        self.keep_alive_timeout = float(keep_alive_timeout)
+        self.io_timeout = float(io_timeout)
+
+        self._queue = queue.Queue(maxsize=self.queue_size)
+        self._stats_lock = threading.Lock()
+        self._in_flight = 0
+        self._handled = 0
+        self._rejected = 0
+        self._peak_queue_depth = 0
+        self._peak_in_flight = 0
+        self._total_wait = 0.0
+        self._started_at = time.time()
+        self._threads = []
+
+        if handler is None:
+            # Отдельный подкласс, чтобы тайм-ауты не меняли общий класс обработчика
+            handler = type('PooledRequestHandler', (PooledRequestHandler,),
+                           {'timeout': self.io_timeout or None,
+                            'keep_alive_timeout': self.keep_alive_timeout or None})
+
+        super().__init__(host, port, app, handler=handler)
+
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker_loop, name=f'wsgi-worker-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    # --- Очередь и рабочие потоки ---
+    def process_request(self, request, client_address):
+        try:
+            self._queue.put_nowait((request, client_address, time.monotonic()))
+        except queue.Full:
+            with self._stats_lock:
+                self._rejected += 1
+            try:
+                request.sendall(_REJECT_RESPONSE)
+            except OSError:
+                pass
+            self.shutdown_request(request)
+            return
+        depth = self._queue.qsize()
+        with self._stats_lock:
+            self._peak_queue_depth = max(self._peak_queue_depth, depth)
+
+    def _worker_loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            request, client_address, enqueued_at = item
+            with self._stats_lock:
+                self._in_flight += 1
+                self._peak_in_flight = max(self._peak_in_flight, self._in_flight)
+                self._total_wait += time.monotonic() - enqueued_at
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+                with self._stats_lock:
+                    self._in_flight -= 1
+                    self._handled += 1
+
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def stats(self):
+        """Снимок метрик: глубина очереди, запросы в работе, отказы."""
+        with self._stats_lock:
+            handled = self._handled
+            return {
+                'workers': self.workers,
+                'queue_size': self.queue_size,
+                'keep_alive_timeout': self.keep_alive_timeout,
+                'io_timeout': self.io_timeout,
+                'queue_depth': self._queue.qsize(),
+                'peak_queue_depth': self._peak_queue_depth,
+                'in_flight': self._in_flight,
+                'peak_in_flight': self._peak_in_flight,
+                'handled': handled,
+                'rejected': self._rejected,
+                'avg_queue_wait_ms': round(self._total_wait / handled * 1000, 3) if handled else 0.0,
+                'uptime_seconds': round(time.time() - self._started_at, 1)
+            }
+
+    def server_close(self):
+        super().server_close()
+        # Останавливаем потоки; ожидающие соединения закрываются
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None:
+                self.shutdown_request(item[0])
+        for _ in self._threads:
+            try:
+                self._queue.put_nowait(None)
+            except queue.Full:
+                break
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Клиент протокола проверки OTP YubiCloud (validation protocol 2.0).
+
+- Подпись запроса и проверка подписи ответа (HMAC-SHA1, ключ — Secret Key в base64)
+- Проверка, что сервер вернул тот же otp и nonce
+- Общая HTTP-сессия с пулом соединений для всех Client ID
+- Адрес сервера проверки настраивается (можно поднять локальную заглушку YubiCloud)
+"""
+
+import base64
+import hashlib
+import hmac
+import secrets
+import threading
+from urllib.parse import urlencode
+
+DEFAULT_API_URLS = ('https://api.yubico.com/wsapi/2.0/verify',)
+DEFAULT_TIMEOUT = 5
+
+
+class YubiCloudError(Exception):
+    """Сетевая ошибка или некорректный ответ сервера проверки."""
+
+
+class YubiCloudSignatureError(YubiCloudError):
+    """Подпись ответа не совпала (неверный Secret Key или подмена ответа)."""
+
+
+def sign_params(params, secret_key):
+    """Подпись h: HMAC-SHA1 по параметрам, отсортированным по имени и склеенным через '&'."""
+    key = base64.b64decode(secret_key)
+    message = '&'.join(f"{k}={params[k]}" for k in sorted(params) if k != 'h')
+    digest = hmac.new(key, message.encode('utf-8'), hashlib.sha1).digest()
+    return base64.b64encode(digest).decode('ascii')
+
+
+def parse_response(text):
+    """Разбирает ответ вида key=value (по строке на пару)."""
+    result = {}
+    for line in text.splitlines():
+        line = line.strip()
+        if '=' in line:
+            key, value = line.split('=', 1)
+            result[key] = value
+    return result
+
+
+class YubiCloudClient:
+    def __init__(self, api_urls=None, timeout=DEFAULT_TIMEOUT, pool_size=8):
+        urls = [u.strip() for u in (api_urls or DEFAULT_API_URLS) if u and u.strip()]
+        self.api_urls = urls or list(DEFAULT_API_URLS)
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self._session = None
+        self._session_lock = threading.Lock()
+
+    def _get_session(self):
+        with self._session_lock:
+            if self._session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=len(self.api_urls), pool_maxsize=self.pool_size)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                self._session = session
+            return self._session
+
+    def verify(self, client_id, secret_key, otp):
+        """
+        Проверяет OTP от имени client_id. Возвращает статус сервера
+        ('OK', 'REPLAYED_OTP', 'BAD_OTP', ...). Бросает YubiCloudError.
+        """
+        import requests
+
+        nonce = secrets.token_hex(16)
+        params = {'id': str(client_id), 'otp': otp, 'nonce': nonce}
+        params['h'] = sign_params(params, secret_key)
+        query = urlencode(params)
+
+        last_error = None
+        for url in self.api_urls:
+            try:
+                response = self._get_session().get(f"{url}?{query}", timeout=self.timeout)
+            except requests.exceptions.Timeout as e:
+                last_error = YubiCloudError(f"timeout: {e}")
+                continue
+            except requests.exceptions.RequestException as e:
+                last_error = YubiCloudError(f"connection error: {e}")
+                continue
+            if response.status_code != 200:
+                last_error = YubiCloudError(f"HTTP {response.status_code}")
+                continue
+            return self._check_response(parse_response(response.text), otp, nonce, secret_key)
+        raise last_error or YubiCloudError("no validation servers configured")
+
+    @staticmethod
+    def _check_response(data, otp, nonce, secret_key):
+        status = data.get('status')
+        if not status:
+            raise YubiCloudError("response without status")
+        # Ответ NO_SUCH_CLIENT сервер не может подписать ключом клиента
+        if status == 'NO_SUCH_CLIENT':
+            return status
+        signature = data.get('h')
+        if not signature or not hmac.compare_digest(signature, sign_params(data, secret_key)):
+            raise YubiCloudSignatureError("response signature mismatch")
+        if status == 'OK' and (data.get('otp') != otp or data.get('nonce') != nonce):
+            raise YubiCloudError("response otp/nonce mismatch")
+        return status
@@ -1,73 +1,167 @@
 import json
 from pathlib import Path
 from flask import session, redirect, url_for, flash, request
-from yubico_client import Yubico
-from yubico_client.yubico_exceptions import YubicoError, InvalidClientIdError, SignatureVerificationError
+from yubicloud_client import YubiCloudClient, YubiCloudError, YubiCloudSignatureError
+from yubikey_otp import LocalOTPValidator, OTPValidationError, OTP_LENGTH
 from datetime import datetime
+import os
 import socket
+import threading
 import time
 import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-# Кэш результата онлайна, чтобы не дёргать сеть слишком часто
-_LAST_ONLINE_TS = 0.0
-_LAST_ONLINE_RESULT = False
-
-def check_internet_connection(timeout: float = 0.7, cache_ttl: float = 10.0, retries: int = 2) -> bool:
-    """Устойчивый и быстрый детектор онлайна.
-    Стратегия:
-    - Кэшируем результат на cache_ttl секунд, чтобы избежать миганий UI
-    - Прямой TCP (без DNS) к публичным адресам: 1.1.1.1:443, 8.8.8.8:443, 9.9.9.9:443
-    - DNS + TCP к api.yubico.com:443 (пробуем несколько A-записей)
-    - Онлайн, если (хотя бы один прямой TCP успешен) и (DNS разрешился и хотя бы одна попытка TCP к api.yubico.com успешна)
-      В качестве послабления: если прямой TCP успешен и DNS разрешился (но TCP к api.yubico.com не прошёл), считаем онлайн
-      чтобы избежать ложных оффлайнов при временных сбоях Yubico.
-    """
-    global _LAST_ONLINE_TS, _LAST_ONLINE_RESULT
-    now = time.time()
-    if now - _LAST_ONLINE_TS < cache_ttl:
-        return _LAST_ONLINE_RESULT
-
-    def try_connect(host_port_pairs):
-        for (h, p) in host_port_pairs:
-            for _ in range(max(1, retries)):
-                try:
-                    with socket.create_connection((h, p), timeout=timeout):
-                        return True
-                except Exception:
-                    continue
+DIRECT_PROBE_TARGETS = (("1.1.1.1", 443), ("8.8.8.8", 443), ("9.9.9.9", 443))
+YUBICO_API_HOST = "api.yubico.com"
+
+
+def _tcp_probe(host, port, timeout):
+    try:
+        with socket.create_connection((host, port), timeout=timeout):
+            return True
+    except Exception:
         return False
 
-    # 1) Прямой TCP к популярным DNS‑резолверам (без DNS)
-    direct_ok = try_connect([("1.1.1.1", 443), ("8.8.8.8", 443), ("9.9.9.9", 443)])
 
-    # 2) DNS + TCP к api.yubico.com (пробуем несколько IP)
-    yubico_tcp_ok = False
-    dns_ok = False
+def _dns_probe(host):
     try:
-        # Получаем несколько адресов
-        infos = socket.getaddrinfo("api.yubico.com", 443, proto=socket.IPPROTO_TCP)
-        targets = []
-        for info in infos:
-            addr = info[-1]
-            if isinstance(addr, tuple) and len(addr) >= 2:
-                targets.append((addr[0], 443))
-        dns_ok = len(targets) > 0
-        # Пробуем несколько IP
-        if targets:
-            yubico_tcp_ok = try_connect(targets[:3])
+        return bool(socket.getaddrinfo(host, 443, proto=socket.IPPROTO_TCP))
     except Exception:
-        dns_ok = False
-        yubico_tcp_ok = False
+        return False
+
 
-    result = (direct_ok and yubico_tcp_ok) or (direct_ok and dns_ok)
-    _LAST_ONLINE_TS, _LAST_ONLINE_RESULT = now, result
+def probe_connectivity(timeout: float = 0.7) -> bool:
+    """Параллельная проверка сети (в духе happy eyeballs).
+    Все прямые TCP-подключения (без DNS) к 1.1.1.1/8.8.8.8/9.9.9.9 и разрешение
+    имени api.yubico.com запускаются одновременно. Онлайн, если хотя бы один прямой
+    TCP успешен и DNS разрешился (TCP к самому Yubico не требуется, чтобы избежать
+    ложных оффлайнов при временных сбоях Yubico).
+    Итоговое время — не больше самого медленного пробника, а не их суммы.
+    """
+    executor = ThreadPoolExecutor(max_workers=len(DIRECT_PROBE_TARGETS) + 1,
+                                  thread_name_prefix='net-probe')
+    try:
+        direct = [executor.submit(_tcp_probe, h, p, timeout) for (h, p) in DIRECT_PROBE_TARGETS]
+        dns = executor.submit(_dns_probe, YUBICO_API_HOST)
+
+        # Достаточно первого успешного прямого подключения
+        direct_ok = False
+        for future in as_completed(direct):
+            if future.result():
+                direct_ok = True
+                break
+        dns_ok = dns.result()
+    finally:
+        executor.shutdown(wait=False)
+
+    result = direct_ok and dns_ok
     if not result:
         try:
-            print(f"🔌 Интернет офлайн/нестабилен: direct_ok={direct_ok}, dns_ok={dns_ok}, yubico_tcp_ok={yubico_tcp_ok}")
+            print(f"🔌 Интернет офлайн/нестабилен: direct_ok={direct_ok}, dns_ok={dns_ok}")
         except Exception:
             pass
     return result
 
+
+class ConnectivityMonitor:
+    """Фоновый монитор сети.
+
+    Поток периодически выполняет probe_connectivity() и хранит состояние
+    {online, since, checked_at}. Читатели получают его мгновенно, подписчики
+    вызываются при каждом переходе онлайн/офлайн.
+    """
+
+    def __init__(self, online_interval: float = 30.0, offline_interval: float = 5.0, timeout: float = 0.7):
+        self.online_interval = online_interval
+        self.offline_interval = offline_interval
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._ready = threading.Event()
+        self._thread = None
+        self._subscribers = []
+        self._state = {'online': False, 'since': None, 'checked_at': None}
+
+    def start(self):
+        """Запускает поток мониторинга (повторный вызов ничего не делает)."""
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name='connectivity-monitor', daemon=True)
+            self._thread.start()
+
+    def is_running(self) -> bool:
+        return bool(self._thread and self._thread.is_alive())
+
+    def refresh(self):
+        """Просит монитор выполнить проверку немедленно."""
+        self._wake.set()
+
+    def wait_ready(self, timeout=None) -> bool:
+        """Ждёт завершения первой проверки."""
+        return self._ready.wait(timeout)
+
+    def get_state(self) -> dict:
+        with self._lock:
+            return dict(self._state)
+
+    def is_online(self) -> bool:
+        with self._lock:
+            return self._state['online']
+
+    def subscribe(self, callback):
+        """callback(state) вызывается из потока монитора при смене состояния."""
+        with self._lock:
+            self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        with self._lock:
+            if callback in self._subscribers:
+                self._subscribers.remove(callback)
+
+    def check_now(self) -> dict:
+        """Выполняет проверку синхронно и обновляет состояние."""
+        online = probe_connectivity(self.timeout)
+        now = time.time()
+        with self._lock:
+            changed = self._state['online'] != online or self._state['since'] is None
+            if changed:
+                self._state['online'] = online
+                self._state['since'] = now
+            self._state['checked_at'] = now
+            state = dict(self._state)
+            subscribers = list(self._subscribers) if changed else []
+        self._ready.set()
+        for callback in subscribers:
+            try:
+                callback(state)
+            except Exception as e:
+                print(f"⚠️ Ошибка подписчика монитора сети: {e}")
+        return state
+
+    def _run(self):
+        while True:
+            state = self.check_now()
+            interval = self.online_interval if state['online'] else self.offline_interval
+            self._wake.wait(interval)
+            self._wake.clear()
+
+
+connectivity_monitor = ConnectivityMonitor()
+
+
+def check_internet_connection(timeout: float = 0.7, wait: float = 2.0) -> bool:
+    """Текущее состояние сети из фонового монитора (без сетевых запросов).
+    При первом вызове монитор запускается; ждём результат первой проверки
+    не дольше wait секунд, иначе считаем, что сети нет.
+    """
+    if not connectivity_monitor.is_running():
+        connectivity_monitor.timeout = timeout
+        connectivity_monitor.start()
+    if not connectivity_monitor.wait_ready(wait):
+        return False
+    return connectivity_monitor.is_online()
+
 class YubiKeyAuth:
     def __init__(self, app_data_dir, static_passwords=None):
         self.config_file = Path(app_data_dir) / 'yubikey_config.json'
@@ -82,6 +176,10 @@ class YubiKeyAuth:
         self.secret_login_attempts = 0
         self.secret_login_blocked_until = 0
         self.secret_login_block_duration = 30  # секунд
+        # Серверы проверки OTP (пусто — YubiCloud по умолчанию)
+        self.api_urls = []
+        # Ключи для локальной проверки OTP (AES-секрет и private id)
+        self.local_keys = []
 
         self.load_config()
         # Если заданы статические пароли, включаем защиту даже без онлайн-ключей
@@ -90,9 +188,12 @@ class YubiKeyAuth:
                 self.enabled = True
         except Exception:
             pass
+        # Адрес сервера проверки можно переопределить (например, локальной заглушкой YubiCloud)
+        env_urls = [u.strip() for u in (os.getenv('YUBIKEY_API_URL') or '').split(',') if u.strip()]
+        self.cloud_client = YubiCloudClient(env_urls or self.api_urls)
+        self._build_local_validator()
         # Загружаем разрешённые публичные ID из окружения
         try:
-            import os
             env_allowed = os.getenv('YUBIKEY_ALLOWED_PUBLIC_IDS')
             if env_allowed:
                 for it in env_allowed.split(','):
@@ -123,6 +224,12 @@ class YubiKeyAuth:
                         else:
                             # Новый формат (несколько ключей)
                             self.keys = config.get('keys', [])
+                            local_keys = config.get('local_keys') or []
+                            if isinstance(local_keys, list):
+                                self.local_keys = [k for k in local_keys if isinstance(k, dict)]
+                            api_urls = config.get('api_urls') or []
+                            if isinstance(api_urls, list):
+                                self.api_urls = [u for u in api_urls if isinstance(u, str) and u.strip()]
                             # Глобально заданный список разрешённых public id
                             try:
                                 top_allowed = config.get('allowed_public_ids') or []
@@ -178,6 +285,10 @@ class YubiKeyAuth:
                 'enabled': self.enabled,
                 'allowed_public_ids': sorted(list(self.allowed_public_ids)) if self.allowed_public_ids else []
             }
+            if self.api_urls:
+                config['api_urls'] = self.api_urls
+            if self.local_keys:
+                config['local_keys'] = self.local_keys
             
             with open(self.config_file, 'w', encoding='utf-8') as f:
                 json.dump(config, f, indent=2, ensure_ascii=False)
@@ -214,7 +325,7 @@ class YubiKeyAuth:
         """Удаляет YubiKey по индексу."""
         if 0 <= key_index < len(self.keys):
             removed_key = self.keys.pop(key_index)
-            if not self.keys:
+            if not self.has_keys():
                 self.enabled = False
             self.save_config()
             return removed_key
@@ -224,6 +335,50 @@ class YubiKeyAuth:
         """Возвращает список всех ключей."""
         return self.keys
 
+    def has_keys(self):
+        """Настроен ли хотя бы один ключ: YubiCloud или локальной (офлайн) проверки."""
+        return bool(self.keys or self.local_keys)
+
+    # ====== ЛОКАЛЬНЫЕ КЛЮЧИ: офлайн-проверка OTP ======
+    def _build_local_validator(self):
+        counters_path = str(self.app_data_dir / 'yubikey_counters.json')
+        self.local_validator = LocalOTPValidator(self.local_keys, counters_path)
+
+    def add_local_key(self, public_id, aes_key, private_id, name=None):
+        """Регистрирует ключ для локальной (офлайн) проверки OTP."""
+        public_id = (public_id or '').strip()
+        aes_key = (aes_key or '').strip().lower()
+        private_id = (private_id or '').strip().lower()
+        if not re.match(r'^[cbdefghijklnrtuv]{12}$', public_id):
+            raise ValueError("Public ID должен содержать 12 символов ModHex")
+        if not re.match(r'^[0-9a-f]{32}$', aes_key):
+            raise ValueError("AES-ключ должен содержать 32 hex-символа")
+        if not re.match(r'^[0-9a-f]{12}$', private_id):
+            raise ValueError("Private ID должен содержать 12 hex-символов")
+        self.local_keys = [k for k in self.local_keys if k.get('public_id') != public_id]
+        self.local_keys.append({
+            'public_id': public_id,
+            'aes_key': aes_key,
+            'private_id': private_id,
+            'name': name or f"Локальный ключ {len(self.local_keys) + 1}",
+            'created_at': datetime.now().isoformat()
+        })
+        self.enabled = True
+        self.save_config()
+        self._build_local_validator()
+
+    def remove_local_key(self, public_id):
+        """Удаляет ключ локальной проверки. Возвращает удалённую запись или None."""
+        removed = next((k for k in self.local_keys if k.get('public_id') == public_id), None)
+        if removed is None:
+            return None
+        self.local_keys = [k for k in self.local_keys if k.get('public_id') != public_id]
+        if not self.has_keys():
+            self.enabled = False
+        self.save_config()
+        self._build_local_validator()
+        return removed
+
     # ====== СЕКРЕТНЫЙ PIN: хранение и антибрут ======
     def _load_app_config(self):
         try:
@@ -351,6 +506,15 @@ class YubiKeyAuth:
         if not otp:
             return False, "OTP не может быть пустым"
 
+        # Ключ зарегистрирован для локальной проверки: сеть не нужна
+        if len(otp) == OTP_LENGTH and self.local_validator.has_key(otp[:12]):
+            try:
+                self.local_validator.verify(otp)
+            except OTPValidationError as e:
+                return False, str(e)
+            session['yubikey_authenticated'] = True
+            return True, "OTP подтвержден локально"
+
         online = check_internet_connection()
 
         # Онлайн-режим: принимаем только динамический OTP
@@ -378,72 +542,84 @@ class YubiKeyAuth:
                 'OPERATION_NOT_ALLOWED': "Операция OTP запрещена для вашего ключа."
             }
 
+            # Быстрая валидация формата Secret Key (base64)
+            import base64, binascii
+            candidates = []
             for key_data in self.keys:
+                client_id = key_data.get('client_id')
+                secret_key = key_data.get('secret_key')
+                if not client_id or not secret_key:
+                    continue
                 try:
-                    client_id = key_data.get('client_id')
-                    secret_key = key_data.get('secret_key')
-                    if not client_id or not secret_key:
-                        continue
-
-                    # Быстрая валидация формата Secret Key (base64)
-                    try:
-                        import base64, binascii
-                        base64.b64decode(str(secret_key).encode('ascii'), validate=True)
-                    except (binascii.Error, ValueError, UnicodeError):
-                        return False, "Secret Key в настройках некорректен (ожидается base64 из кабинета Yubico)"
-
-                    client = Yubico(client_id, secret_key)
-                    response = client.verify(otp, return_response=True)
-                    # Расширенная диагностика статуса ответа
-                    try:
-                        status = getattr(response, 'status', None)
-                    except Exception:
-                        status = None
-                    if status is None and isinstance(response, dict):
-                        status = response.get('status')
+                    base64.b64decode(str(secret_key).encode('ascii'), validate=True)
+                except (binascii.Error, ValueError, UnicodeError):
+                    return False, "Secret Key в настройках некорректен (ожидается base64 из кабинета Yubico)"
+                candidates.append((client_id, secret_key))
+
+            if not candidates:
+                return False, "Неверный онлайн OTP"
+
+            # Проверяем OTP всеми Client ID параллельно: побеждает первый успешный ответ
+            outcomes = [None] * len(candidates)
+            status = None
+            executor = ThreadPoolExecutor(max_workers=len(candidates), thread_name_prefix='yubicloud')
+            try:
+                futures = {executor.submit(self.cloud_client.verify, cid, secret, otp): idx
+                           for idx, (cid, secret) in enumerate(candidates)}
+                for future in as_completed(futures):
                     try:
-                        print(f"🧪 Yubico response: {getattr(response, 'status', None)} | raw={response}")
-                    except Exception:
-                        pass
+                        outcomes[futures[future]] = future.result()
+                    except YubiCloudError as e:
+                        outcomes[futures[future]] = e
+                    if outcomes[futures[future]] == 'OK':
+                        status = 'OK'
+                        break
+            finally:
+                # Остальные ответы больше не нужны — не ждём их
+                executor.shutdown(wait=False, cancel_futures=True)
+
+            try:
+                print(f"🧪 Yubico responses: {outcomes}")
+            except Exception:
+                pass
 
-                    if status == 'OK':
-                        # Проверка привязки к устройству по публичному ID (первые 12 modhex символов)
+            if status == 'OK':
+                # Проверка привязки к устройству по публичному ID (первые 12 modhex символов)
+                try:
+                    public_id = str(otp)[:12]
+                except Exception:
+                    public_id = None
+                if self.allowed_public_ids:
+                    if not public_id or public_id not in self.allowed_public_ids:
+                        return False, "OTP от непозволенного ключа (public id не в списке разрешённых)"
+                else:
+                    # Если список не задан — авто-привязка к первому успешному public id
+                    if public_id and len(public_id) == 12:
+                        self.allowed_public_ids.add(public_id)
                         try:
-                            public_id = str(otp)[:12]
+                            self.save_config()
+                            print(f"🔒 Автопривязка к ключу: {public_id}")
                         except Exception:
-                            public_id = None
-                        if self.allowed_public_ids:
-                            if not public_id or public_id not in self.allowed_public_ids:
-                                return False, "OTP от непозволенного ключа (public id не в списке разрешённых)"
-                        else:
-                            # Если список не задан — авто-привязка к первому успешному public id
-                            if public_id and len(public_id) == 12:
-                                self.allowed_public_ids.add(public_id)
-                                try:
-                                    self.save_config()
-                                    print(f"🔒 Автопривязка к ключу: {public_id}")
-                                except Exception:
-                                    pass
-                        session['yubikey_authenticated'] = True
-                        return True, "Онлайн-пароль подтвержден"
-
-                    if status:
-                        human_message = status_to_message.get(status, f"Ошибка Yubico: {status}")
-                        return False, human_message
-
-                    return False, "Не удалось подтвердить OTP (нет статуса ответа). Проверьте Client ID/Secret Key и повторите."
-                except InvalidClientIdError:
-                    return False, "Неверный Client ID."
-                except SignatureVerificationError:
-                    return False, "Неверный Secret Key."
-                except YubicoError as e:
-                    msg = str(e) or "YubicoError"
-                    lower_msg = msg.lower()
-                    if 'timeout' in lower_msg or 'timed out' in lower_msg:
-                        return False, "Тайм-аут соединения с YubiCloud."
-                    if 'network' in lower_msg or 'connection' in lower_msg:
-                        return False, "Нет связи с YubiCloud."
-                    return False, f"Ошибка Yubico: {msg}"
+                            pass
+                session['yubikey_authenticated'] = True
+                return True, "Онлайн-пароль подтвержден"
+
+            # Все ключи отказали: важнее ответ сервера для «своего» Client ID
+            # (например, REPLAYED_OTP), чем NO_SUCH_CLIENT или ошибки остальных ключей
+            outcome = next((o for o in outcomes if isinstance(o, str) and o != 'NO_SUCH_CLIENT'),
+                           next((o for o in outcomes if o is not None), None))
+            if isinstance(outcome, YubiCloudSignatureError):
+                return False, "Неверный Secret Key."
+            if isinstance(outcome, YubiCloudError):
+                msg = str(outcome) or "YubiCloudError"
+                lower_msg = msg.lower()
+                if 'timeout' in lower_msg or 'timed out' in lower_msg:
+                    return False, "Тайм-аут соединения с YubiCloud."
+                if 'network' in lower_msg or 'connection' in lower_msg:
+                    return False, "Нет связи с YubiCloud."
+                return False, f"Ошибка Yubico: {msg}"
+            if outcome:
+                return False, status_to_message.get(outcome, f"Ошибка Yubico: {outcome}")
 
             return False, "Неверный онлайн OTP"
 
@@ -471,8 +647,8 @@ class YubiKeyAuth:
 
             # Если ключи ещё не заданы — разрешаем только настройки/мастер
             try:
-                if len(self.get_keys()) == 0:
-                    if endpoint in ('settings_page', 'yubikey_setup', 'static'):
+                if not self.has_keys():
+                    if endpoint in ('settings_page', 'yubikey_setup', 'yubikey_add_local_key', 'static'):
                         return f(*args, **kwargs)
                     # Убираем флаг аутентификации, чтобы исключить доступ по старой сессии
                     try:
@@ -498,67 +674,9 @@ def init_yubikey_auth(app_data_dir):
     try:
         print(f"🔧 Инициализация YubiKey в директории: {app_data_dir}")
         
-        # Загружаем статические пароли из переменных окружения
-        import os
-        import sys
-        from dotenv import load_dotenv
-        
-        # Улучшенная загрузка .env файла для работы в дистрибутиве
-        def load_env_file():
-            """Загружает .env файл из различных возможных мест."""
-            from pathlib import Path
-            
-            # Список возможных путей к .env файлу
-            possible_paths = []
-            
-            # 1. Текущая директория (для разработки)
-            possible_paths.append(Path.cwd() / ".env")
-            
-            # 2. Директория приложения (для дистрибутива)
-            if getattr(sys, 'frozen', False):
-                # Если приложение запаковано
-                if sys.platform == 'darwin':  # macOS
-                    # В .app бандле
-                    app_bundle = Path(sys.executable).parent.parent.parent
-                    possible_paths.append(app_bundle / "Contents" / "Resources" / ".env")
-                    
-                    # В пользовательской директории
-                    user_env = Path.home() / "Library" / "Application Support" / "AllManagerC" / ".env"
-                    possible_paths.append(user_env)
-                    
-                    # В директории приложения
-                    app_dir = Path(sys.executable).parent
-                    possible_paths.append(app_dir / ".env")
-                elif sys.platform == 'win32':
-                    from pathlib import Path as _P
-                    possible_paths.append(_P(os.environ.get('APPDATA', str(Path.home()))) / 'AllManagerC' / '.env')
-                    possible_paths.append(Path(sys.executable).parent / '.env')
-                else:
-                    possible_paths.append(Path.home() / '.local' / 'share' / 'AllManagerC' / '.env')
-                    possible_paths.append(Path(sys.executable).parent / '.env')
-            
-            # 3. Директория скрипта
-            script_dir = Path(__file__).parent
-            possible_paths.append(script_dir / ".env")
-            
-            # 4. Родительская директория
-            parent_dir = Path(__file__).parent.parent
-            possible_paths.append(parent_dir / ".env")
-            
-            # Пытаемся загрузить .env из каждого возможного места
-            for env_path in possible_paths:
-                if env_path.exists():
-                    print(f"📁 [yubikey_auth] Найден .env файл: {env_path}")
-                    load_dotenv(env_path)
-                    return True
-            
-            print(f"❌ [yubikey_auth] .env файл не найден в следующих местах:")
-            for path in possible_paths:
-                print(f"   - {path} {'✅' if path.exists() else '❌'}")
-            return False
-        
-        # Загружаем .env файл
-        load_env_file()
+        # Загружаем .env (общий поиск путей; повторный вызов ничего не делает)
+        import bootstrap
+        bootstrap.load_env()
         static_passwords_str = os.getenv('YUBIKEY_STATIC_PASSWORDS')
         static_passwords = []
         if static_passwords_str:
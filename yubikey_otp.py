@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Локальная проверка YubiKey OTP (режим Yubico OTP) без обращения к YubiCloud.
+
+OTP из 44 символов ModHex: 12 символов публичного ID и 32 символа токена.
+Токен — 16 байт, зашифрованных AES-128 (ECB) секретом ключа:
+
+    private id (6) | use counter (2, LE) | timestamp (3, LE) |
+    session counter (1) | random (2) | CRC16 (2, LE)
+
+CRC16 (ISO 13239) по всем 16 байтам даёт остаток 0xF0B8. Повтор защищается
+монотонностью пары (use counter, session counter), которая сохраняется на диск.
+"""
+
+import json
+import os
+import secrets
+import threading
+
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
+MODHEX_ALPHABET = 'cbdefghijklnrtuv'
+_MODHEX_DECODE = {c: i for i, c in enumerate(MODHEX_ALPHABET)}
+CRC_OK_RESIDUAL = 0xF0B8
+PUBLIC_ID_LENGTH = 12
+OTP_LENGTH = 44
+
+
+class OTPValidationError(Exception):
+    """OTP не прошёл локальную проверку."""
+
+
+def modhex_decode(value):
+    if len(value) % 2:
+        raise OTPValidationError("Нечётная длина ModHex")
+    try:
+        return bytes((_MODHEX_DECODE[value[i]] << 4) | _MODHEX_DECODE[value[i + 1]]
+                     for i in range(0, len(value), 2))
+    except KeyError:
+        raise OTPValidationError("Недопустимый символ ModHex")
+
+
+def modhex_encode(data):
+    return ''.join(MODHEX_ALPHABET[b >> 4] + MODHEX_ALPHABET[b & 0x0F] for b in data)
+
+
+def crc16(data):
+    """CRC16 ISO 13239 (полином 0x8408, начальное значение 0xFFFF)."""
+    crc = 0xFFFF
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0x8408 if crc & 1 else crc >> 1
+    return crc
+
+
+def _aes(key, data, decrypt):
+    cipher = Cipher(algorithms.AES(key), modes.ECB())
+    ctx = cipher.decryptor() if decrypt else cipher.encryptor()
+    return ctx.update(data) + ctx.finalize()
+
+
+def decode_token(otp, aes_key_hex):
+    """Расшифровывает токен OTP и возвращает его поля (после проверки CRC)."""
+    if len(otp) != OTP_LENGTH:
+        raise OTPValidationError("OTP должен содержать 44 символа ModHex")
+    plain = _aes(bytes.fromhex(aes_key_hex), modhex_decode(otp[PUBLIC_ID_LENGTH:]), decrypt=True)
+    if crc16(plain) != CRC_OK_RESIDUAL:
+        raise OTPValidationError("Неверная контрольная сумма (чужой ключ или искажённый OTP)")
+    return {
+        'private_id': plain[0:6].hex(),
+        'use_counter': int.from_bytes(plain[6:8], 'little'),
+        'timestamp': int.from_bytes(plain[8:11], 'little'),
+        'session_counter': plain[11],
+    }
+
+
+def generate_otp(public_id, aes_key_hex, private_id_hex, use_counter, session_counter, timestamp=0):
+    """Формирует корректный OTP (для тестов и замеров)."""
+    body = (bytes.fromhex(private_id_hex)
+            + int(use_counter).to_bytes(2, 'little')
+            + int(timestamp).to_bytes(3, 'little')
+            + bytes([int(session_counter) & 0xFF])
+            + secrets.token_bytes(2))
+    body += (~crc16(body) & 0xFFFF).to_bytes(2, 'little')
+    return public_id + modhex_encode(_aes(bytes.fromhex(aes_key_hex), body, decrypt=False))
+
+
+class LocalOTPValidator:
+    """
+    Проверяет OTP по локально сохранённым секретам ключей.
+
+    keys — список словарей {public_id, aes_key (32 hex), private_id (12 hex), name}.
+    Последние принятые счётчики хранятся в counters_path.
+    """
+
+    def __init__(self, keys, counters_path):
+        self.counters_path = counters_path
+        self._lock = threading.Lock()
+        self._keys = {}
+        for key in keys or []:
+            public_id = str(key.get('public_id') or '').strip()
+            if len(public_id) == PUBLIC_ID_LENGTH and key.get('aes_key') and key.get('private_id'):
+                self._keys[public_id] = key
+        self._counters = self._load_counters()
+
+    def _load_counters(self):
+        try:
+            with open(self.counters_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            return data if isinstance(data, dict) else {}
+        except (OSError, json.JSONDecodeError):
+            return {}
+
+    def _save_counters(self):
+        """Атомарная запись: временный файл, fsync, замена."""
+        os.makedirs(os.path.dirname(self.counters_path) or '.', exist_ok=True)
+        tmp_path = f"{self.counters_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._counters, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.counters_path)
+
+    def has_key(self, public_id):
+        return public_id in self._keys
+
+    def __bool__(self):
+        return bool(self._keys)
+
+    def verify(self, otp):
+        """Возвращает public id при успехе, иначе бросает OTPValidationError."""
+        public_id = otp[:PUBLIC_ID_LENGTH]
+        key = self._keys.get(public_id)
+        if key is None:
+            raise OTPValidationError("Ключ не зарегистрирован для локальной проверки")
+        try:
+            token = decode_token(otp, key['aes_key'])
+        except ValueError:
+            raise OTPValidationError("Некорректный AES-ключ в настройках")
+        if token['private_id'] != str(key['private_id']).lower():
+            raise OTPValidationError("Неверный private id")
+
+        counter = (token['use_counter'], token['session_counter'])
+        with self._lock:
+            last = tuple(self._counters.get(public_id, (-1, -1)))
+            if counter <= last:
+                raise OTPValidationError("Код уже был использован")
+            self._counters[public_id] = list(counter)
+            try:
+                self._save_counters()
+            except OSError as e:
+                # Без сохранения счётчика OTP можно будет повторить после перезапуска
+                self._counters[public_id] = list(last)
+                raise OTPValidationError(f"Не удалось сохранить счётчики: {e}")
+        return public_id
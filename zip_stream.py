@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Потоковая сборка ZIP-архивов для AI Manager.
+
+Архив формируется прямо в тело HTTP-ответа: zipfile пишет в несмещаемый
+приёмник, а генератор отдаёт накопленные байты после каждого блока.
+Уже сжатые форматы (изображения, PDF, архивы) сохраняются без повторного
+сжатия, небольшие файлы читаются заранее в пуле потоков.
+"""
+
+import io
+import os
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+# Расширения, которые уже сжаты: deflate их почти не уменьшает, но тратит CPU
+STORED_EXTENSIONS = {
+    'png', 'jpg', 'jpeg', 'gif', 'webp', 'ico', 'pdf',
+    'zip', 'gz', 'tgz', 'bz2', 'xz', '7z', 'rar', 'mp3', 'mp4', 'docx', 'xlsx'
+}
+
+CHUNK_SIZE = 64 * 1024
+# Файлы меньше этого размера читаются целиком в пуле потоков, большие — потоково
+PREFETCH_LIMIT = 1024 * 1024
+
+
+class _StreamSink(io.RawIOBase):
+    """Несмещаемый приёмник: копит записанные байты до следующего drain()."""
+
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def compress_type_for(arcname):
+    """ZIP_STORED для уже сжатых форматов, ZIP_DEFLATED для остальных."""
+    ext = arcname.rsplit('.', 1)[-1].lower() if '.' in arcname else ''
+    return zipfile.ZIP_STORED if ext in STORED_EXTENSIONS else zipfile.ZIP_DEFLATED
+
+
+def _zipinfo(arcname, size, mtime=None):
+    date_time = datetime.fromtimestamp(mtime) if mtime else datetime.now()
+    zinfo = zipfile.ZipInfo(arcname, date_time=date_time.timetuple()[:6])
+    zinfo.compress_type = compress_type_for(arcname)
+    zinfo.file_size = size
+    zinfo.external_attr = 0o600 << 16
+    return zinfo
+
+
+def _read_small(opener):
+    with opener() as f:
+        return f.read()
+
+
+def stream_zip(entries, max_workers=4, chunk_size=CHUNK_SIZE):
+    """
+    Генератор байтов ZIP-архива.
+
+    entries — итерируемое пар (имя в архиве, источник), где источник — путь
+    к файлу (str/Path), bytes или объект с атрибутами size, mtime и методом open()
+    (например, расшифровывающий блоб). Файлы, исчезнувшие во время сборки, пропускаются.
+    """
+    sink = _StreamSink()
+    executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='zip-read')
+    pending = deque()
+    window = max_workers * 2
+    entries = iter(entries)
+
+    def schedule():
+        # Держим впереди до `window` записей; мелкие файлы уже читаются в пуле
+        while len(pending) < window:
+            try:
+                arcname, source = next(entries)
+            except StopIteration:
+                return
+            if isinstance(source, (bytes, bytearray)):
+                pending.append((arcname, None, bytes(source), None))
+                continue
+            if hasattr(source, 'open') and hasattr(source, 'size'):
+                opener, size, mtime = source.open, source.size, getattr(source, 'mtime', None)
+            else:
+                path = os.fspath(source)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                opener, size, mtime = (lambda p=path: open(p, 'rb')), st.st_size, st.st_mtime
+            future = executor.submit(_read_small, opener) if size <= PREFETCH_LIMIT else None
+            pending.append((arcname, opener, future, (size, mtime)))
+
+    try:
+        with zipfile.ZipFile(sink, 'w', allowZip64=True) as zf:
+            schedule()
+            while pending:
+                arcname, opener, payload, meta = pending.popleft()
+                schedule()
+
+                if opener is None:
+                    zf.writestr(_zipinfo(arcname, len(payload)), payload)
+                elif payload is not None:
+                    try:
+                        data = payload.result()
+                    except (OSError, ValueError):
+                        continue
+                    zf.writestr(_zipinfo(arcname, len(data), meta[1]), data)
+                else:
+                    try:
+                        src = opener()
+                    except (OSError, ValueError):
+                        continue
+                    with src, zf.open(_zipinfo(arcname, meta[0], meta[1]), 'w') as dst:
+                        while True:
+                            block = src.read(chunk_size)
+                            if not block:
+                                break
+                            dst.write(block)
+                            data = sink.drain()
+                            if data:
+                                yield data
+
+                data = sink.drain()
+                if data:
+                    yield data
+
+        # Центральный каталог записывается при закрытии архива
+        data = sink.drain()
+        if data:
+            yield data
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)